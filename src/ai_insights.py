@@ -1,35 +1,304 @@
-import openai
+import hashlib
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
-def generate_ai_insights(orders, inventory_df):
+# ECOMMERCE_AI_PROVIDER=openai (default) or local (offline stand-in, no network or API key)
+AI_PROVIDER = os.getenv("ECOMMERCE_AI_PROVIDER", "openai")
+# Seconds per provider call, and how many times a failed call is retried
+AI_TIMEOUT = float(os.getenv("ECOMMERCE_AI_TIMEOUT", "30"))
+AI_RETRIES = int(os.getenv("ECOMMERCE_AI_RETRIES", "2"))
+AI_CACHE_SIZE = int(os.getenv("ECOMMERCE_AI_CACHE_SIZE", "128"))
+AI_CACHE_TTL = float(os.getenv("ECOMMERCE_AI_CACHE_TTL", "3600"))
+AI_WORKERS = int(os.getenv("ECOMMERCE_AI_WORKERS", "2"))
+# Seconds, retries included, after which a request fails even if its provider call never returns
+AI_DEADLINE = float(os.getenv("ECOMMERCE_AI_DEADLINE", "100"))
+
+PROMPT_TEMPLATE = """
+We have total sales of ${total_sales}.
+The most popular item is: {most_popular}.
+Please provide a concise strategy to increase overall sales.
+    """
+
+
+class InsightsError(Exception):
+    """
+    The provider could not produce insights (missing key, API error, timeout).
+    """
+
+
+class OpenAIProvider:
+    """
+    Chat completion call with a chat-based model (e.g. gpt-3.5-turbo), through
+    the openai>=1.0 client.
+    """
+
+    name = "openai"
+
+    def __init__(self, model="gpt-3.5-turbo", max_tokens=100, temperature=0.7):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self._client = None
+
+    def client(self):
+        # Imported here so the local provider works without the openai package
+        from openai import OpenAI
+
+        if self._client is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                raise InsightsError("The OPENAI_API_KEY environment variable is not set.")
+            # InsightsService does the retrying
+            self._client = OpenAI(api_key=api_key, max_retries=0)
+        return self._client
+
+    def complete(self, prompt, timeout):
+        response = self.client().chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            timeout=timeout
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    def cache_tag(self):
+        return [self.name, self.model, self.max_tokens, self.temperature]
+
+
+class LocalProvider:
     """
-    Generates an AI-based summary of sales & popular items using the ChatCompletion endpoint.
+    Offline stand-in for the model: a canned strategy built from the prompt,
+    after `latency` seconds. Lets the page, the cache and benchmarks run without
+    network access or an API key.
     """
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    if not openai.api_key:
-        return "Error: The OPENAI_API_KEY environment variable is not set."
 
-    total_sales = sum(o["total_cost"] for o in orders)
+    name = "local"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def complete(self, prompt, timeout):
+        self.calls += 1
+        if self.latency:
+            time.sleep(min(self.latency, timeout))
+            if self.latency > timeout:
+                raise TimeoutError(f"local provider took longer than {timeout} s")
+        facts = " ".join(line.strip() for line in prompt.strip().splitlines()[:2])
+        return (f"{facts} Feature the most popular item on the home page, bundle it with "
+                f"slower-selling products, and follow up with past customers with a time-limited offer.")
+
+    def cache_tag(self):
+        return [self.name]
+
+
+def get_provider(name=AI_PROVIDER):
+    if name == "openai":
+        return OpenAIProvider()
+    if name == "local":
+        return LocalProvider()
+    raise ValueError(f"Unknown AI provider: {name!r} (expected 'openai' or 'local')")
+
+
+def insight_inputs(inventory_df, total_sales):
+    """
+    What the prompt is built from. `total_sales` comes from the caller (the
+    sales rollups), and the most popular product is one idxmax, not a sort.
+    """
     if not inventory_df.empty:
-        most_popular = inventory_df.sort_values(by="popularity", ascending=False).iloc[0]["name"]
+        most_popular = inventory_df.at[inventory_df["popularity"].idxmax(), "name"]
     else:
         most_popular = "No products"
+    return {"total_sales": total_sales, "most_popular": str(most_popular)}
 
-    prompt = f"""
-We have total sales of ${total_sales}.
-The most popular item is: {most_popular}.
-Please provide a concise strategy to increase overall sales.
+
+class InsightsService:
+    """
+    Runs provider calls on a small thread pool so the Streamlit script thread
+    never waits on the network, and shares the answers between sessions:
+
+    - responses are cached by a hash of the prompt inputs (and provider settings),
+      for `ttl` seconds, LRU-evicted past `maxsize` entries; errors aren't cached
+    - identical requests made while one is in flight share its Future
+    - each call gets `timeout` seconds and is retried `retries` times, with backoff
+    - the Future a request gets fails with InsightsError after `deadline` seconds
+      whatever the provider does; a late answer is still cached
     """
 
+    def __init__(self, provider=None, maxsize=AI_CACHE_SIZE, ttl=AI_CACHE_TTL, timeout=AI_TIMEOUT,
+                 retries=AI_RETRIES, workers=AI_WORKERS, backoff=0.5, deadline=AI_DEADLINE):
+        self.provider = provider or get_provider()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timeout = timeout
+        self.retries = retries
+        self.deadline = deadline
+        self.backoff = backoff
+        self.entries = OrderedDict()  # key -> (expires_at, text)
+        self.inflight = {}            # key -> Future
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-insights")
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self.evictions = 0
+        self.calls = 0
+        self.failures = 0
+        self.expired = 0
+
+    def key(self, inputs):
+        payload = json.dumps([self.provider.cache_tag(), inputs], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def cached(self, key):
+        with self.lock:
+            return self._cached(key)
+
+    def _cached(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def submit(self, inputs):
+        """
+        Returns (key, Future) for the insights text. The Future is already done
+        on a cache hit; an InsightsError comes out of result() if every attempt failed.
+        """
+        key = self.key(inputs)
+        with self.lock:
+            text = self._cached(key)
+            if text is not None:
+                self.hits += 1
+                future = Future()
+                future.set_result(text)
+                return key, future
+            future = self.inflight.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                return key, future
+            self.misses += 1
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self.inflight[key] = future
+        timer = threading.Timer(self.deadline, self._expire, (key, future))
+        timer.daemon = True
+        timer.start()
+        work = self.pool.submit(self._run, key, PROMPT_TEMPLATE.format(**inputs))
+        work.add_done_callback(lambda done: (timer.cancel(), self._settle(key, future, done)))
+        return key, future
+
+    def _settle(self, key, future, done=None, error=None):
+        # Completes the request's Future with the worker's outcome (or `error`),
+        # unless the deadline or the worker got there first
+        with self.lock:
+            if future.done():
+                return False
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+            if done is not None:
+                error = done.exception()
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(done.result())
+            return True
+
+    def _expire(self, key, future):
+        error = InsightsError(f"No answer from the {self.provider.name} provider within {self.deadline:g} s")
+        if self._settle(key, future, error=error):
+            with self.lock:
+                self.expired += 1
+                self.failures += 1
+
+    def _run(self, key, prompt):
+        try:
+            error = None
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+                with self.lock:
+                    self.calls += 1
+                try:
+                    text = self.provider.complete(prompt, self.timeout)
+                except InsightsError:
+                    # A configuration problem; retrying won't help
+                    raise
+                except Exception as e:
+                    error = e
+                    continue
+                self._put(key, text)
+                return text
+            raise InsightsError(f"Error calling the {self.provider.name} provider: {error}")
+        except InsightsError:
+            with self.lock:
+                self.failures += 1
+            raise
+
+    def _put(self, key, text):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses + self.deduplicated
+            return {
+                "provider": self.provider.name,
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "in_flight": len(self.inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "deduplicated": self.deduplicated,
+                "evictions": self.evictions,
+                "provider_calls": self.calls,
+                "failures": self.failures,
+                "expired": self.expired,
+                "hit_rate": (self.hits + self.deduplicated) / lookups if lookups else 0.0,
+            }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_insights_service():
+    """
+    The process-wide InsightsService (shared by every Streamlit session).
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = InsightsService()
+        return _service
+
+
+def generate_ai_insights(orders, inventory_df, total_sales=None):
+    """
+    Generates an AI-based summary of sales & popular items, waiting for the answer.
+    total_sales: optional precomputed total (e.g. from sales_rollups) instead of summing `orders`.
+    Pages should rather submit() to get_insights_service() and poll the Future.
+    """
+    if total_sales is None:
+        total_sales = sum(o["total_cost"] for o in orders)
+    _, future = get_insights_service().submit(insight_inputs(inventory_df, total_sales))
     try:
-        # Use ChatCompletion with a chat-based model (e.g. gpt-3.5-turbo)
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=100,
-            temperature=0.7
-        )
-        # The AI response is in response["choices"][0]["message"]["content"]
-        return response["choices"][0]["message"]["content"].strip()
-    except Exception as e:
-        return f"Error calling OpenAI API: {str(e)}"
+        return future.result()
+    except InsightsError as e:
+        return f"Error: {e}"
@@ -0,0 +1,127 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from order import OrderBook
+
+LINE_COLUMNS = ["order_id", "customer_id", "product_id", "quantity"]
+
+
+def explode_orders(orders):
+    """
+    One row per order line: [order_id, customer_id, product_id, quantity].
+    """
+    if not orders:
+        return pd.DataFrame({col: pd.Series(dtype="int64") for col in LINE_COLUMNS})
+    if isinstance(orders, OrderBook):
+        # Straight from the line arrays, no per-order Python objects
+        line_orders = orders.line_orders()
+        customers = np.array(orders.customers, dtype=object)
+        return pd.DataFrame({
+            "order_id": orders.order_id[line_orders],
+            "customer_id": customers[orders.customer[line_orders]].tolist(),
+            "product_id": orders.product_id.astype("int64"),
+            "quantity": orders.qty.astype("int64"),
+        })
+    lines = pd.DataFrame(orders, columns=["order_id", "customer_id", "items"]).explode("items", ignore_index=True)
+    lines = lines.dropna(subset=["items"])
+    items = pd.DataFrame(lines["items"].tolist(), columns=["product_id", "quantity"], index=lines.index)
+    return pd.concat([lines[["order_id", "customer_id"]], items], axis=1).astype(
+        {"order_id": "int64", "product_id": "int64", "quantity": "int64"})
+
+
+def enrich_order_lines(lines, inventory_df):
+    """
+    Joins order lines with the current product name/price (left join on product id).
+    Products no longer in the inventory show up as "Unknown" with price 0.
+    """
+    products = inventory_df[["id", "name", "price"]].rename(
+        columns={"id": "product_id", "name": "product_name"})
+    df = lines.merge(products, on="product_id", how="left")
+    df["product_name"] = df["product_name"].fillna("Unknown")
+    df["price"] = df["price"].fillna(0.0).astype(float)
+    df["subtotal"] = df["price"] * df["quantity"]
+    return df[["order_id", "customer_id", "product_id", "product_name", "quantity", "price", "subtotal"]]
+
+
+def build_order_lines(orders, inventory_df):
+    return enrich_order_lines(explode_orders(orders), inventory_df)
+
+
+class OrderLinesTable:
+    """
+    Order-lines fact table shared by the Analytics charts and the sales report.
+
+    Built once with a single explode + merge, then kept current: add_order()
+    queues the new lines (O(items)), only those lines are joined on the next
+    table() call, and the full join is redone only when product names or
+    prices change. Safe to share between threads: checkout adds while sessions read.
+    """
+
+    def __init__(self, orders=()):
+        self._lines = explode_orders(orders if isinstance(orders, OrderBook) else list(orders))
+        self._pending = []
+        self._table = None
+        self._table_key = None
+        self._products_hash = None
+        self._lock = threading.RLock()
+
+    def add_order(self, order):
+        lines = [(order["order_id"], order["customer_id"], pid, qty) for pid, qty in order["items"]]
+        with self._lock:
+            self._pending.extend(lines)
+
+    @property
+    def lines(self):
+        with self._lock:
+            if self._pending:
+                pending, self._pending = self._pending, []
+                pending = pd.DataFrame(pending, columns=LINE_COLUMNS).astype(
+                    {"order_id": "int64", "product_id": "int64", "quantity": "int64"})
+                self._lines = pd.concat([self._lines, pending], ignore_index=True)
+            return self._lines
+
+    def __len__(self):
+        with self._lock:
+            return len(self._lines) + len(self._pending)
+
+    def table(self, inventory_df, inventory_version=None):
+        """
+        The enriched table (name, price, subtotal per line) for `inventory_df`.
+        With an unchanged inventory version only newly added lines are joined;
+        without a version it is rebuilt on every call.
+        """
+        with self._lock:
+            return self._build_table(inventory_df, inventory_version)
+
+    def _build_table(self, inventory_df, inventory_version):
+        lines = self.lines
+        if inventory_version is not None and inventory_version != self._table_key:
+            # Product edits may change only stock; names and prices are all the
+            # join uses, so compare those before throwing the table away
+            products_hash = int(pd.util.hash_pandas_object(
+                inventory_df[["id", "name", "price"]], index=False).sum())
+            if products_hash != self._products_hash:
+                self._table = None
+            self._products_hash = products_hash
+            self._table_key = inventory_version
+
+        if self._table is None or inventory_version is None:
+            self._table = enrich_order_lines(lines, inventory_df)
+        elif len(self._table) < len(lines):
+            new_lines = enrich_order_lines(lines.iloc[len(self._table):], inventory_df)
+            self._table = pd.concat([self._table, new_lines], ignore_index=True)
+        return self._table
+
+
+def sold_counts(order_lines, product_ids):
+    """
+    Units sold per product, aligned with `product_ids` (0 for unsold products).
+    """
+    sold = order_lines.groupby("product_id")["quantity"].sum()
+    return sold.reindex(product_ids, fill_value=0)
+
+
+def product_sales(order_lines, by="product_name"):
+    return order_lines.groupby(by)["subtotal"].sum()
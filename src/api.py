@@ -0,0 +1,444 @@
+"""
+HTTP/JSON API over service.ShopService, on a plain asyncio server (no web
+framework needed). The event loop only parses requests and writes responses;
+each service call runs on a bounded thread pool, so many connections are
+served at once while the shared DataStore keeps its own locking.
+
+    python src/api.py [--host 127.0.0.1] [--port 8000] [--workers 8]
+
+    GET  /health
+    POST /customers                          {"customer_id": "cust001"}  (log in / sign up)
+    GET  /customers/<id>/orders
+    GET  /products?q=<search>&limit=<n, 0 for all>
+    GET  /products/<id>
+    GET  /carts/<customer>/<order_num>
+    POST /carts/<customer>/<order_num>/items  {"product_id": 1, "qty": 2}
+    POST /carts/<customer>/<order_num>/checkout
+    GET  /orders/<id>/invoice[?format=csv]
+    GET  /recommendations?products=1,2,3
+    GET  /reports/sales?format=text|csv|json&top_n=<n>
+    GET  /reports/sales-over-time?granularity=hour|day|month&start=<epoch s>&end=<epoch s>&product=<id>
+    GET  /reports/period?start=<epoch s>&end=<epoch s>&top_n=<n>
+    GET  /perf
+
+Errors come back as {"error": ...} with a 4xx/5xx status; running out of stock
+is a 409 that also carries product_id, requested and available.
+ApiClient calls the API with the same methods as ShopService.
+"""
+import argparse
+import asyncio
+import http.client
+import io
+import json
+import os
+import queue
+import re
+import select
+import signal
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import pandas as pd
+
+from checkout import InsufficientStock
+import perf
+from service import SEARCH_LIMIT, ServiceError, ShopService, valid_customer_id
+
+API_HOST = os.getenv("ECOMMERCE_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("ECOMMERCE_API_PORT", "8000"))
+# Threads running service calls (storage writes among them) at once
+API_WORKERS = int(os.getenv("ECOMMERCE_API_WORKERS", "8"))
+MAX_BODY = 1 << 20
+MAX_HEADERS = 100
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+ROUTES = []
+
+
+def route(method, pattern):
+    """
+    Registers handler(service, params, query, body) for `method` and the path
+    regex `pattern`. A handler returns something JSON-serializable, or a
+    (content_type, text) tuple.
+    """
+    def decorate(fn):
+        ROUTES.append((method, re.compile(pattern + "$"), fn))
+        return fn
+    return decorate
+
+
+def _arg(query, name, default=None, convert=str):
+    values = query.get(name)
+    if not values or values[0] == "":
+        return default
+    try:
+        return convert(values[0])
+    except ValueError:
+        raise ServiceError(f"Invalid {name}: {values[0]!r}")
+
+
+def _customer(value):
+    # Any path segment matches the customer part of a route; the id rule is login's
+    if not valid_customer_id(value):
+        raise ServiceError(f"Invalid customer ID: {value!r}", 404)
+    return value
+
+
+def _field(body, name):
+    if not isinstance(body, dict) or name not in body:
+        raise ServiceError(f"Missing {name!r} in the request body")
+    return body[name]
+
+
+@route("GET", r"/health")
+def health(service, params, query, body):
+    return {"status": "ok"}
+
+@route("POST", r"/customers")
+def login(service, params, query, body):
+    customer, created = service.login(_field(body, "customer_id"))
+    return {"customer": customer, "created": created}
+
+@route("GET", r"/customers/([^/]+)/orders")
+def customer_orders(service, params, query, body):
+    return service.customer_orders(_customer(params[0]))
+
+@route("GET", r"/products")
+def search(service, params, query, body):
+    limit = _arg(query, "limit", SEARCH_LIMIT, int)
+    return service.search(_arg(query, "q", ""), limit if limit > 0 else None)
+
+@route("GET", r"/products/(\d+)")
+def product(service, params, query, body):
+    return service.product(int(params[0]))
+
+@route("GET", r"/carts/([^/]+)/(\d+)")
+def cart(service, params, query, body):
+    return service.cart(_customer(params[0]), int(params[1]))
+
+@route("POST", r"/carts/([^/]+)/(\d+)/items")
+def add_to_cart(service, params, query, body):
+    return service.add_to_cart(_customer(params[0]), int(params[1]), _field(body, "product_id"), _field(body, "qty"))
+
+@route("POST", r"/carts/([^/]+)/(\d+)/checkout")
+def checkout(service, params, query, body):
+    return service.checkout(_customer(params[0]), int(params[1]))
+
+@route("GET", r"/orders/(\d+)/invoice")
+def invoice(service, params, query, body):
+    invoice_df = service.invoice(int(params[0]))
+    if _arg(query, "format") == "csv":
+        return "text/csv", invoice_df.to_csv(index=False)
+    return json.loads(invoice_df.to_json(orient="records"))
+
+@route("GET", r"/recommendations")
+def recommendations(service, params, query, body):
+    products = _arg(query, "products", "")
+    try:
+        product_ids = [int(pid) for pid in products.split(",") if pid.strip()]
+    except ValueError:
+        raise ServiceError(f"Invalid products: {products!r}")
+    return service.recommendations(product_ids)
+
+@route("GET", r"/reports/sales")
+def sales_report(service, params, query, body):
+    fmt = _arg(query, "format", "text")
+    report = service.sales_report(fmt, _arg(query, "top_n", None, int))
+    return {"text": "text/plain", "csv": "text/csv", "json": "application/json"}[fmt], report
+
+@route("GET", r"/reports/sales-over-time")
+def sales_over_time(service, params, query, body):
+    return service.sales_over_time(_arg(query, "granularity", "day"), _arg(query, "start", None, float),
+                                   _arg(query, "end", None, float), _arg(query, "product", None, int))
+
+@route("GET", r"/reports/period")
+def sales_period(service, params, query, body):
+    start, end = _arg(query, "start", None, float), _arg(query, "end", None, float)
+    if start is None or end is None:
+        raise ServiceError("start and end are required")
+    return service.sales_period(start, end, _arg(query, "top_n", 10, int))
+
+@route("GET", r"/perf")
+def perf_stats(service, params, query, body):
+    return perf.snapshot()
+
+
+class BadRequest(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_request(reader):
+    """
+    Reads one request: (method, target, headers, body), or None once the client has closed the connection.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise BadRequest("Malformed request line")
+    headers = {"_version": version}
+    for _ in range(MAX_HEADERS + 1):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise BadRequest("Too many headers")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise BadRequest("Invalid Content-Length")
+    if length > MAX_BODY:
+        raise BadRequest("Request body too large", 413)
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+def encode_response(status, content_type, text, keep_alive):
+    data = text.encode("utf-8")
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + data
+
+
+class ApiServer:
+    def __init__(self, service=None, workers=API_WORKERS):
+        self.service = service or ShopService()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self.connections = set()  # writers of the open client connections
+
+    def call(self, handler, params, query, body):
+        # Runs on the worker pool; returns (status, content type, text)
+        try:
+            with perf.timer("api." + handler.__name__):
+                result = handler(self.service, params, query, body)
+        except InsufficientStock as e:
+            return 409, "application/json", json.dumps({"error": str(e), "product_id": e.product_id,
+                                                        "requested": e.requested, "available": e.available})
+        except ServiceError as e:
+            return e.status, "application/json", json.dumps({"error": str(e)})
+        except Exception as e:
+            traceback.print_exc()
+            return 500, "application/json", json.dumps({"error": f"{type(e).__name__}: {e}"})
+        if isinstance(result, tuple):
+            return 200, result[0], result[1]
+        return 200, "application/json", json.dumps(result)
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        allowed = False
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(url.path)
+            if match is None:
+                continue
+            if route_method != method:
+                allowed = True
+                continue
+            try:
+                payload = json.loads(body) if body else None
+            except ValueError:
+                return 400, "application/json", json.dumps({"error": "Request body is not valid JSON"})
+            loop = asyncio.get_running_loop()
+            # Path parts arrive percent-encoded (ApiClient quotes them; ids need not be ASCII)
+            params = [unquote(group) for group in match.groups()]
+            return await loop.run_in_executor(self.pool, partial(self.call, handler, params, query, payload))
+        if allowed:
+            return 405, "application/json", json.dumps({"error": f"{method} not allowed on {url.path}"})
+        return 404, "application/json", json.dumps({"error": f"No route for {url.path}"})
+
+    async def handle(self, reader, writer):
+        # One client connection; requests on it are answered in order (HTTP/1.1 keep-alive)
+        self.connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except BadRequest as e:
+                    writer.write(encode_response(e.status, "application/json", json.dumps({"error": str(e)}),
+                                                 False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status, content_type, text = await self.dispatch(method, target, body)
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" and (headers["_version"] != "HTTP/1.0" or connection == "keep-alive")
+                writer.write(encode_response(status, content_type, text, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def serve(self, host=API_HOST, port=API_PORT, ready=None):
+        """
+        Serves until SIGINT / SIGTERM, then returns (so atexit handlers such as
+        the cart and rollup saves still run). `ready(server)` is called once listening.
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Windows, or not the main thread
+                pass
+        if ready is not None:
+            ready(server)
+        async with server:
+            await stop.wait()
+            # Drop the idle keep-alive connections so their handlers return
+            for writer in list(self.connections):
+                writer.transport.abort()
+            await asyncio.sleep(0)
+        self.pool.shutdown()
+
+
+class ApiClient:
+    """
+    The ShopService methods, called over HTTP. Keeps up to `pool_size` idle
+    keep-alive connections and hands one to each calling thread, so concurrent
+    Streamlit sessions don't queue on one socket or reconnect per call.
+    Errors come back as the exceptions ShopService raises.
+    """
+
+    def __init__(self, base_url, pool_size=8, timeout=30):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=pool_size)
+
+    def _connection(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+            # An idle keep-alive connection has nothing to read unless the server closed it
+            if conn.sock is not None and not select.select([conn.sock], [], [], 0)[0]:
+                return conn, True
+            conn.close()
+
+    def _release(self, conn, response):
+        if response.will_close:
+            conn.close()
+            return
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, payload=None, raw=False):
+        """
+        Returns the decoded JSON response (the text if `raw` or not JSON).
+        Only a GET is sent again when a reused connection drops: a POST may
+        have been carried out before the server closed it (placing the order
+        twice), so that error goes to the caller.
+        """
+        body = json.dumps(payload) if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        while True:
+            conn, reused = self._connection()
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused and method == "GET":
+                    # The server dropped an idle connection; try again on a new one
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            self._release(conn, response)
+            break
+        text = data.decode("utf-8")
+        is_json = response.getheader("Content-Type", "").startswith("application/json")
+        if response.status >= 400:
+            error = json.loads(text) if is_json else {"error": text}
+            if response.status == 409 and "available" in error:
+                raise InsufficientStock(error["product_id"], error["requested"], error["available"])
+            raise ServiceError(error.get("error", text), response.status)
+        return json.loads(text) if is_json and not raw else text
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def login(self, customer_id):
+        result = self.request("POST", "/customers", {"customer_id": customer_id})
+        return result["customer"], result["created"]
+
+    def customer_orders(self, customer_id):
+        return self.request("GET", f"/customers/{quote(str(customer_id))}/orders")
+
+    def search(self, term="", limit=SEARCH_LIMIT):
+        query = f"?q={quote(term or '')}&limit={limit if limit is not None else 0}"
+        return self.request("GET", "/products" + query)
+
+    def product(self, product_id):
+        return self.request("GET", f"/products/{int(product_id)}")
+
+    def cart(self, customer_id, order_num):
+        return self.request("GET", f"/carts/{quote(str(customer_id))}/{int(order_num)}")
+
+    def add_to_cart(self, customer_id, order_num, product_id, qty):
+        return self.request("POST", f"/carts/{quote(str(customer_id))}/{int(order_num)}/items",
+                            {"product_id": int(product_id), "qty": int(qty)})
+
+    def checkout(self, customer_id, order_num):
+        return self.request("POST", f"/carts/{quote(str(customer_id))}/{int(order_num)}/checkout")
+
+    def invoice(self, order_id):
+        return pd.read_csv(io.StringIO(self.request("GET", f"/orders/{int(order_id)}/invoice?format=csv")))
+
+    def recommendations(self, product_ids=()):
+        return self.request("GET", "/recommendations?products=" + ",".join(str(int(p)) for p in product_ids))
+
+    def sales_report(self, fmt="text", top_n=None):
+        return self.request("GET", f"/reports/sales?format={quote(fmt)}"
+                                   + (f"&top_n={int(top_n)}" if top_n is not None else ""), raw=True)
+
+    def sales_over_time(self, granularity="day", start=None, end=None, product_id=None):
+        query = f"?granularity={quote(granularity)}"
+        for name, value in (("start", start), ("end", end), ("product", product_id)):
+            if value is not None:
+                query += f"&{name}={value}"
+        return self.request("GET", "/reports/sales-over-time" + query)
+
+    def sales_period(self, start, end, top_n=10):
+        return self.request("GET", f"/reports/period?start={float(start)}&end={float(end)}&top_n={int(top_n)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the shop's HTTP/JSON API.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="threads running service calls")
+    args = parser.parse_args()
+    api = ApiServer(workers=args.workers)
+    print(f"Serving the shop API on http://{args.host}:{args.port} ({args.workers} workers)", flush=True)
+    asyncio.run(api.serve(args.host, args.port))
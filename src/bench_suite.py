@@ -0,0 +1,220 @@
+"""
+Benchmark suite: times the app's hot paths against synthetic data sets (see
+datagen.py) at several scale points and saves the results as JSON, so runs
+can be compared to catch regressions.
+
+Run from the repo root, e.g.:
+    python src/bench_suite.py                                   # small + medium
+    python src/bench_suite.py --scales large --out after.json --baseline before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from analytics import OrderLinesTable, product_sales, sold_counts
+from data_store import DataStore
+from data_versions import bump_version
+from datagen import generate_dataset
+from recommender import get_recommendations
+from reports import generate_sales_report
+from snapshot import ColumnarSnapshot
+from storage import JsonStorage
+from time_rollups import TimeRollups
+
+SCALES = {
+    "small": {"products": 1_000, "customers": 1_000, "orders": 10_000},
+    "medium": {"products": 10_000, "customers": 10_000, "orders": 100_000},
+    "large": {"products": 50_000, "customers": 100_000, "orders": 1_000_000},
+}
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'bench_results')
+# A result only counts as a regression if it is this much slower, and by at least MIN_DELTA_MS
+TOLERANCE = 0.25
+MIN_DELTA_MS = 0.5
+
+
+def timed(fn, repeat):
+    """
+    Runs fn() `repeat` times; returns the timing summary (ms) and the last result.
+    """
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    summary = {"n": repeat, "mean_ms": float(np.mean(samples)), "p50_ms": float(np.percentile(samples, 50)),
+               "p95_ms": float(np.percentile(samples, 95)), "min_ms": float(np.min(samples))}
+    return summary, result
+
+
+def open_store(directory):
+    store = DataStore(JsonStorage.in_directory(directory, snapshot=ColumnarSnapshot(os.path.join(directory,
+                                                                                                 "snapshot"))))
+    # A fresh data set: nothing cached for the previous one may be reused
+    bump_version("inventory")
+    bump_version("orders")
+    return store
+
+
+def run_scale(name, config, repeat=20, seed=42):
+    """
+    Generates the data set for one scale point in a temporary directory and
+    times each operation on it. Returns {"config", "data", "timings": {operation: summary}}.
+    """
+    rng = random.Random(seed)
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        counts = generate_dataset(tmp, config["products"], config["customers"], config["orders"],
+                                  seed=seed, indent=None)
+        generate_s = time.perf_counter() - start
+
+        # Startup: JSON parse (and snapshot write), then again from the columnar snapshot
+        timings["startup_cold"], store = timed(lambda: open_store(tmp), 1)
+        store.close()
+        stores = []
+        timings["startup_warm"], store = timed(lambda: stores.append(open_store(tmp)) or stores[-1],
+                                               max(1, repeat // 10))
+        for other in stores[:-1]:
+            other.close()
+
+        inv_df = store.inventory_df
+        product_ids = inv_df["id"].tolist()
+        products = inv_df.set_index("id").to_dict("index")
+        carts = [rng.sample(product_ids, rng.randint(1, 4)) for _ in range(repeat)]
+        version = store.version("inventory")
+
+        get_recommendations(carts[0], store.orders, inv_df, copurchase_index=store.order_index,
+                            inventory_version=version)
+        cart_iter = iter(carts * 2)
+        timings["recommendations"], _ = timed(
+            lambda: get_recommendations(next(cart_iter), store.orders, inv_df, copurchase_index=store.order_index,
+                                        inventory_version=version), repeat)
+
+        timings["sales_report"], _ = timed(lambda: generate_sales_report(store.orders, products, top_n=10),
+                                           max(1, repeat // 4))
+        timings["sales_report_rollups"], _ = timed(
+            lambda: generate_sales_report(store.orders, None, top_n=10, rollups=store.rollups), repeat)
+
+        # Time series and period totals over the generated year of orders
+        timings["time_rollups_build"], time_rollups = timed(lambda: TimeRollups.from_book(store.orders, inv_df),
+                                                            max(1, repeat // 10))
+        timings["sales_over_time"], _ = timed(
+            lambda: time_rollups.series("day", time_rollups.first, time_rollups.last), repeat)
+        timings["period_report"], _ = timed(
+            lambda: time_rollups.period(time_rollups.first, time_rollups.last, top_n=10), repeat)
+
+        order_ids = [rng.randint(1, counts["orders"]) for _ in range(repeat)]
+        id_iter = iter(order_ids * 2)
+        timings["invoice"], _ = timed(lambda: store.invoice(next(id_iter)), repeat)
+
+        def analytics_cold():
+            table = OrderLinesTable(store.orders).table(inv_df)
+            return product_sales(table), sold_counts(table, inv_df["id"])
+        timings["analytics_cold"], _ = timed(analytics_cold, max(1, repeat // 10))
+
+        # Checkout: one single-item cart per order, as place_final_order runs it
+        customers = [c["customer_id"] for c in store.customers]
+        checkouts = []
+        for i in range(repeat):
+            pid = rng.choice(product_ids)
+            store.carts.add_item(customers[i % len(customers)], 1000 + i,
+                                 {"product_id": pid, "product_name": products[pid]["name"], "qty": 1,
+                                  "subtotal": float(products[pid]["price"])})
+            checkouts.append((customers[i % len(customers)], 1000 + i))
+        checkout_iter = iter(checkouts)
+        timings["checkout"], _ = timed(lambda: store.checkout(*next(checkout_iter)), repeat)
+
+        # Analytics after new orders: only the new lines are joined
+        def analytics_warm():
+            table = store.order_lines.table(store.inventory_df, store.version("inventory"))
+            return product_sales(table), sold_counts(table, inv_df["id"])
+        analytics_warm()
+        timings["analytics_warm"], _ = timed(analytics_warm, repeat)
+        store.close()
+
+    return {"config": config, "data": dict(counts, generate_s=generate_s), "timings": timings}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit, "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(), "numpy": np.__version__,
+            "pandas": pd.__version__}
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Operations whose p50 got slower than the baseline's by more than `tolerance`
+    (and MIN_DELTA_MS): a list of (scale, operation, baseline ms, current ms).
+    """
+    regressions = []
+    for scale, result in results["scales"].items():
+        before = baseline.get("scales", {}).get(scale)
+        if before is None or before["config"] != result["config"]:
+            continue
+        for op, timing in result["timings"].items():
+            old = before["timings"].get(op)
+            if old is None:
+                continue
+            if timing["p50_ms"] > old["p50_ms"] * (1 + tolerance) and timing["p50_ms"] - old["p50_ms"] > MIN_DELTA_MS:
+                regressions.append((scale, op, old["p50_ms"], timing["p50_ms"]))
+    return regressions
+
+
+def run_suite(scales=("small", "medium"), repeat=20, seed=42):
+    results = {"environment": environment(), "repeat": repeat, "seed": seed, "scales": {}}
+    for name in scales:
+        config = SCALES[name]
+        print(f"== {name}: {config['products']} products, {config['customers']} customers, "
+              f"{config['orders']} orders")
+        result = run_scale(name, config, repeat, seed)
+        results["scales"][name] = result
+        for op, timing in result["timings"].items():
+            print(f"  {op:22s} p50 {timing['p50_ms']:10.2f} ms   p95 {timing['p95_ms']:10.2f} ms   (n={timing['n']})")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the app's hot paths on synthetic data.")
+    parser.add_argument("--scales", default="small,medium", help=f"comma-separated, from {', '.join(SCALES)}")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per operation")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="results file (default bench_results/suite-<time>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown of p50, as a fraction")
+    args = parser.parse_args()
+
+    scales = [s.strip() for s in args.scales.split(",") if s.strip()]
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown:
+        sys.exit(f"unknown scale(s): {', '.join(unknown)} (expected {', '.join(SCALES)})")
+    results = run_suite(scales, args.repeat, args.seed)
+
+    out = args.out or os.path.join(RESULTS_DIR, time.strftime("suite-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"Results written to {out}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for scale, op, old_ms, new_ms in regressions:
+            print(f"REGRESSION {scale}/{op}: p50 {old_ms:.2f} ms -> {new_ms:.2f} ms")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
@@ -0,0 +1,1013 @@
+"""
+Micro-benchmarks for the hot paths of the app.
+
+Run from the repo root, e.g.:
+    python src/benchmarks.py checkout
+"""
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+import data_store
+import perf
+from ai_insights import InsightsService, LocalProvider, PROMPT_TEMPLATE
+from analytics import OrderLinesTable, build_order_lines, sold_counts
+from checkout import InsufficientStock, cart_key, place_order, release, reserve
+from datagen import make_customers, make_inventory, make_orders
+from order import Order, OrderBook
+from order_index import OrderIndex
+from order_store import OrderJournal
+from reports import generate_sales_report
+from sales_rollups import SalesRollups
+from search_index import ProductSearchIndex
+from service import ShopService
+from snapshot import OrderColumns
+from storage import JsonStorage, SqliteStorage
+from time_rollups import TimeRollups, parse_date
+from recommender import (CoPurchaseIndex, get_recommendations, get_similarity_engine, recommend_batch,
+                         _scan_co_purchases)
+
+
+def make_carts(n_carts, n_products, max_items=4, seed=7):
+    rng = random.Random(seed)
+    return [[rng.randint(1, n_products) for _ in range(rng.randint(1, max_items))] for _ in range(n_carts)]
+
+
+def _percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def bench_checkout(sizes=(1_000, 10_000, 100_000, 1_000_000), appends=200, rewrite_limit=100_000):
+    """
+    Times persisting one new order with a history of N orders:
+      journal  - OrderJournal.append (what place_final_order does now)
+      rewrite  - json.dump of the whole list with indent=4 (the old save_orders)
+    The rewrite is skipped above `rewrite_limit` orders because it gets too slow.
+    """
+    results = []
+    for n in sizes:
+        orders = make_orders(n)
+        with tempfile.TemporaryDirectory() as tmp:
+            snapshot = os.path.join(tmp, "orders.json")
+            with open(snapshot, 'w') as f:
+                json.dump(orders, f)
+            journal = OrderJournal(snapshot, os.path.join(tmp, "orders.journal"))
+            orders = journal.load()
+
+            journal_ms = []
+            for i in range(appends):
+                order = {"order_id": n + i + 1, "customer_id": "bench", "items": [[1, 1]], "total_cost": 10.0}
+                start = time.perf_counter()
+                orders.append(order)
+                journal.append(order)
+                journal_ms.append((time.perf_counter() - start) * 1000)
+
+            rewrite_ms = None
+            if n <= rewrite_limit:
+                start = time.perf_counter()
+                with open(os.path.join(tmp, "rewrite.json"), 'w') as f:
+                    json.dump(orders, f, indent=4)
+                rewrite_ms = (time.perf_counter() - start) * 1000
+
+        row = {
+            "orders": n,
+            "journal_mean_ms": sum(journal_ms) / len(journal_ms),
+            "journal_p99_ms": _percentile(journal_ms, 99),
+            "rewrite_ms": rewrite_ms,
+        }
+        results.append(row)
+        rewrite = f"{rewrite_ms:10.2f}" if rewrite_ms is not None else "   skipped"
+        print(f"{n:>10} orders | journal mean {row['journal_mean_ms']:.3f} ms"
+              f" p99 {row['journal_p99_ms']:.3f} ms | full rewrite {rewrite} ms")
+    return results
+
+
+def bench_copurchase(n_orders=100_000, n_products=500, n_carts=50):
+    """
+    Collaborative step of get_recommendations: scanning every order vs CoPurchaseIndex,
+    and a check that both give identical recommendations.
+    """
+    orders = make_orders(n_orders, n_products=n_products)
+    inventory_df = make_inventory(n_products)
+    carts = make_carts(n_carts, n_products)
+
+    start = time.perf_counter()
+    index = CoPurchaseIndex(orders)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for cart in carts:
+        _scan_co_purchases(cart, orders)
+    scan_ms = (time.perf_counter() - start) * 1000 / n_carts
+
+    start = time.perf_counter()
+    for cart in carts:
+        index.co_purchase_counts(cart)
+    index_ms = (time.perf_counter() - start) * 1000 / n_carts
+
+    mismatches = sum(
+        get_recommendations(cart, orders, inventory_df)
+        != get_recommendations(cart, orders, inventory_df, copurchase_index=index)
+        for cart in carts[:10])
+
+    print(f"{n_orders} orders, {n_products} products | index build {build_s:.2f} s |"
+          f" scan {scan_ms:.2f} ms/cart | index {index_ms:.2f} ms/cart | ranking mismatches {mismatches}/10")
+    return {"orders": n_orders, "build_s": build_s, "scan_ms": scan_ms, "index_ms": index_ms,
+            "mismatches": mismatches}
+
+
+def _loop_similarity_scores(cart_items, inventory_df):
+    # The per-pair Python loop get_recommendations used before SimilarityEngine
+    product_dict = inventory_df.set_index("id").to_dict("index")
+    scores = {}
+    for cart_pid in cart_items:
+        p1 = product_dict[cart_pid]
+        for candidate_pid, p2 in product_dict.items():
+            if candidate_pid in cart_items:
+                continue
+            dist = math.sqrt((p1["price"] - p2["price"]) ** 2 + (p1["popularity"] - p2["popularity"]) ** 2)
+            scores[candidate_pid] = scores.get(candidate_pid, 0.0) + 1.0 / (1.0 + dist)
+    return scores
+
+
+def bench_similarity(n_products=50_000, n_carts=20):
+    """
+    Content-based step: Python loop vs the cached, vectorized SimilarityEngine.
+    """
+    inventory_df = make_inventory(n_products)
+    carts = make_carts(n_carts, n_products)
+
+    start = time.perf_counter()
+    for cart in carts[:3]:
+        _loop_similarity_scores(cart, inventory_df)
+    loop_ms = (time.perf_counter() - start) * 1000 / 3
+
+    get_similarity_engine(inventory_df, inventory_version=0)  # warm the cache
+    start = time.perf_counter()
+    for cart in carts:
+        get_recommendations(cart, [], inventory_df, inventory_version=0)
+    engine_ms = (time.perf_counter() - start) * 1000 / n_carts
+
+    engine = get_similarity_engine(inventory_df, inventory_version=0)
+    expected = _loop_similarity_scores(carts[0], inventory_df)
+    got = engine.similarity_scores(carts[0])
+    max_err = max(abs(got[engine.position[pid]] - score) for pid, score in expected.items())
+
+    print(f"{n_products} products | python loop {loop_ms:.1f} ms/cart |"
+          f" vectorized get_recommendations {engine_ms:.2f} ms/cart | max score diff {max_err:.2e}")
+    return {"products": n_products, "loop_ms": loop_ms, "engine_ms": engine_ms, "max_err": max_err}
+
+
+def bench_ann(n_products=1_000_000, n_carts=50, candidate_counts=(10, 50, 200, 1000)):
+    """
+    Recall@3 and latency of the approximate (grid) mode against exact scoring.
+    """
+    inventory_df = make_inventory(n_products)
+    carts = make_carts(n_carts, n_products)
+    engine = get_similarity_engine(inventory_df, inventory_version=0)
+
+    start = time.perf_counter()
+    exact = [get_recommendations(cart, [], inventory_df, inventory_version=0, approx_candidates=None)
+             for cart in carts]
+    exact_ms = (time.perf_counter() - start) * 1000 / n_carts
+
+    start = time.perf_counter()
+    _ = engine.grid
+    grid_s = time.perf_counter() - start
+    print(f"{n_products} products | exact {exact_ms:.2f} ms/cart | grid build {grid_s:.2f} s")
+
+    results = {"products": n_products, "exact_ms": exact_ms, "grid_build_s": grid_s, "approx": []}
+    for n_candidates in candidate_counts:
+        start = time.perf_counter()
+        approx = [get_recommendations(cart, [], inventory_df, inventory_version=0, approx_candidates=n_candidates)
+                  for cart in carts]
+        approx_ms = (time.perf_counter() - start) * 1000 / n_carts
+        recall = sum(len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)) / n_carts
+        results["approx"].append({"candidates": n_candidates, "ms": approx_ms, "recall": recall})
+        print(f"  {n_candidates:>5} candidates/item | {approx_ms:.2f} ms/cart | recall@3 {recall:.3f}")
+    return results
+
+
+def bench_batch(n_products=20_000, n_orders=50_000, n_carts=5_000, workers=4):
+    """
+    Carts/second: one plain get_recommendations(cart, orders, inventory_df) call
+    per cart (every call redoes the setup) vs recommend_batch, serial and on a
+    process pool. The per-cart rate is measured on the first 200 carts.
+    """
+    inventory_df = make_inventory(n_products)
+    orders = make_orders(n_orders, n_products=n_products)
+    carts = make_carts(n_carts, n_products)
+
+    start = time.perf_counter()
+    for cart in carts[:200]:
+        get_recommendations(cart, orders, inventory_df)
+    single_cps = 200 / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    recommend_batch(carts, orders, inventory_df)
+    batch_cps = n_carts / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    recommend_batch(carts, orders, inventory_df, workers=workers)
+    pool_cps = n_carts / (time.perf_counter() - start)
+
+    print(f"{n_carts} carts, {n_products} products, {n_orders} orders | per-cart calls {single_cps:.0f} carts/s |"
+          f" batch {batch_cps:.0f} carts/s | batch x{workers} processes {pool_cps:.0f} carts/s"
+          f" ({os.cpu_count()} CPUs)")
+    return {"carts": n_carts, "single_cps": single_cps, "batch_cps": batch_cps, "pool_cps": pool_cps}
+
+
+def _loop_order_lines(orders, inventory_df):
+    # The per-line DataFrame filtering analytics_page used before the fact table
+    all_items = []
+    for o in orders:
+        for pid, qty in o["items"]:
+            row = inventory_df[inventory_df["id"] == pid]
+            price = float(row.iloc[0]["price"]) if not row.empty else 0
+            all_items.append({"order_id": o["order_id"], "product_id": pid, "quantity": qty,
+                              "subtotal": price * qty})
+    return pd.DataFrame(all_items)
+
+
+def bench_analytics(n_orders=400_000, n_products=2_000, loop_orders=2_000):
+    """
+    Analytics aggregation at ~1M order lines (400k orders x 2.5 items): the old
+    per-line filtering (timed on `loop_orders` orders and extrapolated) vs one
+    explode + merge, and the cost of adding one order to OrderLinesTable.
+    """
+    orders = make_orders(n_orders, n_products=n_products)
+    inventory_df = make_inventory(n_products)
+    n_lines = sum(len(o["items"]) for o in orders)
+
+    start = time.perf_counter()
+    df = _loop_order_lines(orders[:loop_orders], inventory_df)
+    for pid in inventory_df["id"].tolist()[:200]:
+        df[df["product_id"] == pid]["quantity"].sum()
+    loop_s = (time.perf_counter() - start) * n_orders / loop_orders
+
+    start = time.perf_counter()
+    lines = build_order_lines(orders, inventory_df)
+    sold_counts(lines, inventory_df["id"])
+    fact_s = time.perf_counter() - start
+
+    table = OrderLinesTable(orders)
+    table.table(inventory_df, inventory_version=0)
+    start = time.perf_counter()
+    table.add_order({"order_id": n_orders + 1, "customer_id": "bench", "items": [[1, 2]], "total_cost": 1.0})
+    add_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    table.table(inventory_df, inventory_version=0)
+    refresh_s = time.perf_counter() - start
+
+    print(f"{n_lines} order lines | per-line filtering ~{loop_s:.0f} s (extrapolated) |"
+          f" explode+merge+groupby {fact_s:.2f} s | add_order {add_ms:.3f} ms | refresh after add {refresh_s:.2f} s")
+    return {"lines": n_lines, "loop_s": loop_s, "fact_s": fact_s, "add_ms": add_ms, "refresh_s": refresh_s}
+
+
+def bench_charts(n_orders=200_000, n_products=200, workers=4):
+    """
+    Rendering every Analytics chart from scratch: serially vs on the chart
+    process pool (warmed up first, as it would be after the first page load).
+    The slowest single chart is the floor for the parallel time.
+    """
+    import charts
+
+    inventory_df = make_inventory(n_products)
+    orders = make_orders(n_orders, n_products=n_products)
+    data = {"inventory": inventory_df, "order_lines": build_order_lines(orders, inventory_df),
+            "total_sales": sum(o["total_cost"] for o in orders)}
+
+    per_chart = {}
+    for name, builder, columns, order_columns in charts.CHARTS:
+        job = charts.chart_job(data, columns, order_columns)
+        start = time.perf_counter()
+        charts.render_png(builder, job)
+        per_chart[name] = time.perf_counter() - start
+    serial_s = sum(per_chart.values())
+
+    charts.render_charts(data, orders_version=-1, workers=workers)  # start the pool
+    charts.chart_cache.entries.clear()
+    start = time.perf_counter()
+    charts.render_charts(data, orders_version=-2, workers=workers)
+    parallel_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    charts.render_charts(data, orders_version=-2, workers=workers)
+    cached_s = time.perf_counter() - start
+
+    print(f"{len(data['order_lines'])} order lines | serial {serial_s:.2f} s | slowest chart"
+          f" {max(per_chart.values()):.2f} s | pool x{workers} {parallel_s:.2f} s | cached {cached_s * 1000:.1f} ms"
+          f" ({os.cpu_count()} CPUs)")
+    return {"serial_s": serial_s, "slowest_s": max(per_chart.values()), "parallel_s": parallel_s,
+            "cached_s": cached_s}
+
+
+WORDS = ["smart", "wireless", "usb", "portable", "gaming", "pro", "mini", "ultra", "home", "camera",
+         "speaker", "charger", "cable", "watch", "drive", "keyboard", "mouse", "router", "hub", "tablet"]
+
+def bench_search(n_products=1_000_000, queries=("Wire", "smart w", "keyboard", "able", "ULTRA HUB 12"), repeat=50):
+    """
+    Product search at 1M names: the old str.startswith scan vs ProductSearchIndex
+    (prefix, word prefix and substring queries), plus an incremental update.
+    """
+    rng = random.Random(3)
+    names = [" ".join(rng.choice(WORDS).title() for _ in range(rng.randint(2, 4))) + f" {i}"
+             for i in range(n_products)]
+    inventory_df = pd.DataFrame({"id": range(1, n_products + 1), "name": names})
+
+    start = time.perf_counter()
+    inventory_df[inventory_df["name"].str.startswith("Wire", na=False)]
+    scan_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    index = ProductSearchIndex(inventory_df)
+    build_s = time.perf_counter() - start
+
+    results = {"products": n_products, "scan_ms": scan_ms, "build_s": build_s, "queries": {}}
+    print(f"{n_products} products | startswith scan {scan_ms:.1f} ms | index build {build_s:.1f} s")
+    for query in queries:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            found = index.search(query, limit=50)
+        query_ms = (time.perf_counter() - start) * 1000 / repeat
+        results["queries"][query] = query_ms
+        print(f"  {query!r:>16}: {query_ms:.3f} ms ({len(found)} results)")
+
+    start = time.perf_counter()
+    index.add(n_products + 1, "Wireless Test Product")
+    index.remove(n_products + 1)
+    results["update_ms"] = (time.perf_counter() - start) * 1000
+    print(f"  add + remove one product: {results['update_ms']:.2f} ms")
+    return results
+
+
+def bench_sessions(n_products=20_000, n_orders=50_000, n_customers=5_000, sessions=5):
+    """
+    Cost of a new Streamlit session: loading the data and building the indexes
+    (what every session used to do into its own session_state) vs attaching to
+    the process-wide DataStore, plus the memory one copy of the data takes.
+    """
+    import tracemalloc
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SqliteStorage(os.path.join(tmp, "bench.db"))
+        orders = make_orders(n_orders, n_products=n_products, n_customers=n_customers)
+        customers = make_customers(n_customers)
+        with storage.transaction():
+            storage.save_inventory(make_inventory(n_products))
+            for order in orders:
+                storage.save_order(order)
+            storage.save_customers(customers)
+            storage.save_bill({})
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        store = data_store.DataStore(storage)
+        load_ms = (time.perf_counter() - start) * 1000
+        store_mb = tracemalloc.get_traced_memory()[0] / 2**20
+        tracemalloc.stop()
+
+        data_store._store = store
+        start = time.perf_counter()
+        for _ in range(sessions):
+            assert data_store.get_data_store() is store
+        attach_ms = (time.perf_counter() - start) * 1000 / sessions
+        data_store._store = None
+        storage.conn.close()
+
+    print(f"{n_products} products, {n_orders} orders, {n_customers} customers")
+    print(f"  per-session load: {load_ms:8.1f} ms, {store_mb:.1f} MB per session "
+          f"({store_mb * sessions:.1f} MB for {sessions} sessions)")
+    print(f"  shared store:     {attach_ms:8.4f} ms per new session, {store_mb:.1f} MB in total")
+    return {"load_ms": load_ms, "attach_ms": attach_ms, "store_mb": store_mb}
+
+
+def _json_storage(tmp):
+    return JsonStorage(os.path.join(tmp, "customers.json"), os.path.join(tmp, "bill.json"),
+                       os.path.join(tmp, "orders.json"), os.path.join(tmp, "orders.journal"),
+                       os.path.join(tmp, "inventory.json"), os.path.join(tmp, "reservations.json"),
+                       os.path.join(tmp, "order_id.seq"), os.path.join(tmp, "data.lock"))
+
+def _open_storage(backend, tmp):
+    if backend == "json":
+        return _json_storage(tmp)
+    return SqliteStorage(os.path.join(tmp, "bench.db"))
+
+def _checkout_worker(backend, tmp, worker, n_orders, n_products, seed):
+    # One "server process": add to cart (reserve), then check out, as fast as it can
+    storage = _open_storage(backend, tmp)
+    products = {pid: {"price": 10.0} for pid in range(1, n_products + 1)}
+    rng = random.Random(seed)
+    placed, rejected = [], 0
+    for n in range(n_orders):
+        cart = cart_key(f"w{worker}", n)
+        items = []
+        try:
+            for _ in range(rng.randint(1, 3)):
+                pid, qty = rng.randint(1, n_products), rng.randint(1, 3)
+                reserve(storage, cart, pid, qty)
+                items.append((pid, qty))
+            order, _ = place_order(storage, f"w{worker}", cart, items, products)
+            placed.append(order["order_id"])
+        except InsufficientStock:
+            release(storage, cart)
+            rejected += 1
+    return placed, rejected
+
+
+def bench_checkout_stress(backends=("json", "sqlite"), processes=4, orders_per_process=300,
+                          n_products=20, initial_stock=100):
+    """
+    Multi-process checkout stress test: `processes` workers reserve and check out
+    random carts against the same storage until stock runs out, then the result
+    is checked: no negative stock, units sold == stock consumed, and order ids
+    unique and gap-free.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = {}
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = _open_storage(backend, tmp)
+            storage.save_inventory(pd.DataFrame({
+                "id": list(range(1, n_products + 1)),
+                "name": [f"Product {pid}" for pid in range(1, n_products + 1)],
+                "price": [10.0] * n_products,
+                "stock": [initial_stock] * n_products,
+                "popularity": [50.0] * n_products,
+            }))
+
+            start = time.perf_counter()
+            with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [pool.submit(_checkout_worker, backend, tmp, w, orders_per_process, n_products, w)
+                           for w in range(processes)]
+                outcomes = [f.result() for f in futures]
+            elapsed = time.perf_counter() - start
+
+            placed = sorted(oid for ids, _ in outcomes for oid in ids)
+            rejected = sum(r for _, r in outcomes)
+            orders = storage.load_orders()
+            stock = storage.read_stock(range(1, n_products + 1))
+            sold = {pid: 0 for pid in range(1, n_products + 1)}
+            for order in orders:
+                for pid, qty in order["items"]:
+                    sold[pid] += qty
+
+            assert min(stock.values()) >= 0, f"negative stock: {stock}"
+            assert all(initial_stock - stock[pid] == sold[pid] for pid in sold), "stock and orders disagree"
+            assert placed == [o["order_id"] for o in orders] == list(range(1, len(placed) + 1)), \
+                "order ids are duplicated or missing"
+
+        rate = len(placed) / elapsed
+        results[backend] = {"orders": len(placed), "rejected": rejected, "orders_per_s": rate}
+        print(f"  {backend:>6}: {len(placed)} orders, {rejected} rejected carts, "
+              f"{sum(sold.values())}/{initial_stock * n_products} units sold, {rate:.0f} orders/s "
+              f"({processes} processes) - stock and order ids consistent")
+    print(f"  ({os.cpu_count()} CPUs available)")
+    return results
+
+
+def bench_cart(n_customers=10_000, adds=200, flush_interval=2.0):
+    """
+    ShopService.add_to_cart latency with N customers holding open carts and
+    stock reservations (JSON storage):
+      write-through - reserve rewriting reservations.json, then the bill rewritten
+                      to bill_for_all.json (the old save_reservations and save_bill per add)
+      service       - ShopService.add_to_cart: reserve appends the cart to the
+                      reservations journal, CartStore.add_item leaves the bill to
+                      the write-behind flusher
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = _json_storage(tmp)
+        storage.save_inventory(make_inventory(100, stock=10 ** 9))
+        item = {"product_id": 1, "product_name": "Product 1", "qty": 1, "subtotal": 10.0}
+        customers = [f"cust{i:05d}" for i in range(n_customers)]
+        bill = {cust: {"1": {"order_items": [dict(item)] * 3, "total": 30.0}} for cust in customers}
+        storage.save_bill(bill)
+        ledger = {cart_key(cust, 1): {"expires_at": time.time() + 3600, "items": {1: 3}} for cust in customers}
+        storage.save_reservations(ledger)
+
+        through_ms = []
+        for cust in customers[:adds]:
+            start = time.perf_counter()
+            with storage.exclusive():
+                with open(storage.reservations_file) as f:
+                    ledger = json.load(f)
+                ledger[cart_key(cust, 1)]["items"]["1"] += 1
+                storage.save_reservations(ledger)
+            cart = bill[cust]["1"]
+            cart["order_items"].append(dict(item))
+            cart["total"] = float(sum(it["subtotal"] for it in cart["order_items"]))
+            storage.save_bill(bill)
+            through_ms.append((time.perf_counter() - start) * 1000)
+
+        store = data_store.DataStore(storage)
+        store.carts.flush_interval = flush_interval
+        service = ShopService(store)
+        service_ms = []
+        for cust in customers[adds:2 * adds]:
+            start = time.perf_counter()
+            service.add_to_cart(cust, 1, 1, 1)
+            service_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        flushed = store.carts.flush()
+        flush_ms = (time.perf_counter() - start) * 1000
+        store.close()
+
+    print(f"{n_customers} customers with open carts and reservations, {adds} adds")
+    print(f"  write-through: p50 {_percentile(through_ms, 50):8.3f} ms  p99 {_percentile(through_ms, 99):8.3f} ms")
+    print(f"  service:       p50 {_percentile(service_ms, 50):8.3f} ms  p99 {_percentile(service_ms, 99):8.3f} ms "
+          f"(+ one {flush_ms:.1f} ms flush for {flushed} dirty customers per {flush_interval:g} s)")
+    return {"write_through_p50_ms": _percentile(through_ms, 50), "service_p50_ms": _percentile(service_ms, 50),
+            "flush_ms": flush_ms}
+
+
+_LOAD_SNIPPET = """
+import json, sys, time
+sys.path.insert(0, {src!r})
+from snapshot import ColumnarSnapshot
+start = time.perf_counter()
+if {mode!r} == "json":
+    with open({orders!r}) as f:
+        orders = json.load(f)
+    n = sum(len(o["items"]) for o in orders)
+else:
+    columns = ColumnarSnapshot({snapdir!r}).read_orders({orders!r})
+    if {mode!r} == "records":
+        orders = columns.to_records()
+    n = int(columns.qty.sum())
+elapsed = time.perf_counter() - start
+# Peak resident set of this process (ru_maxrss would include the parent's, inherited across exec)
+with open("/proc/self/status") as f:
+    peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+print(json.dumps([elapsed, peak_kb / 1024, n]))
+"""
+
+def bench_snapshot(n_lines=10_000_000, n_products=5_000, n_customers=100_000, seed=42):
+    """
+    Cold start of an order history with `n_lines` order lines, each loader in a
+    fresh process (wall time and peak RSS):
+      json      - json.load of the pretty-printed orders.json
+      columnar  - ColumnarSnapshot.read_orders (memory-mapped columns), one pass over qty
+      records   - the same, converted to the list of order dicts the app uses
+    """
+    import subprocess
+    import numpy as np
+    from snapshot import ColumnarSnapshot, OrderColumns
+
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(1, 5, size=int(n_lines / 2.5) + 1)
+    sizes = sizes[:np.searchsorted(np.cumsum(sizes), n_lines) + 1]
+    n_orders = len(sizes)
+    offsets = np.zeros(n_orders + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    columns = OrderColumns(np.arange(1, n_orders + 1, dtype=np.int64),
+                           rng.integers(0, n_customers, size=n_orders).astype(np.int32),
+                           [f"cust{i:06d}" for i in range(n_customers)],
+                           np.round(rng.uniform(10, 5000, size=n_orders), 2),
+                           offsets,
+                           rng.integers(1, n_products + 1, size=offsets[-1]),
+                           rng.integers(1, 4, size=offsets[-1]))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        orders_path = os.path.join(tmp, "orders.json")
+        start = time.perf_counter()
+        with open(orders_path, "w") as f:
+            # Written in chunks of orders so the generator never holds all the dicts
+            f.write("[\n")
+            chunk = 200_000
+            for a in range(0, n_orders, chunk):
+                part = OrderColumns(columns.order_id[a:a + chunk], columns.customer[a:a + chunk],
+                                    columns.customers, columns.total_cost[a:a + chunk],
+                                    columns.item_offsets[a:a + chunk + 1] - columns.item_offsets[a],
+                                    columns.product_id[offsets[a]:offsets[min(a + chunk, n_orders)]],
+                                    columns.qty[offsets[a]:offsets[min(a + chunk, n_orders)]])
+                text = ",\n".join(json.dumps(o, indent=4) for o in part.to_records())
+                f.write(text + (",\n" if a + chunk < n_orders else "\n"))
+            f.write("]")
+        json_write_s = time.perf_counter() - start
+        snapdir = os.path.join(tmp, "snapshot")
+        start = time.perf_counter()
+        ColumnarSnapshot(snapdir).write_orders(columns, orders_path)
+        snapshot_write_s = time.perf_counter() - start
+        json_mb = os.path.getsize(orders_path) / 2**20
+        snap_mb = sum(os.path.getsize(os.path.join(root, name))
+                      for root, _, names in os.walk(snapdir) for name in names) / 2**20
+        print(f"{n_orders} orders, {offsets[-1]} order lines: orders.json {json_mb:.0f} MB "
+              f"(written in {json_write_s:.0f} s), snapshot {snap_mb:.0f} MB (written in {snapshot_write_s:.1f} s)")
+
+        src = os.path.dirname(os.path.abspath(__file__))
+        for mode in ("json", "columnar", "records"):
+            code = _LOAD_SNIPPET.format(src=src, mode=mode, orders=orders_path, snapdir=snapdir)
+            proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"  {mode:>8}: failed (exit {proc.returncode}, e.g. killed for memory)")
+                results[mode] = None
+                continue
+            seconds, rss_mb, n = json.loads(proc.stdout)
+            results[mode] = {"seconds": seconds, "rss_mb": rss_mb}
+            print(f"  {mode:>8}: {seconds:8.2f} s, peak RSS {rss_mb:7.0f} MB")
+    return results
+
+
+def bench_orderbook(n_lines=1_000_000, n_products=5_000):
+    """
+    Memory per million line items and whole-history totals:
+      dicts     - the list of {order_id, customer_id, items: [[pid, qty], ...], total_cost} dicts
+      OrderBook - typed arrays (order.OrderBook)
+    plus Order.calculate_total per order vs OrderBook.calculate_totals, and the
+    sales report over each.
+    """
+    import tracemalloc
+    import numpy as np
+
+    n_orders = int(n_lines / 2.5)
+    products = {pid: {"price": float(pid % 97 + 1)} for pid in range(1, n_products + 1)}
+
+    tracemalloc.start()
+    orders = make_orders(n_orders, n_products=n_products)
+    dicts_mb = tracemalloc.get_traced_memory()[0] / 2**20
+    tracemalloc.stop()
+    lines = sum(len(o["items"]) for o in orders)
+
+    tracemalloc.start()
+    book = OrderBook(OrderColumns.from_records(orders))
+    book_mb = tracemalloc.get_traced_memory()[0] / 2**20
+    tracemalloc.stop()
+    per_million = 1_000_000 / lines
+    print(f"{n_orders} orders, {lines} line items")
+    print(f"  dicts:     {dicts_mb:7.1f} MB ({dicts_mb * per_million:6.1f} MB per million line items)")
+    print(f"  OrderBook: {book_mb:7.1f} MB ({book_mb * per_million:6.1f} MB per million line items)")
+
+    start = time.perf_counter()
+    loop_totals = [Order(o["order_id"], o["customer_id"], o["items"]).calculate_total(products) for o in orders]
+    loop_s = time.perf_counter() - start
+    start = time.perf_counter()
+    totals = book.calculate_totals(products)
+    vector_s = time.perf_counter() - start
+    assert np.allclose(totals, loop_totals)
+    print(f"  calculate_total per order: {loop_s * 1000:8.1f} ms   OrderBook.calculate_totals: {vector_s * 1000:8.1f} ms")
+
+    start = time.perf_counter()
+    report = generate_sales_report(orders, products)
+    report_loop_s = time.perf_counter() - start
+    start = time.perf_counter()
+    book_report = generate_sales_report(book, products)
+    report_book_s = time.perf_counter() - start
+    # Same ranking; the total only to rounding, as the two sum the order totals in a different order
+    report_lines, book_lines = report.splitlines(), book_report.splitlines()
+    assert report_lines[1:4] == book_lines[1:4]
+    assert math.isclose(float(report_lines[0].split("$")[1]), float(book_lines[0].split("$")[1]))
+    print(f"  sales report over dicts:   {report_loop_s * 1000:8.1f} ms   over the OrderBook:         "
+          f"{report_book_s * 1000:8.1f} ms")
+    return {"dicts_mb_per_million": dicts_mb * per_million, "book_mb_per_million": book_mb * per_million,
+            "calculate_total_ms": loop_s * 1000, "calculate_totals_ms": vector_s * 1000}
+
+
+def bench_order_index(n_orders=1_000_000, n_products=500, n_lookups=50):
+    """
+    Invoice lookup, customer history, orders containing a product and the
+    recommender's co-purchase counts: scanning the order list vs OrderIndex
+    (plus CoPurchaseIndex for the co-purchase counts), with equality checks.
+    """
+    orders = make_orders(n_orders, n_products=n_products)
+    book = OrderBook(orders)
+    rng = random.Random(3)
+    order_ids = [rng.randint(1, n_orders) for _ in range(n_lookups)]
+    customer_ids = [f"cust{rng.randint(1, 1000):06d}" for _ in range(n_lookups)]
+    product_ids = [rng.randint(1, n_products) for _ in range(n_lookups)]
+    carts = make_carts(n_lookups, n_products)
+
+    start = time.perf_counter()
+    index = OrderIndex(book)
+    build_s = time.perf_counter() - start
+    start = time.perf_counter()
+    copurchase = CoPurchaseIndex(orders)
+    copurchase_build_s = time.perf_counter() - start
+
+    def per_lookup_ms(fn, keys):
+        start = time.perf_counter()
+        results = [fn(key) for key in keys]
+        return (time.perf_counter() - start) * 1000 / len(keys), results
+
+    rows = []
+    scan_ms, scanned = per_lookup_ms(lambda oid: next(o for o in orders if o["order_id"] == oid), order_ids)
+    index_ms, found = per_lookup_ms(index.get, order_ids)
+    assert [o["order_id"] for o in scanned] == [o["order_id"] for o in found]
+    rows.append(("invoice (order_id)", scan_ms, index_ms))
+
+    scan_ms, scanned = per_lookup_ms(lambda c: [o["order_id"] for o in orders if o["customer_id"] == c],
+                                     customer_ids)
+    index_ms, found = per_lookup_ms(lambda c: [o["order_id"] for o in index.by_customer(c)], customer_ids)
+    assert scanned == found
+    rows.append(("customer history", scan_ms, index_ms))
+
+    scan_ms, scanned = per_lookup_ms(
+        lambda pid: [o["order_id"] for o in orders if any(p == pid for p, _ in o["items"])], product_ids[:10])
+    index_ms, found = per_lookup_ms(lambda pid: index.book.order_id[index.product_positions(pid)].tolist(),
+                                    product_ids[:10])
+    assert scanned == found
+    rows.append(("orders with a product", scan_ms, index_ms))
+
+    scan_ms, scanned = per_lookup_ms(lambda cart: dict(_scan_co_purchases(cart, orders)), carts[:10])
+    index_ms, found = per_lookup_ms(index.co_purchase_counts, carts[:10])
+    copurchase_ms, counted = per_lookup_ms(lambda cart: dict(copurchase.co_purchase_counts(cart)), carts[:10])
+    assert scanned == found == counted
+    rows.append(("co-purchase counts", scan_ms, index_ms))
+
+    print(f"{n_orders} orders, {book.n_lines} lines | OrderIndex build {build_s:.2f} s"
+          f" (CoPurchaseIndex {copurchase_build_s:.2f} s, {copurchase_ms:.2f} ms/cart)")
+    for name, scan_ms, index_ms in rows:
+        print(f"  {name:24s} scan {scan_ms:9.2f} ms   index {index_ms:7.3f} ms")
+    return {"orders": n_orders, "build_s": build_s, "copurchase_build_s": copurchase_build_s,
+            "copurchase_ms": copurchase_ms,
+            "lookups": {name: {"scan_ms": scan_ms, "index_ms": index_ms} for name, scan_ms, index_ms in rows}}
+
+
+_REPORT_SNIPPET = """
+import io, json, sys, time
+sys.path.insert(0, {src!r})
+from reports import generate_sales_report, iter_orders, stream_sales_report
+products = {{pid: {{"price": float(pid % 97 + 1)}} for pid in range(1, {n_products} + 1)}}
+start = time.perf_counter()
+sink = io.StringIO()
+if {mode!r} == "load":
+    with open({orders!r}) as f:
+        orders = json.load(f)
+    sink.write(generate_sales_report(orders, products, top_n=10))
+else:
+    stream_sales_report(iter_orders({orders!r}), products, sink, top_n=10)
+elapsed = time.perf_counter() - start
+with open("/proc/self/status") as f:
+    peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+print(json.dumps([elapsed, peak_kb / 1024, sink.getvalue()]))
+"""
+
+def bench_report(n_orders=2_000_000, n_products=5_000, chunk=100_000):
+    """
+    Sales report over a pretty-printed orders.json of `n_orders` orders, each way
+    in a fresh process (wall time and peak RSS):
+      load    - json.load of the whole list, then generate_sales_report
+      stream  - stream_sales_report over iter_orders (chunked reader, bounded memory)
+    Peak RSS of the streaming report stays flat as the file grows.
+    """
+    import subprocess
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        orders_path = os.path.join(tmp, "orders.json")
+        with open(orders_path, "w") as f:
+            f.write("[\n")
+            for a in range(0, n_orders, chunk):
+                part = make_orders(min(chunk, n_orders - a), n_products=n_products, seed=a)
+                text = ",\n".join(json.dumps(o, indent=4) for o in part)
+                f.write(text + (",\n" if a + chunk < n_orders else "\n"))
+            f.write("]")
+        print(f"{n_orders} orders: orders.json {os.path.getsize(orders_path) / 2**20:.0f} MB")
+
+        src = os.path.dirname(os.path.abspath(__file__))
+        reports = {}
+        for mode in ("load", "stream"):
+            code = _REPORT_SNIPPET.format(src=src, mode=mode, orders=orders_path, n_products=n_products)
+            proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"  {mode:>6}: failed (exit {proc.returncode}, e.g. killed for memory)")
+                results[mode] = None
+                continue
+            seconds, rss_mb, reports[mode] = json.loads(proc.stdout)
+            results[mode] = {"seconds": seconds, "rss_mb": rss_mb}
+            print(f"  {mode:>6}: {seconds:8.2f} s, peak RSS {rss_mb:7.0f} MB")
+        if len(reports) == 2:
+            assert reports["load"] == reports["stream"]
+    return results
+
+
+def bench_rollups(n_orders=1_000_000, n_products=5_000):
+    """
+    Total revenue, per-product revenue/units and per-customer spend: recomputed
+    from the order dicts, recomputed over the OrderBook arrays, and read from
+    SalesRollups (kept current in O(items) per order), plus the cost of
+    add_order, a save and a verify against a full recompute.
+    """
+    inventory_df = make_inventory(n_products)
+    products = inventory_df.set_index("id").to_dict("index")
+    orders = make_orders(n_orders, n_products=n_products)
+    book = OrderBook(orders)
+
+    start = time.perf_counter()
+    total = sum(o["total_cost"] for o in orders)
+    revenue, units, spend = {}, {}, {}
+    for o in orders:
+        for pid, qty in o["items"]:
+            revenue[pid] = revenue.get(pid, 0) + products[pid]["price"] * qty
+            units[pid] = units.get(pid, 0) + qty
+        spend[o["customer_id"]] = spend.get(o["customer_id"], 0) + o["total_cost"]
+    scan_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    SalesRollups.from_book(book, inventory_df)
+    book_ms = (time.perf_counter() - start) * 1000
+
+    rollups = SalesRollups()
+    start = time.perf_counter()
+    for o in orders:
+        rollups.add_order(o, products)
+    add_us = (time.perf_counter() - start) * 1e6 / n_orders
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        rollups.total_revenue, rollups.customer("cust0001"), rollups.product(1)
+    read_us = (time.perf_counter() - start) * 1e6 / 1000
+    start = time.perf_counter()
+    top = rollups.top_products(10)
+    top_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    mismatched = rollups.verify(book)
+    verify_ms = (time.perf_counter() - start) * 1000
+    assert not mismatched, mismatched
+    assert math.isclose(rollups.total_revenue, total) and rollups.product_units == units
+    assert top == sorted(revenue.items(), key=lambda x: x[1], reverse=True)[:10]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = JsonStorage(rollups_file=os.path.join(tmp, "rollups.json"), lock_file=os.path.join(tmp, "lock"))
+        start = time.perf_counter()
+        storage.save_rollups(rollups.to_dict())
+        save_ms = (time.perf_counter() - start) * 1000
+        assert SalesRollups.from_dict(storage.load_rollups()).stats() == rollups.stats()
+
+    print(f"{n_orders} orders, {n_products} products")
+    print(f"  recompute over dicts {scan_ms:8.1f} ms | over the OrderBook {book_ms:6.1f} ms |"
+          f" rollup reads {read_us:.2f} us, top 10 {top_ms:.2f} ms")
+    print(f"  add_order {add_us:.2f} us/order | save {save_ms:.1f} ms | verify {verify_ms:.1f} ms")
+    return {"scan_ms": scan_ms, "book_ms": book_ms, "read_us": read_us, "top_ms": top_ms,
+            "add_us": add_us, "save_ms": save_ms, "verify_ms": verify_ms}
+
+
+def bench_time_rollups(n_orders=1_000_000, n_products=5_000, days=365):
+    """
+    Daily revenue over a year and one month's top products: grouped from the
+    timestamped order lines on every request vs read from TimeRollups (built
+    once from the OrderBook, then kept current in O(items) per order).
+    """
+    inventory_df = make_inventory(n_products)
+    products = inventory_df.set_index("id").to_dict("index")
+    orders = make_orders(n_orders, n_products=n_products)
+    start_day = parse_date("2024-01-01")
+    for i, o in enumerate(orders):
+        o["placed_at"] = start_day + days * 86400 * (i + 0.5) / n_orders
+    book = OrderBook(orders)
+    month_start, month_end = parse_date("2024-06-01"), parse_date("2024-07-01")
+
+    start = time.perf_counter()
+    lines = pd.DataFrame({"day": (book.placed_at[book.line_orders()] // 86400).astype("int64"),
+                          "product_id": book.product_id, "subtotal": book.line_prices(inventory_df) * book.qty})
+    daily_scan = lines.groupby("day")["subtotal"].sum()
+    in_month = lines[(lines["day"] >= month_start // 86400) & (lines["day"] < month_end // 86400)]
+    top_scan = in_month.groupby("product_id")["subtotal"].sum().nlargest(10)
+    scan_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    rollups = TimeRollups.from_book(book, inventory_df)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    daily = rollups.series("day", start_day, start_day + days * 86400 - 1)
+    series_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    period = rollups.period(month_start, month_end, top_n=10)
+    period_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    rollups.series("day", start_day, start_day + days * 86400 - 1, product_id=1)
+    product_ms = (time.perf_counter() - start) * 1000
+    # Per-line revenue is at current prices in both, so the day totals agree with the line sums
+    assert len(daily) == days and math.isclose(daily["units"].sum(), int(book.qty.sum()))
+    assert [pid for pid, _, _ in period["top_products"]] == top_scan.index.tolist()
+
+    incremental = TimeRollups()
+    n_add = min(n_orders, 100_000)
+    start = time.perf_counter()
+    for o in orders[:n_add]:
+        incremental.add_order(o, products)
+    add_us = (time.perf_counter() - start) * 1e6 / n_add
+
+    print(f"{n_orders} orders over {days} days, {n_products} products")
+    print(f"  group the order lines {scan_ms:8.1f} ms | build from the OrderBook {build_ms:6.1f} ms")
+    print(f"  daily series {series_ms:.2f} ms | one product's daily series {product_ms:.2f} ms |"
+          f" month's top 10 {period_ms:.2f} ms | add_order {add_us:.1f} us/order")
+    return {"scan_ms": scan_ms, "build_ms": build_ms, "series_ms": series_ms, "product_ms": product_ms,
+            "period_ms": period_ms, "add_us": add_us}
+
+
+def bench_insights(latency=0.5, n_requests=40, n_distinct=5, workers=5):
+    """
+    AI insights with the offline LocalProvider standing in for a `latency`-second
+    model call. `n_requests` clicks from concurrent sessions over `n_distinct`
+    different prompt inputs:
+      blocking  - one synchronous provider call per click, on the clicking thread
+      service   - InsightsService: submit() returns at once, identical in-flight
+                  requests share a call, answers are cached
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    inputs = [{"total_sales": 1000.0 * i, "most_popular": f"Product {i}"} for i in range(n_distinct)]
+    requests = [inputs[i % n_distinct] for i in range(n_requests)]
+
+    provider = LocalProvider(latency)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_requests) as sessions:
+        blocking = list(sessions.map(lambda x: provider.complete(PROMPT_TEMPLATE.format(**x), 60), requests))
+    blocking_s = time.perf_counter() - start
+
+    service = InsightsService(LocalProvider(latency), workers=workers)
+    start = time.perf_counter()
+    futures = [service.submit(x)[1] for x in requests]
+    submit_us = (time.perf_counter() - start) * 1e6 / n_requests
+    answers = [f.result() for f in futures]
+    service_s = time.perf_counter() - start
+    assert answers == blocking
+
+    start = time.perf_counter()
+    cached = [service.submit(x)[1].result() for x in requests]
+    cached_us = (time.perf_counter() - start) * 1e6 / n_requests
+    assert cached == blocking
+    stats = service.stats()
+
+    print(f"{n_requests} requests over {n_distinct} distinct inputs, provider latency {latency * 1000:.0f} ms")
+    print(f"  blocking: {blocking_s:6.2f} s wall, {provider.calls} provider calls, each click waits"
+          f" {latency * 1000:.0f} ms")
+    print(f"  service:  {service_s:6.2f} s wall, {stats['provider_calls']} provider calls, submit() returns in"
+          f" {submit_us:.0f} us; cached answer {cached_us:.1f} us")
+    print(f"  {stats}")
+    return {"blocking_s": blocking_s, "service_s": service_s, "submit_us": submit_us, "cached_us": cached_us,
+            "blocking_calls": provider.calls, "service_calls": stats["provider_calls"]}
+
+
+def bench_perf(n_calls=1_000_000):
+    """
+    Overhead of perf instrumentation per call: a bare function, the same function
+    under @perf.timed with recording off (the default) and on, and perf.timer.
+    """
+    def bare(x):
+        return x
+
+    timed = perf.timed("bench.noop")(bare)
+    was_enabled = perf.enabled()
+    results = {}
+    try:
+        for label, fn in [("bare", bare), ("timed, off", timed), ("timed, on", timed)]:
+            perf.enable(label == "timed, on")
+            start = time.perf_counter()
+            for i in range(n_calls):
+                fn(i)
+            results[label] = (time.perf_counter() - start) * 1e9 / n_calls
+        perf.enable(True)
+        start = time.perf_counter()
+        for i in range(n_calls):
+            with perf.timer("bench.block"):
+                pass
+        results["timer, on"] = (time.perf_counter() - start) * 1e9 / n_calls
+    finally:
+        perf.enable(was_enabled)
+        perf.reset()
+    for label, ns in results.items():
+        print(f"  {label:12s} {ns:7.0f} ns/call ({ns - results['bare']:+.0f} ns)")
+    return results
+
+
+BENCHMARKS = {
+    "checkout": bench_checkout,
+    "copurchase": bench_copurchase,
+    "similarity": bench_similarity,
+    "ann": bench_ann,
+    "batch": bench_batch,
+    "analytics": bench_analytics,
+    "charts": bench_charts,
+    "search": bench_search,
+    "sessions": bench_sessions,
+    "checkout_stress": bench_checkout_stress,
+    "cart": bench_cart,
+    "snapshot": bench_snapshot,
+    "orderbook": bench_orderbook,
+    "order_index": bench_order_index,
+    "report": bench_report,
+    "rollups": bench_rollups,
+    "time_rollups": bench_time_rollups,
+    "insights": bench_insights,
+    "perf": bench_perf,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name]()
@@ -0,0 +1,150 @@
+import atexit
+import os
+import threading
+import time
+
+import perf
+
+# Seconds a cart change may sit in memory before it is written; 0 writes on every change
+CART_FLUSH_INTERVAL = float(os.getenv("ECOMMERCE_CART_FLUSH_INTERVAL", "2"))
+# Carts not touched for this many seconds are dropped (memory and disk)
+CART_TTL = float(os.getenv("ECOMMERCE_CART_TTL", str(24 * 3600)))
+# How often the flusher looks for expired carts
+EXPIRE_EVERY = 60.0
+
+
+class CartStore:
+    """
+    Open carts ({customer_id: {order_num: {"order_items": [...], "total": ...}}},
+    the old bill_for_all.json layout) kept in memory with write-behind persistence.
+
+    Changes only mark the customer dirty. A background flusher writes all dirty
+    customers in one save_bill call at most every `flush_interval` seconds, so
+    a burst of add-to-carts costs one write instead of one full rewrite each.
+    The storage swaps files in atomically (temp file + rename). Call flush() to
+    make a change durable right away (checkout does); pending changes are also
+    flushed at interpreter exit.
+
+    Carts untouched for `ttl` seconds are expired. Carts loaded at startup count
+    as touched then, since the file keeps no timestamps.
+
+    Order numbers are ints: both backends hand them back as strings (JSON object
+    keys, a TEXT column), so they are converted on load and on every lookup.
+    """
+
+    def __init__(self, storage, flush_interval=CART_FLUSH_INTERVAL, ttl=CART_TTL):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self.bill = {cust: {int(num): cart for num, cart in carts.items()}
+                     for cust, carts in storage.load_bill().items()}
+        now = time.time()
+        self.touched = {(cust, num): now for cust, carts in self.bill.items() for num in carts}
+        self.dirty = set()
+        self.flushes = 0
+        self._last_expire = now
+        self._wakeup = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def get(self, customer_id, order_num):
+        return self.bill.get(customer_id, {}).get(int(order_num))
+
+    def add_item(self, customer_id, order_num, item):
+        """
+        Appends `item` ({"product_id", "product_name", "qty", "subtotal"}) to the
+        cart and returns the cart.
+        """
+        order_num = int(order_num)
+        with self.lock:
+            cart = self.bill.setdefault(customer_id, {}).setdefault(order_num, {"order_items": [], "total": 0.0})
+            cart["order_items"].append(item)
+            cart["total"] = float(sum(i["subtotal"] for i in cart["order_items"]))
+            self.touched[(customer_id, order_num)] = time.time()
+            self.dirty.add(customer_id)
+        self._schedule()
+        return cart
+
+    def remove(self, customer_id, order_num):
+        order_num = int(order_num)
+        with self.lock:
+            carts = self.bill.get(customer_id, {})
+            cart = carts.pop(order_num, None)
+            if not carts:
+                self.bill.pop(customer_id, None)
+            self.touched.pop((customer_id, order_num), None)
+            self.dirty.add(customer_id)
+            return cart
+
+    def _schedule(self):
+        # Called without self.lock held: flush() takes the flush lock first
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        with self.lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cart-flusher", daemon=True)
+                self._thread.start()
+
+    def expire(self, now=None):
+        """
+        Drops carts idle for longer than the TTL. Returns how many were dropped.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            expired = [key for key, t in self.touched.items() if now - t > self.ttl]
+            for customer_id, order_num in expired:
+                self.remove(customer_id, order_num)
+            self._last_expire = now
+            return len(expired)
+
+    @perf.timed("carts.flush")
+    def flush(self):
+        """
+        Writes every dirty customer's carts now, in one save. Don't call it while
+        holding the storage lock: the flusher thread takes the two the other way round.
+        """
+        # One flush at a time, so an older snapshot can never be written over a newer one
+        with self._flush_lock:
+            with self.lock:
+                if not self.dirty:
+                    return 0
+                dirty, self.dirty = self.dirty, set()
+                # Copy the carts so adds made while the file is being written don't race the encoder
+                snapshot = {cust: {num: {"order_items": list(cart["order_items"]), "total": cart["total"]}
+                                   for num, cart in self.bill[cust].items()}
+                            for cust in dirty if cust in self.bill}
+            try:
+                self.storage.save_bill(snapshot, changed_customers=sorted(dirty))
+            except Exception:
+                # Keep them dirty so the next flush retries
+                with self.lock:
+                    self.dirty |= dirty
+                raise
+            self.flushes += 1
+            return len(dirty)
+
+    def _run(self):
+        while not self._wakeup.wait(self.flush_interval):
+            try:
+                if time.time() - self._last_expire >= EXPIRE_EVERY:
+                    self.expire()
+                self.flush()
+            except Exception:
+                # A failed write (disk full, locked DB) is retried on the next tick
+                pass
+
+    def stop(self):
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._wakeup.clear()
+        self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {"customers": len(self.bill), "carts": len(self.touched), "dirty": len(self.dirty),
+                    "flushes": self.flushes, "flush_interval": self.flush_interval, "ttl": self.ttl}
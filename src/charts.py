@@ -0,0 +1,263 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from analytics import product_sales, sold_counts
+import perf
+
+# Rendered PNGs kept across reruns and sessions, evicted least-recently-used past this size
+CHART_CACHE_BYTES = int(os.getenv("ECOMMERCE_CHART_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Processes used to render charts that are not cached; 0 or 1 renders them one by one
+CHART_WORKERS = int(os.getenv("ECOMMERCE_CHART_WORKERS", str(min(os.cpu_count() or 1, 8))))
+
+
+def fig_to_png_bytes(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    buf.seek(0)
+    return buf.getvalue()
+
+
+### Chart builders: each takes the page data and returns a matplotlib figure ###
+
+def popularity_bar(data):
+    inv_df = data["inventory"]
+    fig, ax = plt.subplots()
+    ax.bar(inv_df["name"], inv_df["popularity"])
+    ax.set_xlabel("Products")
+    ax.set_ylabel("Popularity")
+    ax.set_title("Product Popularity")
+    ax.tick_params(axis="x", rotation=45)
+    fig.tight_layout()
+    return fig
+
+def sales_share_pie(data):
+    sales_by_product = product_sales(data["order_lines"]).to_dict()
+    fig, ax = plt.subplots()
+    ax.pie(sales_by_product.values(), labels=sales_by_product.keys(), autopct='%1.1f%%')
+    ax.set_title("Contribution to Total Sales")
+    return fig
+
+def sales_over_time_line(data):
+    # Revenue per month, read from the time rollups (time_rollups.TimeRollups.series)
+    sales_over_time = data.get("sales_over_time")
+    fig, ax = plt.subplots()
+    if sales_over_time is None or sales_over_time.empty:
+        ax.text(0.5, 0.5, "No timestamped orders yet", ha="center", va="center", transform=ax.transAxes)
+    else:
+        ax.plot(sales_over_time["period"], sales_over_time["revenue"], marker='o')
+        ax.set_ylabel("Revenue")
+        # At most ~12 labels, however many months there are
+        step = max(1, len(sales_over_time) // 12)
+        ax.set_xticks(range(0, len(sales_over_time), step))
+        ax.set_xticklabels(sales_over_time["period"].iloc[::step])
+        ax.tick_params(axis="x", rotation=45)
+    ax.set_title("Sales Over Time")
+    fig.tight_layout()
+    return fig
+
+def price_popularity_scatter(data):
+    inv_df = data["inventory"]
+    fig, ax = plt.subplots()
+    ax.scatter(inv_df["price"], inv_df["popularity"])
+    ax.set_xlabel("Price")
+    ax.set_ylabel("Popularity")
+    ax.set_title("Price vs. Popularity")
+    return fig
+
+def stock_sold_stacked_bar(data):
+    inv_df = data["inventory"]
+    sold = sold_counts(data["order_lines"], inv_df["id"]).tolist()
+    fig, ax = plt.subplots()
+    ax.bar(inv_df["name"], inv_df["stock"], label="Stock", alpha=0.7)
+    ax.bar(inv_df["name"], sold, bottom=inv_df["stock"], label="Sold", alpha=0.7)
+    ax.tick_params(axis="x", rotation=45)
+    ax.set_title("Stock vs. Sold Stacked Bar")
+    ax.legend()
+    return fig
+
+def price_barh(data):
+    inv_df = data["inventory"]
+    fig, ax = plt.subplots()
+    ax.barh(inv_df["name"], inv_df["price"])
+    ax.set_xlabel("Price")
+    ax.set_title("Product Price (Horizontal)")
+    return fig
+
+def price_boxplot(data):
+    fig, ax = plt.subplots()
+    ax.boxplot(data["inventory"]["price"], vert=False)
+    ax.set_title("Boxplot of Product Prices")
+    return fig
+
+def popularity_by_name_line(data):
+    sorted_inv = data["inventory"].sort_values(by="name")
+    fig, ax = plt.subplots()
+    ax.plot(sorted_inv["name"], sorted_inv["popularity"], marker='o')
+    ax.set_title("Popularity by Product (alphabetical)")
+    ax.tick_params(axis="x", rotation=45)
+    return fig
+
+
+# (name, builder, inventory columns it reads, order-line columns it reads or None)
+# Charts are independent jobs: each one only gets the columns listed here.
+CHARTS = [
+    ("popularity", popularity_bar, ["name", "popularity"], None),
+    ("sales_share", sales_share_pie, ["id", "name", "price"], ["product_name", "subtotal"]),
+    ("sales_over_time", sales_over_time_line, [], []),
+    ("price_vs_popularity", price_popularity_scatter, ["price", "popularity"], None),
+    ("stock_vs_sold", stock_sold_stacked_bar, ["id", "name", "stock"], ["product_id", "quantity"]),
+    ("price_barh", price_barh, ["name", "price"], None),
+    ("price_boxplot", price_boxplot, ["price"], None),
+    ("popularity_by_name", popularity_by_name_line, ["name", "popularity"], None),
+]
+BUILDERS = {name: builder for name, builder, _, _ in CHARTS}
+
+
+class ChartCache:
+    """
+    PNG bytes per (chart, input version), LRU-evicted once the total size
+    passes `max_bytes`. Shared by every session in the process.
+    """
+
+    def __init__(self, max_bytes=CHART_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            png = self.entries.get(key)
+            if png is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return png
+
+    def put(self, key, png):
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = png
+            self.size += len(png)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+chart_cache = ChartCache()
+
+
+def chart_key(name, columns, order_columns, inventory_df, orders_version):
+    """
+    What a chart's image depends on: a hash of the inventory columns it reads
+    and, for order-based charts, the orders version. A stock-only change thus
+    leaves e.g. the popularity chart cached.
+    """
+    inventory_hash = None
+    if columns:
+        row_hashes = pd.util.hash_pandas_object(inventory_df[columns], index=False).to_numpy()
+        inventory_hash = hashlib.sha1(row_hashes.tobytes()).hexdigest()
+    return (name, inventory_hash, orders_version if order_columns is not None else None)
+
+
+@perf.timed("charts.render_png")
+def render_png(builder, data):
+    fig = builder(data)
+    try:
+        return fig_to_png_bytes(fig)
+    finally:
+        # Figures are closed as soon as they are encoded so reruns don't pile them up
+        plt.close(fig)
+
+
+def chart_job(data, columns, order_columns):
+    """
+    The slice of the page data one chart needs, small enough to ship to a worker.
+    """
+    job = {"inventory": data["inventory"][columns], "sales_over_time": data.get("sales_over_time")}
+    if order_columns:
+        job["order_lines"] = data["order_lines"][order_columns]
+    return job
+
+
+def _init_worker():
+    # Workers never show a window; Agg only rasterizes to PNG
+    matplotlib.use("Agg")
+
+def _render_in_worker(name, job):
+    return render_png(BUILDERS[name], job)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool(workers):
+    # One pool per process, reused by every rerun and session
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker)
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+@perf.timed("charts.render_charts")
+def render_charts(data, orders_version, workers=CHART_WORKERS):
+    """
+    Returns [(name, png_bytes)] for every chart in CHARTS, rendering only the
+    ones whose inputs changed since they were last cached. Charts to render go
+    to a process pool when `workers` > 1 (so the page waits about as long as
+    the slowest chart), and are rendered one by one otherwise or if the pool fails.
+    """
+    pngs = {}
+    missing = []
+    for name, builder, columns, order_columns in CHARTS:
+        key = chart_key(name, columns, order_columns, data["inventory"], orders_version)
+        png = chart_cache.get(key)
+        if png is None:
+            missing.append((name, key, chart_job(data, columns, order_columns)))
+        else:
+            pngs[name] = png
+
+    rendered = None
+    if workers and workers > 1 and len(missing) > 1:
+        try:
+            pool = _get_pool(workers)
+            futures = [(name, key, pool.submit(_render_in_worker, name, job)) for name, key, job in missing]
+            rendered = [(name, key, future.result()) for name, key, future in futures]
+        except Exception:
+            # Broken or unavailable pool: drop it and fall back to rendering here
+            _reset_pool()
+            rendered = None
+    if rendered is None:
+        rendered = [(name, key, render_png(BUILDERS[name], job)) for name, key, job in missing]
+
+    for name, key, png in rendered:
+        chart_cache.put(key, png)
+        pngs[name] = png
+    return [(name, pngs[name]) for name, _, _, _ in CHARTS]
@@ -0,0 +1,103 @@
+import os
+import time
+from collections import Counter
+
+from order import Order
+import perf
+
+# A cart's stock reservation lapses this many seconds after its last add-to-cart
+RESERVATION_TTL = float(os.getenv("ECOMMERCE_RESERVATION_TTL", "900"))
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id, requested, available):
+        super().__init__(f"Product {product_id}: {requested} requested, {max(available, 0)} available")
+        self.product_id = product_id
+        self.requested = requested
+        self.available = max(available, 0)
+
+
+def cart_key(customer_id, order_num):
+    return f"{customer_id}:{order_num}"
+
+
+def _held_by_others(ledger, cart, product_id):
+    own = ledger.get(cart)
+    held = sum(entry["items"].get(product_id, 0) for entry in ledger.values())
+    return held - (own["items"].get(product_id, 0) if own is not None else 0)
+
+
+@perf.timed("checkout.reserve")
+def reserve(storage, cart, product_id, qty, ttl=RESERVATION_TTL, now=None):
+    """
+    Adds `qty` of `product_id` to the stock held for `cart`, or raises
+    InsufficientStock if the stock on disk minus what other carts hold can't
+    cover the cart's total. Adding to a cart renews its whole reservation.
+    """
+    now = time.time() if now is None else now
+    with storage.exclusive():
+        stock = storage.read_stock([product_id]).get(product_id, 0)
+        ledger = storage.load_reservations(now)
+        items = dict(ledger[cart]["items"]) if cart in ledger else {}
+        wanted = items.get(product_id, 0) + qty
+        available = stock - _held_by_others(ledger, cart, product_id)
+        if wanted > available:
+            raise InsufficientStock(product_id, qty, available - items.get(product_id, 0))
+        items[product_id] = wanted
+        # A new entry rather than an edit: the storage may hand out its cached ones
+        ledger[cart] = {"expires_at": now + ttl, "items": items}
+        storage.save_reservations(ledger, changed_carts=[cart])
+
+
+def release(storage, cart, now=None):
+    now = time.time() if now is None else now
+    with storage.exclusive():
+        ledger = storage.load_reservations(now)
+        if ledger.pop(cart, None) is not None:
+            storage.save_reservations(ledger, changed_carts=[cart])
+
+
+@perf.timed("checkout.place_order")
+def place_order(storage, customer_id, cart, items, products, now=None):
+    """
+    The atomic part of checkout, run under the storage's exclusive lock:
+
+    1. checks every item against the stock on disk minus what other carts hold
+       (the cart's own reservation is what it is about to buy)
+    2. takes the next id from the order-id sequence
+    3. writes the reduced stock and the order, and drops the cart's reservation
+
+    Raises InsufficientStock before anything is written. Returns
+    (order record, {product_id: new stock}). Callers that persist more in the
+    same checkout (e.g. the cart) wrap this in `storage.transaction()`.
+    """
+    now = time.time() if now is None else now
+    wanted = Counter()
+    for pid, qty in items:
+        wanted[pid] += qty
+
+    with storage.exclusive():
+        stock = storage.read_stock(wanted)
+        ledger = storage.load_reservations(now)
+        for pid, qty in wanted.items():
+            available = stock.get(pid, 0) - _held_by_others(ledger, cart, pid)
+            if qty > available:
+                raise InsufficientStock(pid, qty, available)
+
+        order = Order(storage.next_order_id(), customer_id, items)
+        order.calculate_total(products)
+        order_record = {
+            "order_id": order.order_id,
+            "customer_id": order.customer_id,
+            "items": items,
+            "total_cost": order.total_cost,
+            # Epoch seconds; time_rollups.TimeRollups buckets sales by it
+            "placed_at": now
+        }
+
+        new_stock = {pid: stock[pid] - qty for pid, qty in wanted.items()}
+        storage.update_stock(new_stock)
+        storage.save_order(order_record)
+        if ledger.pop(cart, None) is not None:
+            storage.save_reservations(ledger, changed_carts=[cart])
+    return order_record, new_stock
@@ -1,4 +1,6 @@
 class Customer:
+    __slots__ = ("customer_id", "name", "purchase_history")
+
     def __init__(self, customer_id, name, purchase_history=None):
         # purchase_history could be a list of order_ids or a list of tuples (order_id, product_list)
         self.customer_id = customer_id
@@ -0,0 +1,281 @@
+import atexit
+import threading
+
+import pandas as pd
+
+from analytics import OrderLinesTable
+from cart_store import CartStore
+from checkout import cart_key, place_order
+from data_versions import get_version, bump_version
+from order_index import OrderIndex
+import perf
+from recommender import recommendation_cache
+from registry import CatalogIndex, CustomerRegistry
+from sales_rollups import ROLLUP_SAVE_EVERY, SalesRollups
+from search_index import ProductSearchIndex
+from storage import get_storage
+from time_rollups import TimeRollups, backfill_timestamps
+
+
+class DataStore:
+    """
+    The app's data, loaded once per server process and shared by every
+    Streamlit session: inventory, orders, customers and open carts, plus the
+    indexes derived from them.
+
+    Sessions read the attributes directly and make changes through the methods
+    below (or inside `with store.lock:`), which persist the change, keep the
+    indexes current and bump the data version. Anything cached per version is
+    therefore refreshed for all sessions at once.
+
+    Replaced objects (e.g. the inventory DataFrame after a product is deleted)
+    are swapped in whole, so a session that is halfway through a rerun keeps a
+    consistent view of the old one.
+    """
+
+    @perf.timed("store.load")
+    def __init__(self, storage):
+        self.storage = storage
+        self.lock = threading.RLock()
+        self._load()
+        atexit.register(self.save_rollups)
+        self.customers = storage.load_customers()
+        self.customer_registry = CustomerRegistry(self.customers)
+        self.carts = CartStore(storage)
+
+    def _load(self):
+        # Inventory and orders, and everything derived from them. The stamp is taken
+        # first, so a change made while loading still shows up in refresh() (at worst
+        # one extra reload, if loading wrote the orders file itself, e.g. compacting it)
+        self._stamp = self.storage.change_stamp()
+        self.inventory_df = self.storage.load_inventory()
+        self.catalog = CatalogIndex(self.inventory_df)
+        self.search_index = ProductSearchIndex(self.inventory_df)
+        # Typed arrays rather than a dict per order (see order.OrderBook)
+        self.orders = self.storage.load_order_book()
+        # Lookups by order_id / customer / product; also the recommender's co-purchase counts
+        self.order_index = OrderIndex(self.orders)
+        self.order_lines = OrderLinesTable(self.orders)
+        self.rollups = self._load_rollups()
+        self._rollup_unsaved = 0
+        # Sales per hour/day/month: built from the orders on first use (see the time_rollups property)
+        self._time_rollups = None
+
+    def refresh(self):
+        """
+        Reloads the inventory and orders if they changed on disk since they were
+        loaded. For processes that don't take the checkouts themselves (the app
+        run against an API server, see service.API_URL), whose copy otherwise
+        never sees them. Returns whether anything was reloaded.
+        """
+        with self.lock:
+            if self.storage.change_stamp() == self._stamp:
+                return False
+            self._load()
+        bump_version("inventory")
+        self.orders_changed()
+        return True
+
+    def _load_rollups(self):
+        # The saved rollups plus the orders placed since, checked against a full
+        # recompute; rebuilt from the orders if they disagree (or were never saved)
+        rollups = SalesRollups.from_dict(self.storage.load_rollups())
+        if rollups is not None:
+            prices = {pid: {"price": price}
+                      for pid, price in zip(self.inventory_df["id"].tolist(), self.inventory_df["price"].tolist())}
+            replayed = rollups.catch_up(self.orders, prices)
+            if not rollups.verify(self.orders):
+                if replayed:
+                    self.storage.save_rollups(rollups.to_dict())
+                return rollups
+        rollups = SalesRollups.from_book(self.orders, self.inventory_df)
+        self.storage.save_rollups(rollups.to_dict())
+        return rollups
+
+    @property
+    def time_rollups(self):
+        """
+        The time_rollups.TimeRollups over every order. Built from the order book
+        the first time it is read (nothing is saved: a build is a few array passes),
+        then kept current by add_order().
+        """
+        with self.lock:
+            if self._time_rollups is None:
+                self._time_rollups = TimeRollups.from_book(self.orders, self.inventory_df)
+            return self._time_rollups
+
+    def rollups_snapshot(self):
+        # add_order updates self.rollups in place; reports iterate over a copy taken under the lock
+        with self.lock:
+            return self.rollups.copy()
+
+    def save_rollups(self):
+        with self.lock:
+            if self._rollup_unsaved:
+                self.storage.save_rollups(self.rollups.to_dict())
+                self._rollup_unsaved = 0
+
+    def close(self):
+        """
+        Writes pending carts and rollups and stops the cart flusher. Only needed for
+        stores that don't live until exit (scripts, benchmarks).
+        """
+        self.carts.stop()
+        self.save_rollups()
+        atexit.unregister(self.save_rollups)
+        atexit.unregister(self.carts.flush)
+
+    def version(self, name):
+        return get_version(name)
+
+    def get_customer(self, customer_id):
+        return self.customer_registry.get(customer_id)
+
+    def update_inventory(self, new_df, changed_ids=None, stock_ids=()):
+        """
+        Saves product changes. changed_ids lets the storage write only those rows.
+        Stock is only taken from `new_df` for `stock_ids` (and new products): every
+        other product keeps its stock on disk, which checkouts may have moved on
+        since this copy was loaded (e.g. in another process).
+        """
+        with self.lock, self.storage.exclusive():
+            saved = new_df["id"] if changed_ids is None else new_df["id"][new_df["id"].isin(changed_ids)]
+            stock_ids = set(int(pid) for pid in stock_ids)
+            keep = [pid for pid in saved.tolist() if pid not in stock_ids]
+            on_disk = self.storage.read_stock(keep) if keep else {}
+            if on_disk:
+                if new_df is self.inventory_df:
+                    new_df = new_df.copy()
+                labels = new_df.index[new_df["id"].isin(on_disk)]
+                new_df.loc[labels, "stock"] = new_df.loc[labels, "id"].map(on_disk).to_numpy()
+            self.inventory_df = new_df
+            self.catalog.sync(new_df)
+            self.search_index.sync(new_df, changed_ids, self.catalog)
+            self.storage.save_inventory(new_df, changed_ids)
+            bump_version("inventory")
+            recommendation_cache.invalidate()
+
+    def apply_stock(self, stock):
+        """
+        Copies stock levels already written by checkout ({product_id: stock}) into the
+        shared inventory. Only the stock column changes, so the search index stays as is
+        and only the "stock" version moves: similarity scoring never reads stock, so the
+        engine and cached recommendations built for this inventory version stay valid.
+        """
+        with self.lock:
+            for pid, qty in stock.items():
+                label = self.catalog.row_label(pid)
+                if label is not None:
+                    self.inventory_df.at[label, "stock"] = int(qty)
+            bump_version("stock")
+
+    def add_customer(self, customer_id):
+        with self.lock:
+            if customer_id in self.customer_registry:
+                return False
+            self.customer_registry.add({"customer_id": customer_id, "name": customer_id})
+            self.storage.save_customers(self.customers, changed_ids=[customer_id])
+            return True
+
+    def add_order(self, order, products):
+        """
+        Records an order that checkout.place_order has saved in the orders book,
+        the order index, the order-lines table and the sales rollups (`products`
+        holds the prices it was placed at). Call it inside
+        `with store.lock, store.storage.transaction():` together with
+        place_order, then call orders_changed() once the transaction is done.
+        """
+        with self.lock:
+            self.order_index.insert(order)
+            self.order_lines.add_order(order)
+            self.rollups.add_order(order, products)
+            if self._time_rollups is not None:
+                self._time_rollups.add_order(order, products)
+            self._rollup_unsaved += 1
+            if self._rollup_unsaved >= ROLLUP_SAVE_EVERY:
+                self.save_rollups()
+
+    def backfill_timestamps(self, start, end=None):
+        """
+        Gives the orders placed before checkout recorded times one, spread over
+        [start, end) (see time_rollups.backfill_times), on disk and in memory.
+        Returns how many orders were changed.
+        """
+        with self.lock:
+            times = backfill_timestamps(self.storage, start, end)
+            positions = [self.order_index.position(oid) for oid in times]
+            known = [(pos, t) for pos, t in zip(positions, times.values()) if pos is not None]
+            if known:
+                self.orders.set_placed_at([pos for pos, _ in known], [t for _, t in known])
+            self._time_rollups = None
+        self.orders_changed()
+        return len(times)
+
+    @perf.timed("store.checkout")
+    def checkout(self, customer_id, order_num):
+        """
+        Places the order for a customer's cart: stock check, order id, stock
+        deduction, order, indexes, rollups and the emptied cart, committed together
+        under the storage lock (which other server processes share). Returns the
+        order record, or None if there is no such cart. Raises
+        checkout.InsufficientStock without changing anything.
+        """
+        cart = self.carts.get(customer_id, order_num)
+        if cart is None:
+            return None
+        items = [(item["product_id"], item["qty"]) for item in cart["order_items"]]
+        products = {pid: self.catalog.get(pid) for pid, _ in items}
+        with self.lock, self.storage.exclusive():
+            order_record, new_stock = place_order(self.storage, customer_id, cart_key(customer_id, order_num),
+                                                  items, products)
+            self.apply_stock(new_stock)
+            self.add_order(order_record, products)
+            self.carts.remove(customer_id, order_num)
+        # The emptied cart is written right away rather than on the next flush
+        # (outside the storage lock, see CartStore.flush)
+        self.carts.flush()
+        self.orders_changed()
+        return order_record
+
+    @perf.timed("store.invoice")
+    def invoice(self, order_id):
+        """
+        The order's lines as a DataFrame (product, quantity, current price,
+        subtotal, order totals), or None for an unknown order id.
+        """
+        placed_order = self.order_index.get(order_id)
+        if placed_order is None:
+            return None
+        catalog = self.catalog
+        df = pd.DataFrame(placed_order["items"], columns=["product_id", "quantity"])
+        df["product_name"] = df["product_id"].apply(lambda x: catalog.value(x, "name", ""))
+        df["price"] = df["product_id"].apply(lambda x: float(catalog.value(x, "price", 0.0)))
+        df["subtotal"] = df["price"] * df["quantity"]
+        df["order_id"] = placed_order["order_id"]
+        df["customer_id"] = placed_order["customer_id"]
+        df["total_cost"] = placed_order["total_cost"]
+        return df
+
+    def customer_orders(self, customer_id):
+        # A customer's purchase history, from the order index
+        return self.order_index.by_customer(customer_id)
+
+    def orders_changed(self):
+        bump_version("orders")
+        recommendation_cache.invalidate()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_data_store(storage=None):
+    """
+    Returns the process-wide DataStore, loading it on first use. Streamlit
+    re-executes main.py on every rerun but imports modules once, so the store
+    outlives reruns and is shared by every session.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DataStore(storage or get_storage())
+        return _store
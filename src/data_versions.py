@@ -0,0 +1,15 @@
+import threading
+
+# Process-wide version counters for the app's data sets. Anything derived from
+# the data (similarity arrays, caches, ...) records the version it was built
+# from and is rebuilt once the counter moves on.
+_lock = threading.Lock()
+_versions = {"inventory": 0, "stock": 0, "orders": 0}
+
+def get_version(name):
+    return _versions[name]
+
+def bump_version(name):
+    with _lock:
+        _versions[name] += 1
+        return _versions[name]
@@ -0,0 +1,171 @@
+import argparse
+import calendar
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from inventory_manager import save_inventory
+from snapshot import OrderColumns
+
+ADJECTIVES = ["Wireless", "Smart", "Portable", "Ultra", "Pro", "Mini", "Compact", "Gaming", "Digital", "Solar",
+              "Rugged", "Slim", "Premium", "Classic", "Turbo", "Eco"]
+NOUNS = ["Laptop", "Smartphone", "Tablet", "Headphones", "Speaker", "Keyboard", "Mouse", "Monitor", "Camera",
+         "Router", "Charger", "Hub", "Watch", "Drone", "Projector", "Microphone", "Printer", "Webcam",
+         "Earbuds", "Console", "Tracker", "Drive", "Cable", "Lamp"]
+# Orders are generated and written this many at a time
+CHUNK_ORDERS = 100_000
+# Orders are spread over `days` days from this date (UTC), so the same arguments give the same times
+START_DATE = calendar.timegm((2024, 1, 1, 0, 0, 0))
+# Files derived from the data set, dropped when a directory is regenerated
+DERIVED = ["orders.journal", "order_id.seq", "reservations.json", "reservations.journal", "rollups.json", "data.lock",
+           "ecommerce.db"]
+
+
+def make_inventory(n_products, seed=42, stock=None, rng=None):
+    """
+    `n_products` products in the inventory.json schema (id, name, price, stock, popularity),
+    drawn from `rng` (a numpy Generator) or a new one seeded with `seed`. stock=N
+    gives every product N units instead of a random 50 to 999.
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    ids = np.arange(1, n_products + 1)
+    adjectives = rng.integers(0, len(ADJECTIVES), size=n_products)
+    nouns = rng.integers(0, len(NOUNS), size=n_products)
+    return pd.DataFrame({
+        "id": ids,
+        "name": [f"{ADJECTIVES[a]} {NOUNS[n]} {pid}" for a, n, pid in zip(adjectives.tolist(), nouns.tolist(),
+                                                                         ids.tolist())],
+        # Long-tailed prices, mostly between $10 and $500
+        "price": np.round(np.clip(rng.lognormal(4.5, 1.0, size=n_products), 5, 5000), 2),
+        "stock": rng.integers(50, 1000, size=n_products) if stock is None else np.full(n_products, stock),
+        "popularity": np.round(rng.uniform(40, 100, size=n_products), 1),
+    })
+
+
+def make_customers(n_customers):
+    # Alphanumeric ids, as the login page requires
+    return [{"customer_id": f"cust{i:06d}", "name": f"cust{i:06d}"} for i in range(1, n_customers + 1)]
+
+
+def iter_order_chunks(n_orders, inventory_df, n_customers, max_items, skew, rng, days=365, start=START_DATE):
+    """
+    Yields the orders as snapshot.OrderColumns, CHUNK_ORDERS at a time. Products
+    are drawn with a Zipf-like skew by popularity rank (popular products sell
+    more, so co-purchase and top-seller lists look realistic), customers uniformly;
+    1 to `max_items` lines per order, 1 to 3 units per line. Order times rise
+    with the order id, evenly on average over `days` days from `start`.
+    """
+    prices = inventory_df["price"].to_numpy(dtype=np.float64)
+    rank = np.empty(len(inventory_df), dtype=np.int64)
+    rank[np.argsort(-inventory_df["popularity"].to_numpy(), kind="stable")] = np.arange(len(inventory_df))
+    weights = 1.0 / (rank + 1.0) ** skew
+    weights /= weights.sum()
+    customers = [c["customer_id"] for c in make_customers(n_customers)]
+    first_id = 1
+    while first_id <= n_orders:
+        n = min(CHUNK_ORDERS, n_orders - first_id + 1)
+        sizes = rng.integers(1, max_items + 1, size=n)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        positions = rng.choice(len(prices), size=int(offsets[-1]), p=weights)
+        qty = rng.integers(1, 4, size=int(offsets[-1]))
+        totals = np.round(np.add.reduceat(prices[positions] * qty, offsets[:-1]), 2)
+        customer = rng.integers(0, n_customers, size=n).astype(np.int32)
+        # Order k lands at a random point of its own 1/n_orders slice of the period, so times stay in id order
+        slots = np.arange(first_id - 1, first_id - 1 + n) + rng.random(n)
+        placed_at = np.round(start + days * 86400 * slots / n_orders, 3)
+        yield OrderColumns(np.arange(first_id, first_id + n, dtype=np.int64), customer,
+                           customers, totals, offsets, positions + 1, qty, placed_at)
+        first_id += n
+
+
+def make_orders(n_orders, n_products=25, max_items=4, skew=0.0, seed=42, start=None, days=None,
+                inventory_df=None, n_customers=1_000):
+    """
+    `n_orders` order records ({order_id, customer_id, items, total_cost}) in
+    memory, for benchmarks and tests; iter_order_chunks with uniform demand by
+    default. Totals are at the prices of `inventory_df` (make_inventory(n_products,
+    seed) without one). With `start` (epoch seconds) the orders carry placed_at,
+    spread over `days` days from then (default: about an hour apart).
+    """
+    rng = np.random.default_rng(seed)
+    if inventory_df is None:
+        inventory_df = make_inventory(n_products, rng=rng)
+    if days is None:
+        days = n_orders / 24
+    orders = []
+    for columns in iter_order_chunks(n_orders, inventory_df, n_customers, max_items, skew, rng, days,
+                                     START_DATE if start is None else start):
+        orders.extend(columns.to_records())
+    if start is None:
+        for order in orders:
+            del order["placed_at"]
+    return orders
+
+
+def generate_dataset(directory, n_products=1_000, n_customers=1_000, n_orders=10_000, max_items=4, skew=1.0,
+                     seed=42, indent=4, days=365):
+    """
+    Writes a synthetic data set to `directory` in the files and JSON schema the
+    app reads (inventory.json, customers.json, orders.json, bill_for_all.json).
+    The same arguments always produce the same files. Orders are generated and
+    written in chunks, so memory stays flat however many there are, and carry
+    times spread over `days` days from START_DATE.
+
+    State derived from an older data set in the directory (order journal,
+    order-id counter, reservations, rollups, snapshot, SQLite database) is removed.
+    indent=None writes compact JSON (about a quarter of the size).
+    Returns {"products", "customers", "orders", "order_lines"}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in DERIVED:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(os.path.join(directory, "snapshot"), ignore_errors=True)
+
+    rng = np.random.default_rng(seed)
+    inventory_df = make_inventory(n_products, rng=rng)
+    save_inventory(inventory_df, os.path.join(directory, "inventory.json"))
+    with open(os.path.join(directory, "customers.json"), 'w') as f:
+        json.dump(make_customers(n_customers), f, indent=indent)
+    with open(os.path.join(directory, "bill_for_all.json"), 'w') as f:
+        json.dump({}, f)
+
+    n_lines = 0
+    orders_path = os.path.join(directory, "orders.json")
+    with open(orders_path + ".tmp", 'w') as f:
+        f.write("[")
+        separator = "\n"
+        for columns in iter_order_chunks(n_orders, inventory_df, n_customers, max_items, skew, rng, days):
+            n_lines += columns.n_lines
+            for order in columns.to_records():
+                f.write(separator + json.dumps(order, indent=indent))
+                separator = ",\n"
+        f.write("\n]")
+    os.replace(orders_path + ".tmp", orders_path)
+    return {"products": n_products, "customers": n_customers, "orders": n_orders, "order_lines": n_lines}
+
+
+if __name__ == "__main__":
+    # python src/datagen.py /tmp/shop --products 50000 --customers 100000 --orders 1000000
+    # then: ECOMMERCE_DATA_DIR=/tmp/shop streamlit run src/main.py
+    parser = argparse.ArgumentParser(description="Write a synthetic data set in the app's JSON format.")
+    parser.add_argument("directory")
+    parser.add_argument("--products", type=int, default=1_000)
+    parser.add_argument("--customers", type=int, default=1_000)
+    parser.add_argument("--orders", type=int, default=10_000)
+    parser.add_argument("--max-items", type=int, default=4, help="most lines per order")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of product demand (0 = uniform)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--days", type=int, default=365, help="days the orders are spread over, from 2024-01-01")
+    parser.add_argument("--compact", action="store_true", help="no indentation in the JSON files")
+    args = parser.parse_args()
+    counts = generate_dataset(args.directory, args.products, args.customers, args.orders, args.max_items,
+                              args.skew, args.seed, indent=None if args.compact else 4, days=args.days)
+    print(f"Wrote {counts['products']} products, {counts['customers']} customers and {counts['orders']} orders"
+          f" ({counts['order_lines']} order lines) to {args.directory}")
@@ -2,16 +2,20 @@ import json
 import os
 import pandas as pd
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+import perf
+
+# ECOMMERCE_DATA_DIR points the app at another data directory (e.g. one made by datagen.py)
+DATA_DIR = os.getenv("ECOMMERCE_DATA_DIR", os.path.join(os.path.dirname(__file__), '..', 'data'))
 INVENTORY_FILE = os.path.join(DATA_DIR, 'inventory.json')
 
-def load_inventory():
+@perf.timed("inventory.load")
+def load_inventory(inventory_file=INVENTORY_FILE):
     # Ensure data folder exists
     if not os.path.exists(DATA_DIR):
         os.makedirs(DATA_DIR)
 
     # If the inventory file does not exist, create one with 25 predefined products
-    if not os.path.exists(INVENTORY_FILE):
+    if not os.path.exists(inventory_file):
         # Create 25 default products (example list below).
         default_inventory = [
             {"id": 1,  "name": "Laptop",                     "price": 1200, "stock": 30, "popularity": 90},
@@ -41,14 +45,19 @@ def load_inventory():
             {"id": 25, "name": "USB-C Hub",                  "price": 45,   "stock": 30, "popularity": 65},
         ]
         # Convert to DataFrame and save
-        save_inventory(pd.DataFrame(default_inventory))
+        save_inventory(pd.DataFrame(default_inventory), inventory_file)
 
     # Load the JSON file into a DataFrame
-    with open(INVENTORY_FILE, 'r') as f:
+    with open(inventory_file, 'r') as f:
         data = json.load(f)
     return pd.DataFrame(data)
 
-def save_inventory(df):
+@perf.timed("inventory.save")
+def save_inventory(df, inventory_file=INVENTORY_FILE):
     data = df.to_dict(orient='records')
-    with open(INVENTORY_FILE, 'w') as f:
+    # Swap in a complete file so a reader in another process never sees a partial one
+    tmp_path = inventory_file + ".tmp"
+    with open(tmp_path, 'w') as f:
         json.dump(data, f, indent=4)
+        perf.add_bytes(inventory_file, f.tell())
+    os.replace(tmp_path, inventory_file)
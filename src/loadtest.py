@@ -0,0 +1,228 @@
+"""
+Load test for the HTTP API (api.py): `--connections` simulated shoppers, each
+on one keep-alive connection, send a mix of searches, product lookups,
+recommendations, cart reads, add-to-carts, checkouts and invoices for
+`--duration` seconds. Prints requests/second and latency percentiles per
+endpoint.
+
+Without --url it generates a data set (datagen.py) in a temporary directory,
+starts `api.py` on it in a subprocess, and stops it afterwards:
+
+    python src/loadtest.py --connections 32 --duration 10
+    python src/loadtest.py --url http://127.0.0.1:8000     # an API server that's already running
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+from datagen import NOUNS, generate_dataset
+
+# Relative frequency of each request in the mix
+MIX = {"search": 35, "product": 15, "recommendations": 25, "cart": 10, "add_to_cart": 10, "checkout": 3,
+       "invoice": 2}
+
+
+class Connection:
+    """
+    Minimal HTTP/1.1 keep-alive client over asyncio streams (the load
+    generator should cost far less than the server it measures).
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                          f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1")
+                          + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        close = False
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection":
+                close = value.strip().lower() == "close"
+        data = await self.reader.readexactly(length)
+        if close:
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def shopper(conn, number, product_ids, deadline, results, rng):
+    """
+    One simulated customer: logs in, then sends requests from MIX until `deadline`.
+    results: {endpoint: {"latency": [seconds], "status": {code: count}}}
+    """
+    customer_id = f"load{number:05d}"
+
+    async def call(name, method, path, payload=None):
+        start = time.perf_counter()
+        status, data = await conn.request(method, path, payload)
+        entry = results.setdefault(name, {"latency": [], "status": {}})
+        entry["latency"].append(time.perf_counter() - start)
+        entry["status"][status] = entry["status"].get(status, 0) + 1
+        return status, data
+
+    await call("login", "POST", "/customers", {"customer_id": customer_id})
+    order_num = 1
+    in_cart = []
+    order_ids = []
+    names, weights = zip(*MIX.items())
+    while time.perf_counter() < deadline:
+        op = rng.choices(names, weights)[0]
+        if op == "search":
+            term = rng.choice(NOUNS)[:rng.randint(3, 6)]
+            await call(op, "GET", f"/products?q={quote(term)}&limit=20")
+        elif op == "product":
+            await call(op, "GET", f"/products/{rng.choice(product_ids)}")
+        elif op == "recommendations":
+            cart = in_cart or rng.sample(product_ids, rng.randint(1, 3))
+            await call(op, "GET", "/recommendations?products=" + ",".join(map(str, cart)))
+        elif op == "cart":
+            await call(op, "GET", f"/carts/{customer_id}/{order_num}")
+        elif op == "add_to_cart":
+            pid = rng.choice(product_ids)
+            status, _ = await call(op, "POST", f"/carts/{customer_id}/{order_num}/items",
+                                   {"product_id": pid, "qty": 1})
+            if status == 200:
+                in_cart.append(pid)
+        elif op == "checkout" and in_cart:
+            status, data = await call(op, "POST", f"/carts/{customer_id}/{order_num}/checkout")
+            if status == 200:
+                order_ids.append(json.loads(data)["order_id"])
+                order_num += 1
+                in_cart = []
+        elif op == "invoice" and order_ids:
+            await call(op, "GET", f"/orders/{rng.choice(order_ids)}/invoice")
+
+
+async def run_load(host, port, connections, duration, product_ids, seed=42):
+    results = {}
+    conns = [Connection(host, port) for _ in range(connections)]
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(shopper(conn, i, product_ids, deadline, results, random.Random(seed + i))
+                               for i, conn in enumerate(conns)))
+    finally:
+        for conn in conns:
+            conn.close()
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    total = sum(len(r["latency"]) for r in results.values())
+    print(f"{total} requests in {elapsed:.1f} s: {total / elapsed:,.0f} requests/s")
+    print(f"  {'endpoint':16s} {'requests':>9s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}  status")
+    summary = {"requests": total, "seconds": elapsed, "requests_per_s": total / elapsed, "endpoints": {}}
+    for name, r in sorted(results.items(), key=lambda kv: -len(kv[1]["latency"])):
+        ms = np.array(r["latency"]) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        print(f"  {name:16s} {len(ms):9d} {len(ms) / elapsed:8.0f} {p50:8.2f} {p95:8.2f} {p99:8.2f}  {r['status']}")
+        summary["endpoints"][name] = {"requests": len(ms), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+                                      "status": {str(k): v for k, v in r["status"].items()}}
+    return summary
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(directory, port, workers, backend="json"):
+    env = dict(os.environ, ECOMMERCE_DATA_DIR=directory, ECOMMERCE_STORAGE=backend)
+    # The SQLite database goes next to the generated files (and is seeded from them)
+    for name in ("ECOMMERCE_API_URL", "ECOMMERCE_DB"):
+        env.pop(name, None)
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api.py"),
+                               "--port", str(port), "--workers", str(workers)], env=env)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"api.py exited with status {server.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("api.py did not start listening in time")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the shop's HTTP API.")
+    parser.add_argument("--url", help="API server to test (default: start one on a generated data set)")
+    parser.add_argument("--connections", type=int, default=32, help="concurrent shoppers (connections)")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--workers", type=int, default=8, help="worker threads of the server started here")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json",
+                        help="storage backend of the server started here")
+    parser.add_argument("--products", type=int, default=1_000)
+    parser.add_argument("--customers", type=int, default=1_000)
+    parser.add_argument("--orders", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="also write the summary to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = None
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+            product_ids = None
+        else:
+            counts = generate_dataset(tmp, args.products, args.customers, args.orders, seed=args.seed, indent=None)
+            host, port = "127.0.0.1", _free_port()
+            print(f"Starting api.py on port {port}: {counts['products']} products, {counts['orders']} orders,"
+                  f" {args.storage} storage, {args.workers} workers")
+            server = start_server(tmp, port, args.workers, args.storage)
+            product_ids = list(range(1, args.products + 1))
+        try:
+            if product_ids is None:
+                async def catalog():
+                    conn = Connection(host, port)
+                    try:
+                        _, data = await conn.request("GET", "/products?limit=0")
+                    finally:
+                        conn.close()
+                    return [p["id"] for p in json.loads(data)]
+                product_ids = asyncio.run(catalog())
+            results, elapsed = asyncio.run(run_load(host, port, args.connections, args.duration, product_ids,
+                                                    args.seed))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+        summary = summarize(results, elapsed)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(summary, f, indent=4)
@@ -1,202 +1,84 @@
-import os
-import json
-import re
+import calendar
+import datetime
 import pandas as pd
 import streamlit as st
-import matplotlib.pyplot as plt
-import io
 
-from inventory_manager import load_inventory, save_inventory
-from order import Order
-from ai_insights import generate_ai_insights
-from recommender import get_recommendations
+from checkout import InsufficientStock
+from ai_insights import get_insights_service, insight_inputs
+from recommender import recommendation_cache
+from reports import generate_sales_report
+from storage import get_storage
+from data_store import get_data_store
+from service import API_URL, ServiceError, get_service
+from charts import render_charts, chart_cache
+from time_rollups import GRANULARITIES, bucket_of
+import perf
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
-CUSTOMERS_FILE = os.path.join(DATA_DIR, 'customers.json')
-ORDERS_FILE = os.path.join(DATA_DIR, 'orders.json')
-BILL_FILE = os.path.join(DATA_DIR, 'bill_for_all.json')
+# Most points the Sales by Period chart draws; longer ranges fall back to a coarser granularity
+MAX_SERIES_POINTS = 2000
 
 ADMIN_USERNAME = "admin"
 ADMIN_PASSWORD = "password123"  # Demo credentials
+SEARCH_RESULTS = 50  # products listed for a search term
 
-def load_customers():
-    if not os.path.exists(CUSTOMERS_FILE):
-        with open(CUSTOMERS_FILE, 'w') as f:
-            json.dump([], f, indent=4)
-    with open(CUSTOMERS_FILE, 'r') as f:
-        return json.load(f)
-
-def save_customers(customers_list):
-    with open(CUSTOMERS_FILE, 'w') as f:
-        json.dump(customers_list, f, indent=4)
-
-def load_orders():
-    if not os.path.exists(ORDERS_FILE):
-        with open(ORDERS_FILE, 'w') as f:
-            json.dump([], f, indent=4)
-    with open(ORDERS_FILE, 'r') as f:
-        return json.load(f)
-
-def save_orders(orders_list):
-    with open(ORDERS_FILE, 'w') as f:
-        json.dump(orders_list, f, indent=4)
-
-def load_bill():
-    if not os.path.exists(BILL_FILE):
-        with open(BILL_FILE, 'w') as f:
-            json.dump({}, f)
-    with open(BILL_FILE, 'r') as f:
-        return json.load(f)
-
-def save_bill(bill):
-    with open(BILL_FILE, 'w') as f:
-        json.dump(bill, f, indent=4)
-
-def get_customer_by_id(cust_id, customers):
-    for c in customers:
-        if c['customer_id'] == cust_id:
-            return c
-    return None
+# JSON files or SQLite, picked with the ECOMMERCE_STORAGE environment variable
+storage = get_storage()
 
 if "role" not in st.session_state:
     st.session_state["role"] = None
 if "logged_in" not in st.session_state:
     st.session_state["logged_in"] = False
-if "inventory_df" not in st.session_state:
-    st.session_state["inventory_df"] = load_inventory()
-if "orders" not in st.session_state:
-    st.session_state["orders"] = load_orders()
-if "customers" not in st.session_state:
-    st.session_state["customers"] = load_customers()
+
+# Inventory, orders, customers and carts are shared by every session (see data_store.py);
+# only who is logged in and which cart they are filling is kept per session
+data = get_data_store(storage)
+# Customer pages go through the shop service: in this process, or an API server (api.py)
+# when ECOMMERCE_API_URL is set. Admin pages read and edit `data`, which then
+# reloads whatever the API server changed (see DataStore.refresh)
+service = get_service()
 
 if "current_customer_id" not in st.session_state:
     st.session_state["current_customer_id"] = None
 if "current_order_number" not in st.session_state:
     st.session_state["current_order_number"] = 1
 
-if "bill" not in st.session_state:
-    st.session_state["bill"] = load_bill()
-
-def update_inventory(new_df):
-    st.session_state["inventory_df"] = new_df
-    save_inventory(new_df)
-
-def add_customer(cust_id):
-    customers = st.session_state["customers"]
-    if get_customer_by_id(cust_id, customers) is None:
-        customers.append({"customer_id": cust_id, "name": cust_id, "purchase_history": []})
-        save_customers(customers)
-        st.session_state["customers"] = customers
-        return True
-    return False
+def update_inventory(new_df, changed_ids=None, stock_ids=()):
+    data.update_inventory(new_df, changed_ids, stock_ids)
 
 def add_to_cart(product_id, qty):
-    inv_df = st.session_state["inventory_df"]
-    product_row = inv_df[inv_df["id"] == product_id]
-
-    if product_row.empty:
-        st.error("Invalid product ID")
-        return
-
-    product_id = int(product_id)
-    product_name = str(product_row.iloc[0]["name"])
-    price = float(product_row.iloc[0]["price"])
-    qty = int(qty)
-    subtotal = price * qty
-
     cust_id = st.session_state["current_customer_id"]
     order_num = st.session_state["current_order_number"]
-
-    if cust_id not in st.session_state["bill"]:
-        st.session_state["bill"][cust_id] = {}
-
-    if order_num not in st.session_state["bill"][cust_id]:
-        st.session_state["bill"][cust_id][order_num] = {"order_items": [], "total": 0.0}
-
-    st.session_state["bill"][cust_id][order_num]["order_items"].append({
-        "product_id": product_id,
-        "product_name": product_name,
-        "qty": qty,
-        "subtotal": float(subtotal)
-    })
-
-    total = sum(item["subtotal"] for item in st.session_state["bill"][cust_id][order_num]["order_items"])
-    st.session_state["bill"][cust_id][order_num]["total"] = float(total)
-
-    save_bill(st.session_state["bill"])
+    try:
+        service.add_to_cart(cust_id, order_num, product_id, qty)
+    except InsufficientStock as e:
+        st.warning(f"Insufficient stock! Only {e.available} more available.")
+        return False
+    except ServiceError as e:
+        st.error(str(e))
+        return False
+    return True
 
 def place_final_order():
     cust_id = st.session_state["current_customer_id"]
     order_num = st.session_state["current_order_number"]
-    if cust_id not in st.session_state["bill"] or order_num not in st.session_state["bill"][cust_id]:
-        st.error("No items in cart!")
+    try:
+        order_record = service.checkout(cust_id, order_num)
+    except InsufficientStock as e:
+        st.error(f"Not enough stock: {e}")
+        return False
+    except ServiceError as e:
+        st.error(str(e))
         return False
-
-    order_data = st.session_state["bill"][cust_id][order_num]
-    items = [(item["product_id"], item["qty"]) for item in order_data["order_items"]]
-
-    new_order_id = len(st.session_state["orders"]) + 1
-    products_dict = st.session_state["inventory_df"].set_index("id").to_dict(orient="index")
-
-    # Create an Order object
-    new_order = Order(new_order_id, cust_id, items)
-    new_order.calculate_total(products_dict)
-
-    # Deduct stock
-    inv_df = st.session_state["inventory_df"]
-    for pid, qty in items:
-        idx = inv_df.index[inv_df["id"] == pid][0]
-        inv_df.at[idx, "stock"] = int(inv_df.at[idx, "stock"] - qty)
-    update_inventory(inv_df)
-
-    st.session_state["orders"].append({
-        "order_id": new_order.order_id,
-        "customer_id": new_order.customer_id,
-        "items": items,
-        "total_cost": new_order.total_cost
-    })
-    save_orders(st.session_state["orders"])
-
-    # Update customer purchase history
-    customers = st.session_state["customers"]
-    cust = get_customer_by_id(cust_id, customers)
-    if cust is not None:
-        cust["purchase_history"].append({"order_id": new_order.order_id, "items": items})
-        save_customers(customers)
-
-    # Clear bill for this order
-    st.session_state["bill"][cust_id].pop(order_num)
-    save_bill(st.session_state["bill"])
 
     st.session_state["current_order_number"] += 1
-    return new_order.order_id
+    return order_record["order_id"]
 
 def download_invoice(order_id):
-    # Find the order
-    placed_order = None
-    for o in st.session_state["orders"]:
-        if o["order_id"] == order_id:
-            placed_order = o
-            break
-    if placed_order is None:
+    try:
+        return service.invoice(order_id)
+    except ServiceError:
         return None
 
-    inv_df = st.session_state["inventory_df"].set_index("id")
-    df = pd.DataFrame(placed_order["items"], columns=["product_id", "quantity"])
-    df["product_name"] = df["product_id"].apply(lambda x: inv_df.at[x, "name"] if x in inv_df.index else "")
-    df["price"] = df["product_id"].apply(lambda x: float(inv_df.at[x, "price"]) if x in inv_df.index else 0.0)
-    df["subtotal"] = df["price"] * df["quantity"]
-    df["order_id"] = placed_order["order_id"]
-    df["customer_id"] = placed_order["customer_id"]
-    df["total_cost"] = placed_order["total_cost"]
-    return df
-
-def fig_to_png_bytes(fig):
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    return buf.getvalue()
-
 ### Pages ###
 
 def login_page():
@@ -225,76 +107,64 @@ def login_page():
             if not cust_id or not cust_id.isalnum():
                 st.error("Customer ID must be alphanumeric. Please try again.")
             else:
-                customers = st.session_state["customers"]
-                existing_customer = get_customer_by_id(cust_id, customers)
-                if existing_customer:
-                    # Login
+                # Logs in, creating the customer first if the id is new
+                try:
+                    customer, created = service.login(cust_id)
+                except ServiceError as e:
+                    customer, created = None, False
+                    st.error(str(e))
+                if created:
+                    st.info(f"Customer {cust_id} does not exist. Creating new customer...")
+                if customer:
                     st.session_state["current_customer_id"] = cust_id
                     st.session_state["role"] = "customer"
                     st.session_state["logged_in"] = True
                     st.experimental_rerun()
                 else:
-                    st.info(f"Customer {cust_id} does not exist. Creating new customer...")
-                    created = add_customer(cust_id)
-                    if created:
-                        st.session_state["current_customer_id"] = cust_id
-                        st.session_state["role"] = "customer"
-                        st.session_state["logged_in"] = True
-                        st.experimental_rerun()
-                    else:
-                        st.error("Could not create customer, please try a different ID.")
+                    st.error("Could not create customer, please try a different ID.")
 
 def place_orders_page():
     st.title("Place Orders")
-    inv_df = st.session_state["inventory_df"]
 
-    search_term = st.text_input("Search for a product (we will only consider the first 4 characters)")
+    search_term = st.text_input("Search for a product")
 
-    # Only take first 4 characters
-    search_key = search_term[:4] if len(search_term) >= 4 else search_term
-    if search_key:
-        # We'll do a "starts with" check
-        filtered = inv_df[inv_df["name"].str.startswith(search_key, na=False)]
-    else:
-        filtered = inv_df
+    # Indexed, case-insensitive prefix / word / substring match, best matches first
+    # (the whole catalog for an empty search)
+    products = service.search(search_term, limit=SEARCH_RESULTS if search_term.strip() else None)
+    names = {p["id"]: p["name"] for p in products}
 
-    product_name_list = filtered["name"].tolist()
-    if product_name_list:
-        selected_product = st.selectbox("Select Product", product_name_list)
+    if products:
+        product_id = st.selectbox("Select Product", list(names), format_func=lambda pid: names[pid])
     else:
-        st.warning("No products found with that partial search.")
-        selected_product = None
+        st.warning("No products found with that search.")
+        product_id = None
 
-    if selected_product:
-        p_row = filtered[filtered["name"] == selected_product].iloc[0]
-        product_id = p_row["id"]
+    if product_id is not None:
+        selected_product = names[product_id]
         qty = st.number_input("Quantity", min_value=1, step=1, value=1)
         if st.button("Add to Cart"):
-            if qty > p_row["stock"]:
-                st.warning("Insufficient stock!")
-            else:
-                add_to_cart(product_id, qty)
+            if add_to_cart(product_id, qty):
                 st.success(f"Added {qty} of {selected_product} to cart.")
 
     # Show current cart
     cust_id = st.session_state["current_customer_id"]
     order_num = st.session_state["current_order_number"]
-    if cust_id in st.session_state["bill"] and order_num in st.session_state["bill"][cust_id]:
-        cart_items = st.session_state["bill"][cust_id][order_num]["order_items"]
+    cart = service.cart(cust_id, order_num)
+    if cart is not None:
+        cart_items = cart["order_items"]
         if cart_items:
             df_cart = pd.DataFrame(cart_items)
-            total = st.session_state["bill"][cust_id][order_num]["total"]
+            total = cart["total"]
             st.subheader("Current Cart")
             st.dataframe(df_cart[["product_name","qty","subtotal"]])
             st.write("**Total**:", total)
 
             # Recommendations
             cart_pids = [item["product_id"] for item in cart_items]
-            recs = get_recommendations(cart_pids, st.session_state["orders"], inv_df)
+            recs = service.recommendations(cart_pids)
             if recs:
                 st.write("**Recommended Products for You**:")
-                rec_names = inv_df[inv_df["id"].isin(recs)]["name"].tolist()
-                st.write(", ".join(rec_names))
+                st.write(", ".join(r["name"] for r in recs))
 
             if st.button("Place Order"):
                 order_id = place_final_order()
@@ -307,15 +177,30 @@ def place_orders_page():
                         st.download_button("Download Invoice CSV", data=csv, file_name=f"invoice_{cust_id}.csv", mime='text/csv')
     else:
         # If cart is empty, recommend top popular items anyway
-        recs = get_recommendations([], st.session_state["orders"], inv_df)
+        recs = service.recommendations([])
         if recs:
             st.write("**Recommended Products (Global Popularity)**:")
-            rec_names = inv_df[inv_df["id"].isin(recs)]["name"].tolist()
-            st.write(", ".join(rec_names))
+            st.write(", ".join(r["name"] for r in recs))
+
+    # Order history, looked up in the order index
+    history = service.customer_orders(cust_id)
+    past_orders = history["orders"]
+    if past_orders:
+        spend = history["spend"]
+        with st.expander(f"Your Orders ({len(past_orders)}, ${spend:.2f} in total)"):
+            st.dataframe(pd.DataFrame([{"order_id": o["order_id"], "placed_at": _format_time(o.get("placed_at")),
+                                        "items": len(o["items"]), "total_cost": o["total_cost"]}
+                                       for o in past_orders]))
+
+def _format_time(placed_at):
+    # Orders placed before checkout recorded times have none
+    if placed_at is None:
+        return ""
+    return datetime.datetime.fromtimestamp(placed_at, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
 
 def manage_products_page():
     st.title("Manage Products (Admin)")
-    inv_df = st.session_state["inventory_df"]
+    inv_df = data.inventory_df
 
     # Delete product
     with st.expander("Delete a Product"):
@@ -324,9 +209,9 @@ def manage_products_page():
             if del_pid:
                 try:
                     del_pid = int(del_pid)
-                    if del_pid in inv_df["id"].values:
+                    if del_pid in data.catalog:
                         inv_df = inv_df[inv_df["id"] != del_pid]
-                        update_inventory(inv_df)
+                        update_inventory(inv_df, changed_ids=[del_pid])
                         st.success(f"Product ID {del_pid} deleted.")
                         st.experimental_rerun()
                     else:
@@ -357,25 +242,28 @@ def manage_products_page():
                 return
 
             # Check if product exists
-            existing = inv_df[inv_df["id"] == pid_int]
-            if not existing.empty:
+            row_index = data.catalog.row_label(pid_int)
+            if row_index is not None:
                 # Update
-                row_index = existing.index[0]
                 # If no name was given, auto-fill from existing
                 if not name:
-                    name = existing.loc[row_index, "name"]
+                    name = inv_df.loc[row_index, "name"]
                 # If price=0, maybe keep existing price if we wanted to. Or force admin to fill it.
                 if price == 0:
-                    price = existing.loc[row_index, "price"]
+                    price = inv_df.loc[row_index, "price"]
+                # Stock is only written if the admin entered one (see DataStore.update_inventory)
+                stock_ids = [pid_int] if stock != 0 else []
                 if stock == 0:
-                    stock = existing.loc[row_index, "stock"]
+                    stock = inv_df.loc[row_index, "stock"]
 
-                inv_df.at[row_index, "name"] = name
-                inv_df.at[row_index, "price"] = price
-                inv_df.at[row_index, "stock"] = stock
+                # Edit a copy: other sessions keep reading the shared frame until it is swapped in
+                updated_df = inv_df.copy()
+                updated_df.at[row_index, "name"] = name
+                updated_df.at[row_index, "price"] = price
+                updated_df.at[row_index, "stock"] = stock
                 # popularity remains same
 
-                update_inventory(inv_df)
+                update_inventory(updated_df, changed_ids=[pid_int], stock_ids=stock_ids)
                 st.success(f"Product ID {pid_int} updated.")
                 st.experimental_rerun()
             else:
@@ -395,125 +283,57 @@ def manage_products_page():
                     "popularity": float(avg_pop)
                 }
                 updated_df = pd.concat([inv_df, pd.DataFrame([new_row])], ignore_index=True)
-                update_inventory(updated_df)
+                update_inventory(updated_df, changed_ids=[pid_int], stock_ids=[pid_int])
                 st.success(f"New product ID {pid_int} added.")
                 st.experimental_rerun()
 
-def ai_insights_page():
-    st.title("AI Insights (Admin)")
-    orders = st.session_state["orders"]
-    inv_df = st.session_state["inventory_df"]
-    if st.button("Generate AI Insights"):
-        summary = generate_ai_insights(orders, inv_df)
-        st.write(summary)
 
 def analytics_page():
     st.title("Analytics (Admin)")
-    inv_df = st.session_state["inventory_df"]
-    orders = st.session_state["orders"]
+    inv_df = data.inventory_df
+    orders = data.orders
 
-    # Show total sales
-    total_sales = sum(o["total_cost"] for o in orders)
+    # Show total sales (kept current by every checkout, see sales_rollups.py)
+    total_sales = data.rollups.total_revenue
     st.markdown(f"**Total Sales:** `${total_sales}`")
 
+    # Orders placed before checkout recorded times can be given times spread over a period
+    untimed = data.time_rollups.untimed_orders
+    if untimed:
+        with st.expander(f"Backfill timestamps ({untimed} orders have none)"):
+            backfill_start = st.date_input("Spread them from", value=datetime.date(2024, 1, 1))
+            backfill_end = st.date_input("Up to (default: the first timed order, or today)", value=None)
+            if st.button("Backfill timestamps"):
+                end = calendar.timegm(backfill_end.timetuple()) if backfill_end else None
+                try:
+                    n = data.backfill_timestamps(calendar.timegm(backfill_start.timetuple()), end)
+                    st.success(f"Backfilled timestamps for {n} orders.")
+                except ValueError as e:
+                    st.error(str(e))
+    # Sales per hour/day/month, kept current at checkout: reads cost one lookup per bucket
+    time_rollups = data.time_rollups
+    sales_over_time = None
+    if time_rollups.timed_orders:
+        sales_over_time = time_rollups.series("month", time_rollups.first, time_rollups.last)
+
     # Show orders table merged with product details
     if orders:
-        all_items = []
-        for o in orders:
-            for pid, qty in o["items"]:
-                # Safely find price, name, etc
-                row = inv_df[inv_df["id"] == pid]
-                if not row.empty:
-                    price = float(row.iloc[0]["price"])
-                    pname = row.iloc[0]["name"]
-                else:
-                    price = 0
-                    pname = "Unknown"
-                all_items.append({
-                    "order_id": o["order_id"],
-                    "customer_id": o["customer_id"],
-                    "product_id": pid,
-                    "product_name": pname,
-                    "quantity": qty,
-                    "price": price,
-                    "subtotal": price * qty
-                })
-        df_orders = pd.DataFrame(all_items)
+        df_orders = data.order_lines.table(inv_df, data.version("inventory"))
         st.subheader("Orders Detail")
         st.dataframe(df_orders)
+        report_csv = generate_sales_report(orders, None, rollups=data.rollups_snapshot(), fmt="csv")
+        st.download_button("Download Sales Report CSV", data=report_csv.encode("utf-8"),
+                           file_name="sales_report.csv", mime="text/csv")
 
-        # -- We want at least 10 different visualizations. Examples below:
-
-        # 1. Popularity bar chart
-        fig1, ax1 = plt.subplots()
-        ax1.bar(inv_df["name"], inv_df["popularity"])
-        ax1.set_xlabel("Products")
-        ax1.set_ylabel("Popularity")
-        ax1.set_title("Product Popularity")
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        st.pyplot(fig1)
-
-        # 2. Pie chart of product contribution to total sales
-        product_sales = df_orders.groupby("product_name")["subtotal"].sum().to_dict()
-        fig2, ax2 = plt.subplots()
-        ax2.pie(product_sales.values(), labels=product_sales.keys(), autopct='%1.1f%%')
-        ax2.set_title("Contribution to Total Sales")
-        st.pyplot(fig2)
-
-        # 3. Monthly sales line chart (we'll fake monthly data from orders, for example)
-        # If you had timestamps in orders, you’d parse & group by month. Here we just show a placeholder
-        sales_over_time = pd.DataFrame({
-            "month": ["Jan", "Feb", "Mar", "Apr", "May", "Jun"],
-            "sales": [100, 200, 150, 300, 250, total_sales]
-        })
-        fig3, ax3 = plt.subplots()
-        ax3.plot(sales_over_time["month"], sales_over_time["sales"], marker='o')
-        ax3.set_title("Sales Over Time")
-        st.pyplot(fig3)
-
-        # 4. Scatter plot: Price vs Popularity
-        fig4, ax4 = plt.subplots()
-        ax4.scatter(inv_df["price"], inv_df["popularity"])
-        ax4.set_xlabel("Price")
-        ax4.set_ylabel("Popularity")
-        ax4.set_title("Price vs. Popularity")
-        st.pyplot(fig4)
-
-        # 5. Stacked bar for product stock vs. sold (approx). We'll just pick random sold data for demonstration
-        product_ids = inv_df["id"].tolist()
-        sold_counts = []
-        for pid in product_ids:
-            subdf = df_orders[df_orders["product_id"] == pid]
-            sold_counts.append(subdf["quantity"].sum())
-        fig5, ax5 = plt.subplots()
-        ax5.bar(inv_df["name"], inv_df["stock"], label="Stock", alpha=0.7)
-        ax5.bar(inv_df["name"], sold_counts, bottom=inv_df["stock"], label="Sold", alpha=0.7)
-        ax5.set_xticklabels(inv_df["name"], rotation=45)
-        ax5.set_title("Stock vs. Sold Stacked Bar")
-        ax5.legend()
-        st.pyplot(fig5)
-
-        # 6. Horizontal bar chart of product price
-        fig6, ax6 = plt.subplots()
-        ax6.barh(inv_df["name"], inv_df["price"])
-        ax6.set_xlabel("Price")
-        ax6.set_title("Product Price (Horizontal)")
-        st.pyplot(fig6)
-
-        # 7. Boxplot of product prices
-        fig7, ax7 = plt.subplots()
-        ax7.boxplot(inv_df["price"], vert=False)
-        ax7.set_title("Boxplot of Product Prices")
-        st.pyplot(fig7)
-
-        # 8. Another line chart: popularity trend sorted by name
-        sorted_inv = inv_df.sort_values(by="name")
-        fig8, ax8 = plt.subplots()
-        ax8.plot(sorted_inv["name"], sorted_inv["popularity"], marker='o')
-        ax8.set_title("Popularity by Product (alphabetical)")
-        plt.xticks(rotation=45)
-        st.pyplot(fig8)
+        # -- We want at least 10 different visualizations.
+        # Charts 1-8 are matplotlib figures, rendered once per input change and cached as PNGs
+        chart_data = {"inventory": inv_df, "order_lines": df_orders, "total_sales": total_sales,
+                      "sales_over_time": sales_over_time}
+        for _, png in render_charts(chart_data, data.version("orders")):
+            st.image(png)
+
+        if time_rollups.timed_orders:
+            sales_by_period(time_rollups, inv_df)
 
         # 9. Heatmap-like approach (though we have limited data). We can do a pivot table of product vs. sales.
         # For demonstration, let's show a pivot on product_id vs. quantity sold
@@ -529,13 +349,118 @@ def analytics_page():
     else:
         st.write("No orders placed yet.")
 
+    with st.expander("Recommendation cache"):
+        st.json(recommendation_cache.stats())
+    with st.expander("Chart cache"):
+        st.json(chart_cache.stats())
+    with st.expander("Cart store"):
+        st.json(data.carts.stats())
+    with st.expander("Sales rollups"):
+        st.json(data.rollups.stats())
+    with st.expander("Time rollups"):
+        st.json(time_rollups.stats())
+
+def sales_by_period(time_rollups, inv_df):
+    st.subheader("Sales by Period")
+    last_day = datetime.datetime.fromtimestamp(time_rollups.last, datetime.timezone.utc).date()
+    first_day = datetime.datetime.fromtimestamp(time_rollups.first, datetime.timezone.utc).date()
+    period = st.date_input("Period (UTC)", value=(max(first_day, last_day - datetime.timedelta(days=29)), last_day))
+    granularity = st.selectbox("Granularity", GRANULARITIES, index=GRANULARITIES.index("day"))
+    if not isinstance(period, (tuple, list)) or len(period) != 2:
+        return
+    start = calendar.timegm(period[0].timetuple())
+    end = calendar.timegm(period[1].timetuple()) + 86400
+    for coarser in GRANULARITIES[GRANULARITIES.index(granularity):]:
+        granularity = coarser
+        if bucket_of(end - 1, coarser) - bucket_of(start, coarser) < MAX_SERIES_POINTS:
+            break
+    series = time_rollups.series(granularity, start, end - 1)
+    st.line_chart(series.set_index("period")[["revenue"]])
+    report = time_rollups.period(start, end, top_n=10)
+    st.markdown(f"**{report['orders']} orders, {report['units']} units, ${report['revenue']:,.2f}** "
+                f"({report['products']} products sold)")
+    names = inv_df.set_index("id")["name"]
+    st.dataframe(pd.DataFrame([{"product_id": pid, "product_name": names.get(pid, ""), "revenue": revenue,
+                                "units": units} for pid, revenue, units in report["top_products"]]))
+
 def ai_insights_page():
     st.title("AI Insights (Admin)")
-    orders = st.session_state["orders"]
-    inv_df = st.session_state["inventory_df"]
+    insights = get_insights_service()
     if st.button("Generate AI Insights"):
-        summary = generate_ai_insights(orders, inv_df)
-        st.write(summary)
+        # Runs on the service's worker threads; identical requests share one call and its cached answer
+        inputs = insight_inputs(data.inventory_df, data.rollups.total_revenue)
+        _, st.session_state["ai_insights"] = insights.submit(inputs)
+
+    future = st.session_state.get("ai_insights")
+    if future is not None:
+        if not future.done():
+            st.info("Generating insights...")
+            st.button("Refresh")
+        elif future.exception() is not None:
+            st.error(f"Error: {future.exception()}")
+        else:
+            st.write(future.result())
+
+    with st.expander("Insights cache"):
+        st.json(insights.stats())
+
+def performance_page():
+    st.title("Performance (Admin)")
+    recording = st.checkbox("Record timings", value=perf.enabled(),
+                            help="Off by default (ECOMMERCE_PERF=1 turns it on at startup); near-free when off.")
+    if recording != perf.enabled():
+        perf.enable(recording)
+    stats = perf.snapshot()
+
+    st.subheader("Latency per operation")
+    if stats["latency"]:
+        latency_df = pd.DataFrame([dict(operation=name, **{k: v for k, v in h.items() if k != "buckets"})
+                                   for name, h in stats["latency"].items()])
+        st.dataframe(latency_df.sort_values("total_ms", ascending=False).set_index("operation"))
+        operation = st.selectbox("Histogram of", list(stats["latency"]))
+        buckets = stats["latency"][operation]["buckets"]
+        st.bar_chart(pd.DataFrame({"calls": list(buckets.values())}, index=[f"{b} ms" for b in buckets]))
+    else:
+        st.write("Nothing recorded yet.")
+
+    st.subheader("Bytes written per data file")
+    if stats["bytes_written"]:
+        st.dataframe(pd.DataFrame.from_dict(stats["bytes_written"], orient="index"))
+    else:
+        st.write("Nothing written yet.")
+
+    st.subheader("Profile one rerun")
+    target = st.selectbox("Page", list(PAGES))
+    if st.button("Profile the next rerun"):
+        # Whichever session runs the page next is profiled (customer pages run in other sessions)
+        perf.request_profile(target)
+        st.info(f"The next rerun of {target} will be profiled.")
+    profile = perf.last_profile()
+    if profile is not None:
+        st.write(f"{profile['label']} at {profile['timestamp']}")
+        st.code(profile["stats"])
+
+    st.download_button("Download as JSON", data=perf.dump().encode("utf-8"), file_name="perf.json",
+                       mime="application/json")
+    if st.button("Reset"):
+        perf.reset()
+
+def run_page(name):
+    # One rerun of a page: timed, and profiled if the Performance page asked for it
+    if perf.take_profile_request(name):
+        with perf.profile(label=name), perf.timer("page." + name):
+            PAGES[name]()
+    else:
+        with perf.timer("page." + name):
+            PAGES[name]()
+
+PAGES = {
+    "Place Orders": place_orders_page,
+    "Manage Products": manage_products_page,
+    "Analytics": analytics_page,
+    "AI Insights": ai_insights_page,
+    "Performance": performance_page,
+}
 
 ### Main App Flow ###
 
@@ -543,13 +468,12 @@ if not st.session_state["logged_in"]:
     login_page()
 else:
     if st.session_state["role"] == "admin":
-        page = st.sidebar.selectbox("Menu", ["Manage Products", "Analytics", "AI Insights", "Logout"])
-        if page == "Manage Products":
-            manage_products_page()
-        elif page == "Analytics":
-            analytics_page()
-        elif page == "AI Insights":
-            ai_insights_page()
+        if API_URL:
+            # Checkouts happen in the API server; pick up its orders and stock levels
+            data.refresh()
+        page = st.sidebar.selectbox("Menu", ["Manage Products", "Analytics", "AI Insights", "Performance", "Logout"])
+        if page in PAGES:
+            run_page(page)
         elif page == "Logout":
             st.session_state["logged_in"] = False
             st.session_state["role"] = None
@@ -557,8 +481,8 @@ else:
     else:
         # Customer
         page = st.sidebar.selectbox("Menu", ["Place Orders", "Logout"])
-        if page == "Place Orders":
-            place_orders_page()
+        if page in PAGES:
+            run_page(page)
         elif page == "Logout":
             st.session_state["logged_in"] = False
             st.session_state["role"] = None
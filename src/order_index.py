@@ -0,0 +1,224 @@
+import numpy as np
+
+from order import OrderBook, OrderView
+
+
+class _Postings:
+    """
+    key -> positions of the orders that have it. The orders there at build time
+    are kept as one sorted key array plus the matching positions (two searchsorted
+    calls per lookup); orders inserted since then go into small per-key lists.
+    """
+
+    def __init__(self, keys, positions):
+        order = np.argsort(keys, kind="stable")
+        self.keys = np.ascontiguousarray(keys[order])
+        self.positions = np.ascontiguousarray(positions[order])
+        self.tail = {}
+
+    def add(self, key, pos):
+        self.tail.setdefault(key, []).append(pos)
+
+    def get(self, key):
+        # Positions in increasing order
+        a, b = np.searchsorted(self.keys, [key, key + 1])
+        base = self.positions[a:b]
+        tail = self.tail.get(key)
+        if tail:
+            return np.concatenate([base, np.array(tail, dtype=np.int64)])
+        return base
+
+
+class OrderIndex:
+    """
+    Query layer over an order.OrderBook, indexed by order_id, customer_id and
+    product_id, so looking up an invoice, a customer's history or the orders
+    holding a product no longer scans every order.
+
+    Add orders through insert() (it appends to the book too) so the indexes stay
+    current. Lookups return OrderViews (or positions, for the *_positions methods),
+    oldest order first.
+
+    It also answers co_purchase_counts(cart_items) like recommender.CoPurchaseIndex,
+    so it can be passed to get_recommendations as the copurchase_index.
+    """
+
+    def __init__(self, orders=None):
+        if orders is None:
+            orders = OrderBook()
+        elif not isinstance(orders, OrderBook):
+            orders = OrderBook(orders)
+        self.book = orders
+        self.rebuild()
+
+    def rebuild(self):
+        book = self.book
+        ids = book.order_id
+        # Checkout hands out increasing ids, so order_id lookups are normally a
+        # binary search on the book's own column; otherwise a dict is kept
+        self._ids_sorted = bool(np.all(ids[1:] > ids[:-1]))
+        self._by_id = None if self._ids_sorted else {oid: pos for pos, oid in enumerate(ids.tolist())}
+        positions = np.arange(len(book), dtype=np.int64)
+        self._by_customer = _Postings(book.customer.astype(np.int64), positions)
+        # One posting per (product, order), even if the order has the product on several lines
+        line_orders = book.line_orders().astype(np.int64)
+        order = np.lexsort((line_orders, book.product_id))
+        pids, line_orders = book.product_id[order], line_orders[order]
+        first = np.ones(len(pids), dtype=bool)
+        first[1:] = (pids[1:] != pids[:-1]) | (line_orders[1:] != line_orders[:-1])
+        self._by_product = _Postings(pids[first], line_orders[first])
+
+    def insert(self, order):
+        """
+        Appends `order` ({order_id, customer_id, items, total_cost}) to the book and
+        the indexes. O(items in the order).
+        """
+        book = self.book
+        pos = len(book)
+        if self._ids_sorted and pos and order["order_id"] <= book.order_id[-1]:
+            self._ids_sorted = False
+            self._by_id = {oid: p for p, oid in enumerate(book.order_id.tolist())}
+        book.append(order)
+        if self._by_id is not None:
+            self._by_id[order["order_id"]] = pos
+        self._by_customer.add(int(book.customer[pos]), pos)
+        for pid in set(int(p) for p, _ in order["items"]):
+            self._by_product.add(pid, pos)
+
+    def __len__(self):
+        return len(self.book)
+
+    def _views(self, positions):
+        book = self.book
+        return [OrderView(book, pos) for pos in np.asarray(positions).tolist()]
+
+    def position(self, order_id):
+        if self._by_id is not None:
+            return self._by_id.get(order_id)
+        ids = self.book.order_id
+        pos = int(np.searchsorted(ids, order_id))
+        if pos < len(ids) and ids[pos] == order_id:
+            return pos
+        return None
+
+    def get(self, order_id):
+        """
+        The order with this id, or None.
+        """
+        pos = self.position(order_id)
+        return None if pos is None else OrderView(self.book, pos)
+
+    def customer_positions(self, customer_id):
+        code = self.book._customer_codes.get(customer_id)
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        return self._by_customer.get(code)
+
+    def by_customer(self, customer_id):
+        """
+        The customer's orders, oldest first (what purchase_history used to hold).
+        """
+        return self._views(self.customer_positions(customer_id))
+
+    def product_positions(self, product_ids):
+        """
+        Positions of the orders holding any of `product_ids`, each once, in order.
+        """
+        if np.isscalar(product_ids):
+            return self._by_product.get(int(product_ids))
+        postings = [self._by_product.get(int(pid)) for pid in set(product_ids)]
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+        if len(postings) == 1:
+            return postings[0]
+        return np.unique(np.concatenate(postings))
+
+    def containing(self, product_ids):
+        """
+        Orders holding a product_id (or any of a list of them).
+        """
+        return self._views(self.product_positions(product_ids))
+
+    def id_range_positions(self, min_order_id=None, max_order_id=None):
+        ids = self.book.order_id
+        if self._ids_sorted:
+            a = 0 if min_order_id is None else int(np.searchsorted(ids, min_order_id, side="left"))
+            b = len(ids) if max_order_id is None else int(np.searchsorted(ids, max_order_id, side="right"))
+            return np.arange(a, b, dtype=np.int64)
+        mask = np.ones(len(ids), dtype=bool)
+        if min_order_id is not None:
+            mask &= ids >= min_order_id
+        if max_order_id is not None:
+            mask &= ids <= max_order_id
+        return np.flatnonzero(mask)
+
+    def range(self, min_order_id=None, max_order_id=None):
+        """
+        Orders with min_order_id <= order_id <= max_order_id (either bound optional).
+        """
+        return self._views(self.id_range_positions(min_order_id, max_order_id))
+
+    def query_positions(self, customer_id=None, product_ids=None, min_order_id=None, max_order_id=None,
+                        min_total=None, max_total=None, limit=None):
+        # Start from the narrowest index, then filter the candidates on the columns
+        book = self.book
+        candidates = None
+        if customer_id is not None:
+            candidates = self.customer_positions(customer_id)
+        if product_ids is not None:
+            by_product = self.product_positions(product_ids)
+            candidates = by_product if candidates is None else np.intersect1d(candidates, by_product,
+                                                                              assume_unique=True)
+        if candidates is None:
+            candidates = self.id_range_positions(min_order_id, max_order_id)
+        else:
+            ids = book.order_id[candidates]
+            keep = np.ones(len(candidates), dtype=bool)
+            if min_order_id is not None:
+                keep &= ids >= min_order_id
+            if max_order_id is not None:
+                keep &= ids <= max_order_id
+            candidates = candidates[keep]
+        if min_total is not None or max_total is not None:
+            totals = book.total_cost[candidates]
+            keep = np.ones(len(candidates), dtype=bool)
+            if min_total is not None:
+                keep &= totals >= min_total
+            if max_total is not None:
+                keep &= totals <= max_total
+            candidates = candidates[keep]
+        return candidates if limit is None else candidates[:limit]
+
+    def query(self, customer_id=None, product_ids=None, min_order_id=None, max_order_id=None,
+              min_total=None, max_total=None, limit=None):
+        """
+        Orders matching every given filter (all optional):
+
+        customer_id                 placed by this customer
+        product_ids                 holding this product, or any of this list of products
+        min_order_id, max_order_id  order_id in [min_order_id, max_order_id]
+        min_total, max_total        total_cost in [min_total, max_total]
+        limit                       at most this many (the oldest)
+        """
+        return self._views(self.query_positions(customer_id, product_ids, min_order_id, max_order_id,
+                                                min_total, max_total, limit))
+
+    def co_purchase_counts(self, cart_items):
+        """
+        Same counts as scanning every order: for each order holding any cart item,
+        +1 per line of a product that is not in the cart.
+        """
+        cart = np.unique(np.asarray(list(cart_items), dtype=np.int64))
+        positions = self.product_positions(cart.tolist())
+        if not len(positions):
+            return {}
+        book = self.book
+        offsets = book.item_offsets
+        starts, ends = offsets[positions], offsets[positions + 1]
+        sizes = ends - starts
+        # Line indices of all the neighbouring orders, without a Python loop
+        lines = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(int(sizes.sum()))
+        pids = book.product_id[lines]
+        pids = pids[~np.isin(pids, cart)]
+        values, counts = np.unique(pids, return_counts=True)
+        return dict(zip(values.tolist(), counts.tolist()))
@@ -0,0 +1,168 @@
+import json
+import os
+
+from inventory_manager import DATA_DIR
+from order import OrderBook
+import perf
+
+ORDERS_FILE = os.path.join(DATA_DIR, 'orders.json')
+ORDERS_JOURNAL_FILE = os.path.join(DATA_DIR, 'orders.journal')
+
+# Fold the journal back into the snapshot at load time once it holds this many orders
+COMPACT_THRESHOLD = 1000
+
+
+class OrderJournal:
+    """
+    Append-only order store.
+
+    snapshot_path: JSON list of orders (the old orders.json format, so an existing
+                   orders.json is picked up as the first snapshot without any migration step)
+    journal_path:  one JSON order per line, appended on every checkout
+
+    Placing an order writes a single line instead of re-serializing every order,
+    so checkout cost no longer grows with the order history.
+
+    columnar:      optional snapshot.ColumnarSnapshot. Every JSON snapshot is then
+                   also written in binary form, and load() reads that instead of
+                   parsing orders.json whenever it matches the file.
+    """
+
+    def __init__(self, snapshot_path=ORDERS_FILE, journal_path=ORDERS_JOURNAL_FILE,
+                 compact_threshold=COMPACT_THRESHOLD, columnar=None):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_threshold = compact_threshold
+        self.columnar = columnar
+        self.journal_len = 0
+
+    @perf.timed("orders.load")
+    def load(self, as_book=False):
+        """
+        Returns the full list of orders (snapshot + journal tail), or with
+        as_book=True an OrderBook (straight from the binary snapshot's arrays
+        when there is one, without building a dict per order).
+        A large tail is compacted here, since startup already pays for reading everything.
+        """
+        if not os.path.exists(self.snapshot_path):
+            self._write_snapshot([])
+        columns = self.columnar.read_orders(self.snapshot_path) if self.columnar is not None else None
+        if columns is not None:
+            orders = OrderBook(columns) if as_book else columns.to_records()
+        else:
+            with open(self.snapshot_path, 'r') as f:
+                orders = json.load(f)
+            if self.columnar is not None:
+                # No (current) binary snapshot yet: write one so the next start skips the parse
+                self.columnar.write_orders(orders, self.snapshot_path)
+            if as_book:
+                orders = OrderBook(orders)
+
+        if isinstance(orders, OrderBook):
+            last_snapshot_id = int(orders.order_id.max()) if len(orders) else 0
+        else:
+            last_snapshot_id = max((o["order_id"] for o in orders), default=0)
+        tail = []
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        order = json.loads(line)
+                    except ValueError:
+                        # A torn line from a crash mid-append. append() cuts one off before
+                        # writing, but skip rather than stop in case orders follow it
+                        continue
+                    # Skip records already folded into the snapshot (crash between the
+                    # snapshot replace and the journal truncate in compact())
+                    if order["order_id"] <= last_snapshot_id:
+                        continue
+                    tail.append(order)
+
+        orders.extend(tail)
+        self.journal_len = len(tail)
+        if self.journal_len >= self.compact_threshold:
+            self.compact(orders)
+        return orders
+
+    @perf.timed("orders.append")
+    def append(self, order):
+        """
+        Appends one order record to the journal. O(size of the order).
+        A partial last line left by a crash mid-append is cut off first, so the
+        new record starts on a line of its own.
+        """
+        append_line(self.journal_path, json.dumps(order))
+        self.journal_len += 1
+
+    @perf.timed("orders.compact")
+    def compact(self, orders):
+        """
+        Rewrites the snapshot from `orders` and empties the journal. Can be called on demand.
+        """
+        self._write_snapshot(orders)
+        with open(self.journal_path, 'w'):
+            pass
+        self.journal_len = 0
+
+    def _write_snapshot(self, orders):
+        # Write to a temp file and swap it in so a crash never leaves a half-written snapshot
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(orders.to_records() if isinstance(orders, OrderBook) else orders, f, indent=4)
+            perf.add_bytes(self.snapshot_path, f.tell())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        if self.columnar is not None:
+            self.columnar.write_orders(orders, self.snapshot_path)
+
+
+def append_line(path, text, fsync=True):
+    """
+    Appends `text` as one line to the file at `path`, cutting off a partial last
+    line left by a crash mid-append first, so the new line starts on its own.
+    """
+    line = (text + "\n").encode("utf-8")
+    with open(path, 'ab+') as f:
+        end = f.seek(0, os.SEEK_END)
+        if end:
+            f.seek(end - 1)
+            if f.read(1) != b"\n":
+                f.truncate(_line_start(f, end))
+        f.write(line)
+        perf.add_bytes(path, len(line))
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+
+
+def _line_start(f, end, chunk=4096):
+    # Offset just past the last newline before `end` (0 if there is none)
+    pos = end
+    while pos > 0:
+        start = max(0, pos - chunk)
+        f.seek(start)
+        newline = f.read(pos - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        pos = start
+    return 0
+
+
+def migrate_orders(snapshot_path=ORDERS_FILE, journal_path=ORDERS_JOURNAL_FILE):
+    """
+    One-shot migration from a plain orders.json: loads it (plus any journal tail)
+    and writes a fresh snapshot with an empty journal next to it.
+    """
+    journal = OrderJournal(snapshot_path, journal_path)
+    orders = journal.load()
+    journal.compact(orders)
+    return len(orders)
+
+
+if __name__ == "__main__":
+    # python src/order_store.py  -> compact orders.journal into orders.json
+    print(f"Compacted {migrate_orders()} orders into {ORDERS_FILE}")
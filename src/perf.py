@@ -0,0 +1,236 @@
+"""
+Lightweight instrumentation for the app's hot paths: latency histograms and
+call counts per named operation, and bytes written per data file.
+
+    @perf.timed("storage.save_order")        # decorator
+    with perf.timer("page.Analytics"):       # context manager
+    perf.add_bytes(path, n)                  # after writing a file
+
+Recording is off unless ECOMMERCE_PERF=1 (or enable() is called, e.g. from the
+admin Performance page); when off a timed call costs one flag check.
+snapshot() / dump() give the numbers as JSON, and profile() captures a cProfile
+of one block (one Streamlit rerun). ECOMMERCE_PERF_DUMP=<file> writes the
+snapshot at exit.
+"""
+import atexit
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+PERF_ENABLED = os.getenv("ECOMMERCE_PERF", "0") == "1"
+# If set, snapshot() is written to this file at exit
+PERF_DUMP = os.getenv("ECOMMERCE_PERF_DUMP")
+# Upper bounds (ms) of the histogram buckets; slower calls land in a last, open-ended bucket
+BUCKETS_MS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+_enabled = PERF_ENABLED
+_lock = threading.Lock()
+_latencies = {}    # name -> Histogram
+_bytes = {}        # path -> [writes, bytes]
+_profile = None    # the last profile() capture
+_profile_requests = set()
+
+
+class Histogram:
+    """
+    Call count, total/min/max and bucketed latencies of one operation.
+    Percentiles are read off the buckets (the bucket's upper bound, capped at max).
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.n = 0
+        self.total_ms = 0.0
+        self.min_ms = float("inf")
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+        self.total_ms += ms
+        self.min_ms = min(self.min_ms, ms)
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q):
+        if not self.n:
+            return 0.0
+        rank = q / 100 * self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                bound = BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            "calls": self.n,
+            "total_ms": self.total_ms,
+            "mean_ms": self.total_ms / self.n if self.n else 0.0,
+            "min_ms": self.min_ms if self.n else 0.0,
+            "max_ms": self.max_ms,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            # {"<=1": calls, ..., ">10000": calls}, empty buckets left out
+            "buckets": {(f"<={BUCKETS_MS[i]:g}" if i < len(BUCKETS_MS) else f">{BUCKETS_MS[-1]:g}"): count
+                        for i, count in enumerate(self.counts) if count},
+        }
+
+
+def enabled():
+    return _enabled
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+def record(name, seconds):
+    with _lock:
+        histogram = _latencies.get(name)
+        if histogram is None:
+            histogram = _latencies[name] = Histogram()
+        histogram.add(seconds * 1000)
+
+def add_bytes(path, n):
+    """
+    Counts a write of `n` bytes to `path`.
+    """
+    if not _enabled:
+        return
+    path = os.path.normpath(path)
+    with _lock:
+        entry = _bytes.get(path)
+        if entry is None:
+            entry = _bytes[path] = [0, 0]
+        entry[0] += 1
+        entry[1] += n
+
+
+def timed(name):
+    """
+    Decorator recording each call's latency under `name`.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+class timer:
+    """
+    Context manager recording the latency of its block under `name`.
+    """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if _enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class profile:
+    """
+    Context manager running its block under cProfile; the stats are kept as
+    the last capture (last_profile()) and in `self.text`.
+    """
+
+    def __init__(self, label=None, sort="cumulative", limit=40):
+        self.label = label
+        self.sort = sort
+        self.limit = limit
+        self.profiler = cProfile.Profile()
+        self.text = None
+
+    def __enter__(self):
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        global _profile
+        self.profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats(self.sort).print_stats(self.limit)
+        self.text = out.getvalue()
+        _profile = {"label": self.label, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "sort": self.sort,
+                    "stats": self.text}
+        return False
+
+
+def last_profile():
+    return _profile
+
+def request_profile(label):
+    """
+    Asks for the next run of `label` (e.g. a page, whichever session runs it) to be profiled.
+    """
+    with _lock:
+        _profile_requests.add(label)
+
+def take_profile_request(label):
+    with _lock:
+        if label in _profile_requests:
+            _profile_requests.discard(label)
+            return True
+        return False
+
+
+def snapshot():
+    """
+    Everything recorded so far: {"enabled", "latency": {name: histogram},
+    "bytes_written": {path: {"writes", "bytes"}}, "profile"}.
+    """
+    with _lock:
+        latency = {name: h.to_dict() for name, h in sorted(_latencies.items())}
+        written = {path: {"writes": w, "bytes": b} for path, (w, b) in sorted(_bytes.items())}
+    return {"enabled": _enabled, "latency": latency, "bytes_written": written, "profile": _profile}
+
+
+def dump(path=None):
+    """
+    snapshot() as JSON; also written to `path` if given.
+    """
+    text = json.dumps(snapshot(), indent=4)
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
+
+
+def reset():
+    global _profile
+    with _lock:
+        _latencies.clear()
+        _bytes.clear()
+        _profile = None
+
+
+if PERF_DUMP:
+    atexit.register(dump, PERF_DUMP)
@@ -1,4 +1,6 @@
 class Product:
+    __slots__ = ("product_id", "name", "price", "stock", "popularity")
+
     def __init__(self, product_id, name, price, stock, popularity=0):
         self.product_id = product_id
         self.name = name
@@ -1,8 +1,273 @@
-import pandas as pd
 import math
-from collections import defaultdict
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import perf
+
+TOP_K = 3
+# Approximate mode: score only this many nearest products per cart item (plus
+# co-purchased ones) instead of the whole catalog. Unset = exact scoring.
+ANN_CANDIDATES = int(os.getenv("ECOMMERCE_ANN_CANDIDATES", "0")) or None
+# Batch scoring works on blocks of at most this many floats (carts x catalog)
+BATCH_BLOCK_SIZE = 4_000_000
+# Shared recommendation cache: max entries and seconds an entry stays valid
+REC_CACHE_SIZE = int(os.getenv("ECOMMERCE_REC_CACHE_SIZE", "2048"))
+REC_CACHE_TTL = float(os.getenv("ECOMMERCE_REC_CACHE_TTL", "600"))
+
+
+class CoPurchaseIndex:
+    """
+    Item-to-item co-occurrence counts, built once from the order history and
+    updated per order in place_final_order, so collaborative scoring no longer
+    scans every order.
+
+    pair_counts[a][b]: number of times b appears in orders that contain a
+    postings[a]:       positions (in order_pids) of the orders that contain a
+    """
+
+    def __init__(self, orders=()):
+        self.pair_counts = defaultdict(lambda: defaultdict(int))
+        self.postings = defaultdict(list)
+        self.order_pids = []
+        for order in orders:
+            self.add_order(order)
+
+    def add_order(self, order):
+        """
+        O(items in order^2) for the pair counts, independent of the history size.
+        """
+        pids = [p[0] for p in order["items"]]
+        pos = len(self.order_pids)
+        self.order_pids.append(pids)
+        for a in set(pids):
+            self.postings[a].append(pos)
+            counts = self.pair_counts[a]
+            for b in pids:
+                if b != a:
+                    counts[b] += 1
+
+    def co_purchase_counts(self, cart_items):
+        """
+        Same counts as scanning every order: for each order holding any cart item,
+        +1 per line of a product that is not in the cart.
+        """
+        cart_set = set(cart_items)
+        co_purchase_counts = defaultdict(int)
+        if len(cart_set) == 1:
+            # One distinct cart item: the pair counts are the answer
+            (cart_pid,) = cart_set
+            co_purchase_counts.update(self.pair_counts.get(cart_pid, {}))
+            return co_purchase_counts
+
+        # Several cart items: visit each neighbouring order once, even if it
+        # holds more than one of them
+        positions = set()
+        for pid in cart_set:
+            positions.update(self.postings.get(pid, ()))
+        for pos in positions:
+            for pid in self.order_pids[pos]:
+                if pid not in cart_set:
+                    co_purchase_counts[pid] += 1
+        return co_purchase_counts
+
+
+class GridIndex:
+    """
+    Uniform grid over the (price, popularity) plane, used to find the products
+    nearest to a point without measuring the distance to every product.
+    Cells are square (the distance is plain Euclidean) and sized to hold about
+    `per_cell` products on average.
+    """
+
+    def __init__(self, x, y, per_cell=16):
+        n = len(x)
+        self.x = x
+        self.y = y
+        self.x0 = float(x.min())
+        self.y0 = float(y.min())
+        span_x = float(x.max()) - self.x0
+        span_y = float(y.max()) - self.y0
+        self.cell = max(math.sqrt(span_x * span_y * per_cell / n),
+                        max(span_x, span_y) * per_cell / n, 1e-9)
+        cx = ((x - self.x0) // self.cell).astype(np.int64)
+        cy = ((y - self.y0) // self.cell).astype(np.int64)
+        self.nx = int(cx.max()) + 1
+        self.ny = int(cy.max()) + 1
+
+        # cell key -> positions of the products in that cell
+        keys = cx * self.ny + cy
+        order = np.argsort(keys, kind="stable")
+        cell_keys, starts = np.unique(keys[order], return_index=True)
+        ends = np.append(starts[1:], n)
+        self.cells = {int(k): order[a:b] for k, a, b in zip(cell_keys, starts, ends)}
+
+    def _ring(self, cx, cy, r):
+        if r == 0:
+            cells = [(cx, cy)]
+        else:
+            cells = [(i, cy - r) for i in range(cx - r, cx + r + 1)]
+            cells += [(i, cy + r) for i in range(cx - r, cx + r + 1)]
+            cells += [(cx - r, j) for j in range(cy - r + 1, cy + r)]
+            cells += [(cx + r, j) for j in range(cy - r + 1, cy + r)]
+        for i, j in cells:
+            if 0 <= i < self.nx and 0 <= j < self.ny:
+                found = self.cells.get(i * self.ny + j)
+                if found is not None:
+                    yield found
+
+    def nearest(self, qx, qy, m):
+        """
+        Positions of the m products closest to (qx, qy). Rings of cells are
+        visited outwards until no unvisited cell can hold anything closer.
+        """
+        cx = min(max(int((qx - self.x0) // self.cell), 0), self.nx - 1)
+        cy = min(max(int((qy - self.y0) // self.cell), 0), self.ny - 1)
+        found = []
+        count = 0
+        for r in range(max(self.nx, self.ny) + 1):
+            for positions in self._ring(cx, cy, r):
+                found.append(positions)
+                count += len(positions)
+            if count >= m:
+                pos = np.concatenate(found)
+                dist = np.hypot(self.x[pos] - qx, self.y[pos] - qy)
+                # Anything outside the visited rings is at least r cells away
+                if np.partition(dist, m - 1)[m - 1] <= r * self.cell:
+                    return pos[np.argpartition(dist, m - 1)[:m]]
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.intp)
+
+
+class SimilarityEngine:
+    """
+    Content-based scoring over the whole catalog held as NumPy arrays.
+
+    distance(A,B)   = sqrt( (priceA - priceB)^2 + (popA - popB)^2 )
+    similarity(A,B) = 1 / (1 + distance)
+
+    A cart is scored against every product in one vectorized pass instead of
+    one Python call per (cart item, product) pair.
+    """
+
+    def __init__(self, inventory_df, version=None):
+        self.version = version
+        self.ids = inventory_df["id"].to_numpy()
+        self.price = inventory_df["price"].to_numpy(dtype=float, copy=True)
+        self.popularity = inventory_df["popularity"].to_numpy(dtype=float, copy=True)
+        self.position = {int(pid): i for i, pid in enumerate(self.ids)}
+        # Empty-cart / fallback answer, computed the same way as before but only once
+        self.top_popular = (inventory_df
+                            .sort_values(by="popularity", ascending=False)
+                            .head(TOP_K)["id"].tolist())
+        self._grid = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, pids):
+        # Cart items that are no longer in the catalog are ignored
+        return np.array([self.position[pid] for pid in pids if pid in self.position], dtype=np.intp)
+
+    def similarity_scores(self, cart_items):
+        """
+        Returns an array aligned with self.ids: total similarity of each product
+        to the cart (a product added twice counts twice).
+        """
+        cart_pos = self.positions(cart_items)
+        if len(cart_pos) == 0:
+            return np.zeros(len(self.ids))
+        price_diff = self.price[None, :] - self.price[cart_pos][:, None]
+        pop_diff = self.popularity[None, :] - self.popularity[cart_pos][:, None]
+        return (1.0 / (1.0 + np.sqrt(price_diff ** 2 + pop_diff ** 2))).sum(axis=0)
+
+    @property
+    def grid(self):
+        # Only built the first time approximate scoring is used
+        if self._grid is None:
+            self._grid = GridIndex(self.price, self.popularity)
+        return self._grid
+
+    def candidate_positions(self, cart_items, n_candidates):
+        """
+        Union of the `n_candidates` nearest products of every cart item.
+        """
+        cart_pos = self.positions(cart_items)
+        m = min(n_candidates + 1, len(self.ids))  # +1: the cart item finds itself
+        found = [self.grid.nearest(self.price[p], self.popularity[p], m) for p in np.unique(cart_pos)]
+        return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.intp)
+
+    def similarity_scores_at(self, cart_items, candidate_pos):
+        """
+        Same as similarity_scores, restricted to the products at `candidate_pos`.
+        """
+        cart_pos = self.positions(cart_items)
+        if len(cart_pos) == 0:
+            return np.zeros(len(candidate_pos))
+        price_diff = self.price[candidate_pos][None, :] - self.price[cart_pos][:, None]
+        pop_diff = self.popularity[candidate_pos][None, :] - self.popularity[cart_pos][:, None]
+        return (1.0 / (1.0 + np.sqrt(price_diff ** 2 + pop_diff ** 2))).sum(axis=0)
+
+    def top_k(self, scores, exclude_pos, k=TOP_K, positions=None):
+        """
+        Ids of the k best scores, skipping `exclude_pos`. `scores` is aligned with
+        self.ids, or with `positions` when only a subset was scored. Uses a partial
+        sort (argpartition), so only the k winners are fully ordered.
+        """
+        if positions is None:
+            positions = np.arange(len(scores))
+        keep = ~np.isin(positions, exclude_pos)
+        scores = scores[keep]
+        positions = positions[keep]
+        if len(scores) == 0:
+            return []
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        # Highest score first, ties in catalog order
+        best = best[np.lexsort((positions[best], -scores[best]))]
+        return [int(pid) for pid in self.ids[positions[best]]]
+
+
+_engine_lock = threading.Lock()
+_engine_cache = {}
+
+def get_similarity_engine(inventory_df, inventory_version=None):
+    """
+    Returns a SimilarityEngine for `inventory_df`, reusing the cached one while
+    `inventory_version` (bumped by update_inventory) is unchanged.
+    Without a version nothing is cached.
+    """
+    if inventory_version is None:
+        return SimilarityEngine(inventory_df)
+    with _engine_lock:
+        engine = _engine_cache.get("engine")
+        if engine is None or engine.version != inventory_version or len(engine) != len(inventory_df):
+            engine = SimilarityEngine(inventory_df, inventory_version)
+            _engine_cache["engine"] = engine
+        return engine
+
+
+def _scan_co_purchases(cart_items, orders):
+    # Count how frequently each product is co-purchased with items in cart.
+    co_purchase_counts = defaultdict(int)  # product_id -> frequency
+    for order in orders:
+        pids_in_order = [p[0] for p in order["items"]]
+        # Check if this order has at least one item from the cart
+        if any(pid in pids_in_order for pid in cart_items):
+            # For each product in this order that isn't in the cart, increment
+            for (pid, _) in order["items"]:
+                if pid not in cart_items:
+                    co_purchase_counts[pid] += 1
+    return co_purchase_counts
 
-def get_recommendations(cart_items, orders, inventory_df):
+
+@perf.timed("recommender.get_recommendations")
+def get_recommendations(cart_items, orders, inventory_df, copurchase_index=None, inventory_version=None,
+                        approx_candidates=ANN_CANDIDATES):
     """
     cart_items: list of product_id currently in the customer's cart
     orders: list of order dicts, where each order has:
@@ -14,85 +279,238 @@ def get_recommendations(cart_items, orders, inventory_df):
             }
     inventory_df: pd.DataFrame of all products with columns:
                   [id, name, price, stock, popularity, ... (optionally more fields)]
+    copurchase_index: optional CoPurchaseIndex over `orders`; when given, the
+                      collaborative step reads it instead of scanning `orders`
+    inventory_version: optional version of `inventory_df`; when given, the
+                       similarity arrays are cached until the version changes
+    approx_candidates: optional number of nearest products (in price/popularity
+                       space) to score per cart item instead of the whole catalog.
+                       Larger = better recall, slower. None = exact.
 
     Return: list of recommended product_ids (top 3 best matches).
     """
+    engine = get_similarity_engine(inventory_df, inventory_version)
 
     # 1) If cart is empty → recommend top 3 popular items
     if not cart_items:
-        top_popular = (inventory_df
-                       .sort_values(by="popularity", ascending=False)
-                       .head(3)["id"].tolist())
-        return top_popular
-
-    # For convenience, let's set up a quick way to get product info as a dict
-    # {product_id: {"price":..., "popularity":..., ...}}
-    product_dict = inventory_df.set_index("id").to_dict("index")
+        return list(engine.top_popular)
 
     # 2) Collaborative Filtering: find other orders that contain any cart item
     #    Count how frequently each product is co-purchased with items in cart.
-    co_purchase_counts = defaultdict(int)  # product_id -> frequency
-    for order in orders:
-        pids_in_order = [p[0] for p in order["items"]]
-        # Check if this order has at least one item from the cart
-        if any(pid in pids_in_order for pid in cart_items):
-            # For each product in this order that isn't in the cart, increment
-            for (pid, _) in order["items"]:
-                if pid not in cart_items:
-                    co_purchase_counts[pid] += 1
+    if copurchase_index is not None:
+        co_purchase_counts = copurchase_index.co_purchase_counts(cart_items)
+    else:
+        co_purchase_counts = _scan_co_purchases(cart_items, orders)
 
-    # 3) Content-Based Similarity:
-    #    We'll define a simple distance measure for two products A and B:
-    #    distance(A,B) = sqrt( (priceA - priceB)^2 + (popA - popB)^2 )
-    #    Then similarity = 1 / (1 + distance)
-    #    For each product in cart, we find similar items and accumulate a similarity score.
-    similarity_scores = defaultdict(float)  # product_id -> total similarity
-
-    def product_distance(pid1, pid2):
-        # safe retrieval
-        p1 = product_dict[pid1]
-        p2 = product_dict[pid2]
-        price_dist = (p1["price"] - p2["price"])**2
-        pop_dist = (p1["popularity"] - p2["popularity"])**2
-        return math.sqrt(price_dist + pop_dist)
-
-    def product_similarity(pid1, pid2):
-        dist = product_distance(pid1, pid2)
-        return 1.0 / (1.0 + dist)
-
-    all_product_ids = set(inventory_df["id"].tolist())
-
-    # For each product in the cart, compute similarity to every other product
-    for cart_pid in cart_items:
-        for candidate_pid in all_product_ids:
-            if candidate_pid == cart_pid:
-                continue
-            # We skip if candidate is already in cart
-            if candidate_pid in cart_items:
-                continue
-            similarity_scores[candidate_pid] += product_similarity(cart_pid, candidate_pid)
+    # Collaborative scores as (catalog position, count) arrays
+    co_pos, co_freq = [], []
+    for pid, freq in co_purchase_counts.items():
+        pos = engine.position.get(pid)
+        if pos is not None:
+            co_pos.append(pos)
+            co_freq.append(freq)
+    co_pos = np.array(co_pos, dtype=np.intp)
+    co_freq = np.array(co_freq, dtype=float)
+
+    # 3) Content-Based Similarity: total similarity of each product to the cart,
+    #    either for the whole catalog or only for the nearest candidates
+    if approx_candidates:
+        candidate_pos = np.union1d(engine.candidate_positions(cart_items, approx_candidates), co_pos)
+        scores = engine.similarity_scores_at(cart_items, candidate_pos)
+        co_slots = np.searchsorted(candidate_pos, co_pos)
+    else:
+        candidate_pos = None
+        scores = engine.similarity_scores(cart_items)
+        co_slots = co_pos
 
     # 4) Combine Collaborative Score + Similarity Score
     #    e.g., final_score = alpha * collaborative_frequency + beta * similarity
     #    We'll pick alpha=1.0, beta=1.0 for an equal mix
-    final_scores = {}
-    for pid in all_product_ids:
-        if pid in cart_items:
-            continue
-        freq = co_purchase_counts[pid]    # how often this product is co-purchased
-        sim  = similarity_scores[pid]     # total similarity to items in cart
-        final_scores[pid] = freq + sim    # alpha=1.0, beta=1.0
-
-    # If we have no final scores (e.g., no relevant orders or no similarities),
-    # fallback to top popularity.
-    if not final_scores:
-        fallback = (inventory_df
-                    .sort_values(by="popularity", ascending=False)
-                    .head(3)["id"].tolist())
-        return fallback
-
-    # 5) Sort by final_scores in descending order
-    sorted_pids = sorted(final_scores.items(), key=lambda x: x[1], reverse=True)
-    # Return top 3 product_ids
-    recommended_pids = [pid for (pid, _) in sorted_pids[:3]]
+    scores[co_slots] += co_freq
+
+    # 5) Top 3 products that are not already in the cart. If every product is
+    #    in the cart, fallback to top popularity.
+    recommended_pids = engine.top_k(scores, engine.positions(cart_items), positions=candidate_pos)
+    if not recommended_pids:
+        return list(engine.top_popular)
     return recommended_pids
+
+
+class RecommendationCache:
+    """
+    Bounded LRU cache with a TTL for get_recommendations results, shared by
+    every session in the process. Keys hold the cart contents plus the
+    inventory and orders versions, so a data change never serves stale entries;
+    invalidate() also drops them right away to free the space.
+    """
+
+    def __init__(self, maxsize=REC_CACHE_SIZE, ttl=REC_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, recommendations)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, key, recommendations):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, list(recommendations))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+recommendation_cache = RecommendationCache()
+
+@perf.timed("recommender.get_cached_recommendations")
+def get_cached_recommendations(cart_items, orders, inventory_df, inventory_version, orders_version,
+                               copurchase_index=None):
+    """
+    get_recommendations through the shared recommendation_cache. The same cart
+    (in any order) with unchanged data is answered without recomputing,
+    including the empty-cart popularity list.
+    """
+    key = (tuple(sorted(cart_items)), inventory_version, orders_version)
+    recs = recommendation_cache.get(key)
+    if recs is None:
+        recs = get_recommendations(cart_items, orders, inventory_df, copurchase_index=copurchase_index,
+                                   inventory_version=inventory_version)
+        recommendation_cache.put(key, recs)
+    return recs
+
+
+def _score_carts(engine, carts, co_counts, k):
+    """
+    Scores a chunk of carts together: the (distinct cart items x catalog)
+    similarity block is computed once, then summed per cart.
+    """
+    cart_pos = [engine.positions(cart) for cart in carts]
+    lengths = np.array([len(pos) for pos in cart_pos])
+    scores = np.zeros((len(carts), len(engine)))
+    if lengths.sum():
+        flat = np.concatenate(cart_pos)
+        distinct, rows = np.unique(flat, return_inverse=True)
+        price_diff = engine.price[None, :] - engine.price[distinct][:, None]
+        pop_diff = engine.popularity[None, :] - engine.popularity[distinct][:, None]
+        similarity = 1.0 / (1.0 + np.sqrt(price_diff ** 2 + pop_diff ** 2))
+        # One reduceat over the per-item rows gives every cart's total at once
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        filled = lengths > 0
+        scores[filled] = np.add.reduceat(similarity[rows], starts[filled], axis=0)
+
+    for row, freqs in enumerate(co_counts):
+        for pid, freq in freqs.items():
+            pos = engine.position.get(pid)
+            if pos is not None:
+                scores[row, pos] += freq
+        scores[row, cart_pos[row]] = -np.inf
+
+    k = min(k, len(engine))
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k else np.zeros((len(carts), 0), dtype=np.intp)
+    results = []
+    for row, cart in enumerate(carts):
+        top = best[row][np.isfinite(scores[row, best[row]])]
+        top = top[np.lexsort((top, -scores[row, top]))]
+        if not cart or len(top) == 0:
+            results.append(list(engine.top_popular))
+        else:
+            results.append([int(pid) for pid in engine.ids[top]])
+    return results
+
+
+_worker_engine = None
+
+def _init_worker(engine):
+    global _worker_engine
+    _worker_engine = engine
+
+def _score_carts_in_worker(job):
+    carts, co_counts, k = job
+    return _score_carts(_worker_engine, carts, co_counts, k)
+
+
+def recommend_batch(carts, orders, inventory_df, k=TOP_K, copurchase_index=None, inventory_version=None,
+                    workers=None):
+    """
+    Top-k recommendations for many carts at once, e.g. every open cart in
+    bill_for_all.json or every customer for a campaign.
+
+    carts: list of cart_items lists (as for get_recommendations)
+    workers: optional number of processes to spread the chunks over
+
+    Returns one list of product_ids per cart. The similarity arrays and the
+    co-purchase index are built once for the whole batch, and carts are
+    scored chunk by chunk in matrix form. Scores equal get_recommendations'
+    up to float rounding.
+    """
+    engine = get_similarity_engine(inventory_df, inventory_version)
+    if copurchase_index is None:
+        copurchase_index = CoPurchaseIndex(orders)
+
+    # Keep each chunk's (carts x catalog) and (cart items x catalog) blocks bounded
+    max_rows = max(1, min(4096, BATCH_BLOCK_SIZE // max(len(engine), 1)))
+    jobs = []
+    chunk, chunk_items = [], 0
+    for cart in carts:
+        if chunk and (len(chunk) >= max_rows or chunk_items + len(cart) > max_rows):
+            jobs.append(chunk)
+            chunk, chunk_items = [], 0
+        chunk.append(cart)
+        chunk_items += len(cart)
+    if chunk:
+        jobs.append(chunk)
+    jobs = [(chunk, [dict(copurchase_index.co_purchase_counts(cart)) if cart else {} for cart in chunk], k)
+            for chunk in jobs]
+
+    if workers and workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(engine,)) as pool:
+            chunk_results = list(pool.map(_score_carts_in_worker, jobs))
+    else:
+        chunk_results = [_score_carts(engine, *job) for job in jobs]
+    return [recs for chunk in chunk_results for recs in chunk]
+
+
+if __name__ == "__main__":
+    # python src/recommender.py  -> precompute recommendations for every open cart
+    from storage import get_storage
+
+    storage = get_storage()
+    inventory_df = storage.load_inventory()
+    orders = storage.load_orders()
+    open_carts = [(cust_id, order_num, [item["product_id"] for item in cart["order_items"]])
+                  for cust_id, carts in storage.load_bill().items()
+                  for order_num, cart in carts.items()]
+    recs = recommend_batch([items for _, _, items in open_carts], orders, inventory_df)
+    for (cust_id, order_num, _), pids in zip(open_carts, recs):
+        print(f"{cust_id} cart {order_num}: {pids}")
@@ -0,0 +1,71 @@
+class CatalogIndex:
+    """
+    product id -> row label in the inventory DataFrame, so a product lookup is a
+    dict hit instead of a boolean-mask scan over the whole catalog.
+
+    sync() must be called whenever the inventory changes (update_inventory does).
+    Value edits made in place on the same DataFrame keep the index valid; a new
+    DataFrame (product added or deleted) is re-indexed.
+    """
+
+    def __init__(self, inventory_df):
+        self.rebuild(inventory_df)
+
+    def rebuild(self, inventory_df):
+        self.df = inventory_df
+        self.rows = dict(zip(inventory_df["id"].tolist(), inventory_df.index))
+
+    def sync(self, inventory_df):
+        if inventory_df is not self.df:
+            self.rebuild(inventory_df)
+
+    def __contains__(self, product_id):
+        return product_id in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def row_label(self, product_id):
+        return self.rows.get(product_id)
+
+    def get(self, product_id):
+        """
+        Returns the product as a dict ({"id":..., "name":..., "price":..., ...}) or None.
+        """
+        label = self.rows.get(product_id)
+        if label is None:
+            return None
+        return self.df.loc[label].to_dict()
+
+    def value(self, product_id, column, default=None):
+        label = self.rows.get(product_id)
+        if label is None:
+            return default
+        return self.df.at[label, column]
+
+    def names(self, product_ids):
+        return [self.df.at[self.rows[pid], "name"] for pid in product_ids if pid in self.rows]
+
+
+class CustomerRegistry:
+    """
+    customer_id -> customer dict over the customers list (the dicts are shared,
+    so updating one through the registry updates the list too).
+    """
+
+    def __init__(self, customers):
+        self.customers = customers
+        self.by_id = {c["customer_id"]: c for c in customers}
+
+    def __contains__(self, customer_id):
+        return customer_id in self.by_id
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, customer_id):
+        return self.by_id.get(customer_id)
+
+    def add(self, customer):
+        self.customers.append(customer)
+        self.by_id[customer["customer_id"]] = customer
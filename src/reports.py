@@ -1,21 +1,212 @@
-def generate_sales_report(orders, products):
+import csv
+import heapq
+import io
+import json
+import os
+import re
+import sys
+from operator import itemgetter
+
+from order import OrderBook
+from order_store import ORDERS_FILE, ORDERS_JOURNAL_FILE
+import perf
+
+REPORT_FORMATS = ("text", "csv", "json")
+# Bytes read from an order log at a time
+READ_CHUNK = 1 << 20
+
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+@perf.timed("reports.generate_sales_report")
+def generate_sales_report(orders, products, order_lines=None, top_n=None, fmt="text", rollups=None):
     """
-    Generate a simple sales report. 
-    orders: list of dicts {order_id, customer_id, items, total_cost}
+    Generate a simple sales report.
+    orders: list of dicts {order_id, customer_id, items, total_cost}, or an order.OrderBook
+            (then the totals and per-product sales are computed over its arrays)
     products: dict {product_id: {...}}
+    order_lines: optional order-lines fact table (analytics.OrderLinesTable.table());
+                 when given, per-product sales come from one groupby over it
+    top_n: optional number of products to list (default all)
+    fmt: "text", "csv" or "json" (see write_sales_report)
+    rollups: optional sales_rollups.SalesRollups over `orders`; when given, the
+             totals are read from it in O(products) and `orders` isn't scanned
 
     Returns a string summarizing total sales and top products.
+    For order logs too big for memory use stream_sales_report.
     """
-    total_sales = sum(o['total_cost'] for o in orders)
+    if rollups is not None:
+        # Materialized totals: O(products), no pass over the orders
+        return _report_string(rollups.total_revenue, rollups.product_revenue, top_n, fmt, rollups.n_orders)
+
+    if isinstance(orders, OrderBook):
+        total_sales = float(orders.total_cost.sum())
+    else:
+        total_sales = sum(o['total_cost'] for o in orders)
+    if order_lines is not None:
+        product_sales = order_lines.groupby("product_id", sort=False)["subtotal"].sum().to_dict()
+    elif isinstance(orders, OrderBook):
+        product_sales = orders.sales_by_product(products)
+    else:
+        product_sales = {}
+        for o in orders:
+            for pid, qty in o['items']:
+                product_sales[pid] = product_sales.get(pid, 0) + (products[pid]['price'] * qty)
+    return _report_string(total_sales, product_sales, top_n, fmt, len(orders))
+
+
+def _report_string(total_sales, product_sales, top_n, fmt, n_orders):
+    sink = io.StringIO()
+    write_sales_report(sink, total_sales, product_sales, top_n=top_n, fmt=fmt, n_orders=n_orders)
+    return sink.getvalue()
+
+
+def aggregate_sales(orders, products):
+    """
+    One pass over any iterable of orders (e.g. iter_order_log()), keeping only
+    one running total per product. Returns (orders seen, total sales,
+    {product_id: sales}); memory depends on the catalog, not the number of orders.
+    """
+    prices = {pid: p['price'] for pid, p in products.items()}
     product_sales = {}
+    total_sales = 0
+    n_orders = 0
     for o in orders:
+        n_orders += 1
+        total_sales += o['total_cost']
         for pid, qty in o['items']:
-            product_sales[pid] = product_sales.get(pid, 0) + (products[pid]['price'] * qty)
+            # KeyError for an unknown product, as in generate_sales_report
+            product_sales[pid] = product_sales.get(pid, 0) + prices[pid] * qty
+    return n_orders, total_sales, product_sales
+
+
+def top_products(product_sales, top_n=None):
+    """
+    (product_id, sales) pairs, best first. With top_n, a heap keeps only the top_n
+    instead of sorting every product. Ties keep their first-seen order either way.
+    """
+    if top_n is None:
+        return sorted(product_sales.items(), key=itemgetter(1), reverse=True)
+    return heapq.nlargest(top_n, product_sales.items(), key=itemgetter(1))
+
+
+def write_sales_report(sink, total_sales, product_sales, top_n=None, fmt="text", n_orders=None):
+    """
+    Writes the report to `sink` (any file-like object with write()) line by line:
+
+    text  "Total Sales: $..." then one "Product ID <id>: $<sales>" line per product
+    csv   a rank,product_id,sales header, then one row per product
+    json  {"total_sales": ..., "orders": ..., "top_products": [{"product_id", "sales"}, ...]}
+    """
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"unknown report format {fmt!r}, expected one of {REPORT_FORMATS}")
+    ranked = top_products(product_sales, top_n)
+    if fmt == "text":
+        sink.write(f"Total Sales: ${total_sales}\n")
+        sink.write("Top Selling Products:\n")
+        for pid, sales in ranked:
+            sink.write(f"Product ID {pid}: ${sales}\n")
+    elif fmt == "csv":
+        writer = csv.writer(sink)
+        writer.writerow(["rank", "product_id", "sales"])
+        for rank, (pid, sales) in enumerate(ranked, 1):
+            writer.writerow([rank, pid, sales])
+    else:
+        sink.write('{"total_sales": %s, "orders": %s, "top_products": [' % (json.dumps(total_sales),
+                                                                          json.dumps(n_orders)))
+        for i, (pid, sales) in enumerate(ranked):
+            sink.write((",\n" if i else "\n") + json.dumps({"product_id": pid, "sales": sales}))
+        sink.write("\n]}\n")
+
+
+def stream_sales_report(orders, products, sink, top_n=10, fmt="text"):
+    """
+    generate_sales_report for an order log that needn't fit in memory: `orders`
+    is any iterable (a generator from iter_orders / iter_order_log, a database
+    cursor, ...) and is read once. The report goes straight to `sink`.
+
+    Returns {"orders", "total_sales", "products"} for the data read.
+    """
+    n_orders, total_sales, product_sales = aggregate_sales(orders, products)
+    write_sales_report(sink, total_sales, product_sales, top_n=top_n, fmt=fmt, n_orders=n_orders)
+    return {"orders": n_orders, "total_sales": total_sales, "products": len(product_sales)}
+
+
+def iter_orders(path, chunk_size=READ_CHUNK):
+    """
+    Yields the orders in `path` one at a time, reading `chunk_size` bytes at a
+    time: either a JSON list (orders.json) or one JSON order per line (JSONL,
+    like orders.journal; torn lines are skipped). Only the current chunk and
+    order are held in memory.
+    """
+    with open(path, 'r') as f:
+        head = f.read(chunk_size)
+        stripped = head.lstrip()
+        if stripped.startswith("["):
+            yield from _iter_json_list(f, stripped[1:], chunk_size)
+            return
+        f.seek(0)
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A torn line from a crash mid-append; the orders after it are intact
+                continue
+
+
+def _iter_json_list(f, buf, chunk_size):
+    # Decodes the list's elements with raw_decode, topping the buffer up whenever
+    # the next element runs past its end
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        pos = _SEPARATORS.match(buf, pos).end()
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            more = f.read(chunk_size)
+            if not more:
+                raise ValueError(f"invalid or truncated JSON list in {f.name}")
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield obj
+        pos = end
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+
+
+def iter_order_log(snapshot_path=ORDERS_FILE, journal_path=ORDERS_JOURNAL_FILE):
+    """
+    Every order of an order_store.OrderJournal (snapshot, then the journal tail),
+    streamed from disk without loading either file.
+    """
+    last_snapshot_id = 0
+    if os.path.exists(snapshot_path):
+        for order in iter_orders(snapshot_path):
+            last_snapshot_id = max(last_snapshot_id, order["order_id"])
+            yield order
+    if os.path.exists(journal_path):
+        for order in iter_orders(journal_path):
+            # Already folded into the snapshot (see OrderJournal.load)
+            if order["order_id"] > last_snapshot_id:
+                yield order
+
 
-    top_products = sorted(product_sales.items(), key=lambda x: x[1], reverse=True)
-    report = f"Total Sales: ${total_sales}\n"
-    report += "Top Selling Products:\n"
-    for pid, sales in top_products:
-        report += f"Product ID {pid}: ${sales}\n"
+if __name__ == "__main__":
+    # python src/reports.py [text|csv|json] [top_n] [orders file]
+    #   -> sales report of data/orders.json + orders.journal (or the given JSON/JSONL file) on stdout
+    from inventory_manager import load_inventory
 
-    return report
+    args = sys.argv[1:]
+    if len(args) > 3 or (args and args[0] not in REPORT_FORMATS) or (len(args) > 1 and not args[1].isdigit()):
+        sys.exit("usage: python src/reports.py [text|csv|json] [top_n] [orders file]")
+    fmt = args[0] if args else "text"
+    top_n = int(args[1]) if len(args) > 1 else 10
+    orders = iter_orders(args[2]) if len(args) > 2 else iter_order_log()
+    products = load_inventory().set_index("id").to_dict("index")
+    stream_sales_report(orders, products, sys.stdout, top_n=top_n, fmt=fmt)
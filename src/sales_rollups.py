@@ -0,0 +1,182 @@
+import math
+import os
+
+import numpy as np
+
+from reports import top_products
+
+FORMAT_VERSION = 1
+# Persist the rollups after this many orders (and at exit); a restart replays the rest from the orders
+ROLLUP_SAVE_EVERY = int(os.getenv("ECOMMERCE_ROLLUP_SAVE_EVERY", "100"))
+
+
+class SalesRollups:
+    """
+    Sales aggregates kept current order by order instead of being recomputed
+    from the whole history:
+
+    total_revenue, n_orders     sum of total_cost, number of orders
+    product_revenue             {product_id: revenue}, at the price paid at checkout
+    product_units               {product_id: units sold}
+    customer_spend              {customer_id: sum of total_cost}
+    customer_orders             {customer_id: number of orders}
+
+    add_order() is O(items in the order). last_order_id is the highest order id
+    applied, so a saved copy can be brought up to date by replaying only the
+    orders placed after it (catch_up()).
+    """
+
+    def __init__(self):
+        self.total_revenue = 0.0
+        self.n_orders = 0
+        self.product_revenue = {}
+        self.product_units = {}
+        self.customer_spend = {}
+        self.customer_orders = {}
+        self.last_order_id = 0
+
+    def add_order(self, order, products):
+        """
+        products: {product_id: {'price': ...}}, the prices the order's total was
+        computed with (as for Order.calculate_total); unknown products count at price 0.
+        """
+        for pid, qty in order["items"]:
+            product = products.get(pid)
+            price = float(product["price"]) if product is not None else 0.0
+            self.product_revenue[pid] = self.product_revenue.get(pid, 0.0) + price * qty
+            self.product_units[pid] = self.product_units.get(pid, 0) + int(qty)
+        cust = order["customer_id"]
+        self.customer_spend[cust] = self.customer_spend.get(cust, 0.0) + float(order["total_cost"])
+        self.customer_orders[cust] = self.customer_orders.get(cust, 0) + 1
+        self.total_revenue += float(order["total_cost"])
+        self.n_orders += 1
+        self.last_order_id = max(self.last_order_id, int(order["order_id"]))
+
+    def catch_up(self, book, products):
+        """
+        Applies the orders of `book` (an order.OrderBook) placed after last_order_id.
+        Returns how many there were.
+        """
+        newer = np.flatnonzero(book.order_id > self.last_order_id)
+        for pos in newer.tolist():
+            self.add_order(book[pos], products)
+        return len(newer)
+
+    @classmethod
+    def from_book(cls, book, inventory_df=None):
+        """
+        Full recompute over an order.OrderBook, with a few array passes. Product
+        revenue uses the current prices in `inventory_df` (0 for products no
+        longer listed, or for all without an inventory), since orders don't
+        record what each line cost.
+        """
+        rollups = cls()
+        if not len(book):
+            return rollups
+        pids, inverse = np.unique(book.product_id, return_inverse=True)
+        if inventory_df is None:
+            prices = np.zeros(len(pids), dtype=np.float64)
+        else:
+            prices = inventory_df.set_index("id")["price"].reindex(pids, fill_value=0.0).to_numpy(dtype=np.float64)
+        units = np.bincount(inverse, weights=book.qty, minlength=len(pids))
+        codes = np.arange(len(book.customers))
+        spend = np.bincount(book.customer, weights=book.total_cost, minlength=len(codes))
+        counts = np.bincount(book.customer, minlength=len(codes))
+        seen = counts > 0
+        rollups.total_revenue = float(book.total_cost.sum())
+        rollups.n_orders = len(book)
+        rollups.product_revenue = dict(zip(pids.tolist(), (units * prices).tolist()))
+        rollups.product_units = dict(zip(pids.tolist(), units.astype(np.int64).tolist()))
+        customers = [book.customers[c] for c in codes[seen].tolist()]
+        rollups.customer_spend = dict(zip(customers, spend[seen].tolist()))
+        rollups.customer_orders = dict(zip(customers, counts[seen].tolist()))
+        rollups.last_order_id = int(book.order_id.max())
+        return rollups
+
+    def verify(self, book):
+        """
+        Compares against a full recompute over `book`. Returns the names of the
+        aggregates that disagree (empty when everything matches). Product revenue
+        isn't checked: it can't be recomputed at the prices paid.
+        """
+        expected = SalesRollups.from_book(book)
+        mismatched = []
+        if self.n_orders != expected.n_orders or self.last_order_id != expected.last_order_id:
+            mismatched.append("n_orders")
+        if not math.isclose(self.total_revenue, expected.total_revenue, rel_tol=1e-9, abs_tol=1e-6):
+            mismatched.append("total_revenue")
+        if self.product_units != expected.product_units:
+            mismatched.append("product_units")
+        if self.customer_orders != expected.customer_orders or not _close(self.customer_spend,
+                                                                          expected.customer_spend):
+            mismatched.append("customer_spend")
+        return mismatched
+
+    def copy(self):
+        """
+        An independent copy, to read while checkout keeps updating this one.
+        """
+        rollups = SalesRollups()
+        rollups.total_revenue = self.total_revenue
+        rollups.n_orders = self.n_orders
+        rollups.product_revenue = dict(self.product_revenue)
+        rollups.product_units = dict(self.product_units)
+        rollups.customer_spend = dict(self.customer_spend)
+        rollups.customer_orders = dict(self.customer_orders)
+        rollups.last_order_id = self.last_order_id
+        return rollups
+
+    # O(1) / O(products) reads for dashboards and reports
+
+    def top_products(self, top_n=None, by="revenue"):
+        return top_products(self.product_revenue if by == "revenue" else self.product_units, top_n)
+
+    def product(self, product_id):
+        return {"revenue": self.product_revenue.get(product_id, 0.0),
+                "units": self.product_units.get(product_id, 0)}
+
+    def customer(self, customer_id):
+        return {"spend": self.customer_spend.get(customer_id, 0.0),
+                "orders": self.customer_orders.get(customer_id, 0)}
+
+    def stats(self):
+        return {"orders": self.n_orders, "total_revenue": self.total_revenue,
+                "products": len(self.product_units), "customers": len(self.customer_orders),
+                "last_order_id": self.last_order_id}
+
+    def to_dict(self):
+        return {
+            "format": FORMAT_VERSION,
+            "last_order_id": self.last_order_id,
+            "n_orders": self.n_orders,
+            "total_revenue": self.total_revenue,
+            # JSON keys are strings; product ids are turned back into ints on load
+            "products": {str(pid): [self.product_revenue[pid], self.product_units[pid]]
+                         for pid in self.product_units},
+            "customers": {cust: [self.customer_spend[cust], self.customer_orders[cust]]
+                          for cust in self.customer_orders},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        The rollups saved by to_dict(), or None if `data` is missing or in another format.
+        """
+        if not data or data.get("format") != FORMAT_VERSION:
+            return None
+        rollups = cls()
+        rollups.last_order_id = data["last_order_id"]
+        rollups.n_orders = data["n_orders"]
+        rollups.total_revenue = data["total_revenue"]
+        for pid, (revenue, units) in data["products"].items():
+            rollups.product_revenue[int(pid)] = revenue
+            rollups.product_units[int(pid)] = units
+        for cust, (spend, orders) in data["customers"].items():
+            rollups.customer_spend[cust] = spend
+            rollups.customer_orders[cust] = orders
+        return rollups
+
+
+def _close(a, b):
+    return a.keys() == b.keys() and all(math.isclose(a[k], b[k], rel_tol=1e-9, abs_tol=1e-6) for k in a)
+
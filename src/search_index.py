@@ -0,0 +1,148 @@
+import bisect
+import heapq
+
+# Ranking classes, best first
+EXACT, NAME_PREFIX, WORD_PREFIX, SUBSTRING = range(4)
+# A substring whose rarest trigram is in more than 1/DENSE_FRACTION of the names
+# is answered by scanning names in order instead of intersecting postings
+DENSE_FRACTION = 50
+
+
+def _norm(text):
+    return str(text).casefold()
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductSearchIndex:
+    """
+    Case-insensitive product name search for the Place Orders page.
+
+    - sorted (name, id) and (word, id) arrays answer name / word prefix queries with bisect
+    - a trigram -> ids map answers substring queries (3+ characters)
+
+    Results are ranked exact name > name prefix > word prefix > substring, then
+    alphabetically. add/remove keep all three structures current, so product
+    edits never need a full rebuild.
+    """
+
+    def __init__(self, inventory_df=None):
+        self.names = {}        # id -> normalized name
+        self.display = {}      # id -> name as entered
+        self.name_keys = []    # sorted [(normalized name, id)]
+        self.word_keys = []    # sorted [(word, id)] for every word after the first
+        self.grams = {}        # trigram -> set of ids
+        if inventory_df is not None:
+            self.rebuild(inventory_df)
+
+    def rebuild(self, inventory_df):
+        self.names, self.display, self.grams = {}, {}, {}
+        name_keys, word_keys = [], []
+        for pid, name in zip(inventory_df["id"].tolist(), inventory_df["name"].tolist()):
+            norm = _norm(name)
+            self.names[pid] = norm
+            self.display[pid] = name
+            name_keys.append((norm, pid))
+            word_keys.extend((word, pid) for word in norm.split()[1:])
+            for gram in _trigrams(norm):
+                self.grams.setdefault(gram, set()).add(pid)
+        self.name_keys = sorted(name_keys)
+        self.word_keys = sorted(word_keys)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, pid, name):
+        if pid in self.names:
+            if self.display[pid] == name:
+                return
+            self.remove(pid)
+        norm = _norm(name)
+        self.names[pid] = norm
+        self.display[pid] = name
+        bisect.insort(self.name_keys, (norm, pid))
+        for word in norm.split()[1:]:
+            bisect.insort(self.word_keys, (word, pid))
+        for gram in _trigrams(norm):
+            self.grams.setdefault(gram, set()).add(pid)
+
+    def remove(self, pid):
+        norm = self.names.pop(pid, None)
+        if norm is None:
+            return
+        del self.display[pid]
+        _remove_sorted(self.name_keys, (norm, pid))
+        for word in norm.split()[1:]:
+            _remove_sorted(self.word_keys, (word, pid))
+        for gram in _trigrams(norm):
+            ids = self.grams.get(gram)
+            if ids is not None:
+                ids.discard(pid)
+                if not ids:
+                    del self.grams[gram]
+
+    def sync(self, inventory_df, changed_ids=None, catalog=None):
+        """
+        Applies an inventory change: only `changed_ids` are re-indexed when given
+        (looked up through the CatalogIndex), otherwise everything is rebuilt.
+        """
+        if changed_ids is None or catalog is None:
+            self.rebuild(inventory_df)
+            return
+        for pid in changed_ids:
+            name = catalog.value(pid, "name")
+            if name is None:
+                self.remove(pid)
+            else:
+                self.add(pid, name)
+
+    def search(self, query, limit=20):
+        """
+        Returns up to `limit` product ids matching `query`, best first.
+        """
+        q = _norm(query).strip()
+        if not q:
+            return []
+        results = []
+        seen = set()
+
+        def take(matches, rank_of):
+            for key, pid in matches:
+                if len(results) >= limit:
+                    return
+                if pid not in seen:
+                    seen.add(pid)
+                    results.append((rank_of(key), key, pid))
+
+        # Name prefix matches are contiguous in name_keys; the exact name sorts first
+        take(_prefix_range(self.name_keys, q), lambda key: EXACT if key == q else NAME_PREFIX)
+        results.sort()
+        if len(results) < limit:
+            take(_prefix_range(self.word_keys, q), lambda key: WORD_PREFIX)
+        if len(results) < limit and len(q) >= 3:
+            postings = sorted((self.grams.get(gram, ()) for gram in _trigrams(q)), key=len)
+            if len(postings[0]) * DENSE_FRACTION > len(self.name_keys):
+                # Common substring: walking the names alphabetically hits `limit` matches quickly
+                matches = (key for key in self.name_keys if key[1] not in seen and q in key[0])
+            else:
+                # Rare substring: intersect the rarest trigrams first, then confirm the substring
+                candidates = set(postings[0]).intersection(*postings[1:])
+                matches = heapq.nsmallest(limit, ((self.names[pid], pid) for pid in candidates
+                                                  if pid not in seen and q in self.names[pid]))
+            take(matches, lambda key: SUBSTRING)
+        return [pid for _, _, pid in results]
+
+
+def _prefix_range(keys, prefix):
+    # The entries of sorted `keys` whose text starts with `prefix`, in order. A generator:
+    # take() stops once it has enough distinct ids, however many entries it had to skip
+    i = bisect.bisect_left(keys, (prefix,))
+    while i < len(keys) and keys[i][0].startswith(prefix):
+        yield keys[i]
+        i += 1
+
+def _remove_sorted(keys, key):
+    i = bisect.bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
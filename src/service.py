@@ -0,0 +1,252 @@
+"""
+The shop's customer-facing operations, independent of any UI: search, carts,
+checkout, invoices, recommendations, order history and sales reports.
+
+ShopService runs them against the process-wide DataStore. The Streamlit app
+and the HTTP API (api.py) both go through it, and api.ApiClient offers the
+same methods over HTTP, so the app can also run against a separate API
+server (ECOMMERCE_API_URL).
+"""
+import os
+import threading
+
+from checkout import cart_key, reserve
+from data_store import get_data_store
+from recommender import get_cached_recommendations
+from reports import generate_sales_report
+from time_rollups import GRANULARITIES, bucket_of
+
+# If set (e.g. http://127.0.0.1:8000), get_service() returns a client of that API server
+API_URL = os.getenv("ECOMMERCE_API_URL")
+# Most search results returned when the caller doesn't ask for a limit
+SEARCH_LIMIT = 50
+PRODUCT_FIELDS = ["id", "name", "price", "stock", "popularity"]
+# Most buckets one sales_over_time() call returns
+MAX_SERIES_BUCKETS = 10_000
+
+
+class ServiceError(Exception):
+    """
+    A request the service can't carry out. `status` is the matching HTTP status.
+    checkout.InsufficientStock is raised as is.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def valid_customer_id(customer_id):
+    # Letters and digits only, in any script (str.isalnum), as the login page has always asked
+    return bool(customer_id) and customer_id.isalnum()
+
+
+def product_record(product):
+    # Plain Python types, so the record can go straight into JSON
+    return {"id": int(product["id"]), "name": str(product["name"]), "price": float(product["price"]),
+            "stock": int(product["stock"]), "popularity": float(product["popularity"])}
+
+
+def product_records(catalog, product_ids):
+    """
+    product_record() for each of `product_ids` (unknown ids skipped), with one
+    .loc over the catalog's DataFrame rather than a row lookup per product.
+    """
+    labels = [label for label in map(catalog.row_label, product_ids) if label is not None]
+    rows = catalog.df.loc[labels, PRODUCT_FIELDS]
+    columns = [rows[c].tolist() for c in PRODUCT_FIELDS]
+    return [{"id": int(pid), "name": str(name), "price": float(price), "stock": int(stock),
+             "popularity": float(popularity)} for pid, name, price, stock, popularity in zip(*columns)]
+
+
+class ShopService:
+    """
+    Every method is safe to call from several threads at once: reads use the
+    store's shared in-memory indexes, and changes go through the store's
+    methods, which take its lock and the storage lock.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or get_data_store()
+
+    # Customers
+
+    def login(self, customer_id):
+        """
+        Returns (customer, created): the customer, created first if new.
+        Customer ids must be alphanumeric.
+        """
+        customer_id = str(customer_id)
+        if not valid_customer_id(customer_id):
+            raise ServiceError("Customer ID must be alphanumeric.")
+        customer = self.store.get_customer(customer_id)
+        if customer is not None:
+            return customer, False
+        created = self.store.add_customer(customer_id)
+        return self.store.get_customer(customer_id), created
+
+    def customer_orders(self, customer_id):
+        """
+        {"orders": [{"order_id", "items", "total_cost", "placed_at"}], "spend": total spent}.
+        placed_at is None for orders placed before checkout recorded times.
+        """
+        orders = self.store.customer_orders(customer_id)
+        return {"orders": [{"order_id": int(o["order_id"]),
+                            "items": [[int(pid), int(qty)] for pid, qty in o["items"]],
+                            "total_cost": float(o["total_cost"]), "placed_at": o.get("placed_at")}
+                           for o in orders],
+                "spend": float(self.store.rollups.customer(customer_id)["spend"])}
+
+    # Products
+
+    def search(self, term="", limit=SEARCH_LIMIT):
+        """
+        Products matching `term`, best matches first (see ProductSearchIndex);
+        with an empty term, the catalog in id order. limit=None returns all matches.
+        """
+        store = self.store
+        term = (term or "").strip()
+        if term:
+            ids = store.search_index.search(term, limit=limit if limit is not None else len(store.catalog))
+        else:
+            ids = store.inventory_df["id"].tolist()
+            if limit is not None:
+                ids = ids[:limit]
+        return product_records(store.catalog, ids)
+
+    def product(self, product_id):
+        product = self.store.catalog.get(int(product_id))
+        if product is None:
+            raise ServiceError(f"No product {product_id}", 404)
+        return product_record(product)
+
+    # Carts and checkout
+
+    def cart(self, customer_id, order_num):
+        """
+        {"order_items": [...], "total": ...}, or None if the cart is empty.
+        """
+        cart = self.store.carts.get(customer_id, int(order_num))
+        if cart is None:
+            return None
+        return {"order_items": list(cart["order_items"]), "total": float(cart["total"])}
+
+    def add_to_cart(self, customer_id, order_num, product_id, qty):
+        """
+        Reserves the stock and adds the item; returns the cart. Raises
+        ServiceError for an unknown product or a bad quantity, and
+        checkout.InsufficientStock if the stock can't be held.
+        """
+        store = self.store
+        try:
+            product_id = int(product_id)
+            qty = int(qty)
+        except (TypeError, ValueError):
+            raise ServiceError("product_id and qty must be integers")
+        if qty < 1:
+            raise ServiceError("qty must be at least 1")
+        product = store.catalog.get(product_id)
+        if product is None:
+            raise ServiceError("Invalid product ID", 404)
+        order_num = int(order_num)
+
+        # Hold the stock for this cart until checkout (or until the reservation expires)
+        reserve(store.storage, cart_key(customer_id, order_num), product_id, qty)
+
+        # Carts are kept in memory and written behind (see cart_store.py)
+        store.carts.add_item(customer_id, order_num, {
+            "product_id": product_id,
+            "product_name": str(product["name"]),
+            "qty": qty,
+            "subtotal": float(product["price"]) * qty
+        })
+        return self.cart(customer_id, order_num)
+
+    def checkout(self, customer_id, order_num):
+        """
+        Places the order for the cart and returns the order record. Raises
+        ServiceError if the cart is empty, checkout.InsufficientStock if the
+        stock ran out.
+        """
+        order_record = self.store.checkout(customer_id, int(order_num))
+        if order_record is None:
+            raise ServiceError("No items in cart!", 409)
+        return order_record
+
+    def invoice(self, order_id):
+        """
+        The invoice DataFrame (see DataStore.invoice). Raises ServiceError for an unknown order.
+        """
+        invoice_df = self.store.invoice(int(order_id))
+        if invoice_df is None:
+            raise ServiceError(f"No order {order_id}", 404)
+        return invoice_df
+
+    # Recommendations and reports
+
+    def recommendations(self, product_ids=()):
+        """
+        [{"id", "name"}] for a cart holding `product_ids` (popular products for an empty one).
+        """
+        store = self.store
+        product_ids = [int(pid) for pid in product_ids]
+        recs = get_cached_recommendations(product_ids, store.orders, store.inventory_df,
+                                          store.version("inventory"), store.version("orders"),
+                                          copurchase_index=store.order_index if product_ids else None)
+        return [{"id": int(pid), "name": str(store.catalog.value(pid, "name"))}
+                for pid in recs if pid in store.catalog]
+
+    def sales_report(self, fmt="text", top_n=None):
+        if fmt not in ("text", "csv", "json"):
+            raise ServiceError("format must be text, csv or json")
+        return generate_sales_report(self.store.orders, None, top_n=top_n, fmt=fmt, rollups=self.store.rollups_snapshot())
+
+    def sales_over_time(self, granularity="day", start=None, end=None, product_id=None):
+        """
+        [{"period", "start", "revenue", "units", "orders"}], one per hour, day or
+        month from `start` to `end` (epoch seconds; default the first and last
+        timed order), read from the time rollups. For one product, without "orders".
+        """
+        if granularity not in GRANULARITIES:
+            raise ServiceError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        rollups = self.store.time_rollups
+        if not rollups.timed_orders and (start is None or end is None):
+            return []
+        start = rollups.first if start is None else float(start)
+        end = rollups.last if end is None else float(end)
+        if end < start:
+            raise ServiceError("end must not be before start")
+        if bucket_of(end, granularity) - bucket_of(start, granularity) >= MAX_SERIES_BUCKETS:
+            raise ServiceError(f"more than {MAX_SERIES_BUCKETS} buckets; use a coarser granularity")
+        series = rollups.series(granularity, start, end, None if product_id is None else int(product_id))
+        return series.to_dict("records")
+
+    def sales_period(self, start, end, top_n=10):
+        """
+        Revenue, units, orders and top products for the hours from `start` up to
+        `end` (epoch seconds), read from the time rollups (see TimeRollups.period).
+        """
+        report = self.store.time_rollups.period(float(start), float(end), top_n)
+        report["top_products"] = [{"product_id": int(pid), "revenue": float(revenue), "units": int(units)}
+                                  for pid, revenue, units in report["top_products"]]
+        return report
+
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_service():
+    """
+    The process-wide service: an api.ApiClient if ECOMMERCE_API_URL is set,
+    otherwise a ShopService over the process-wide DataStore.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            if API_URL:
+                # Imported here: api imports this module
+                from api import ApiClient
+                _service = ApiClient(API_URL)
+            else:
+                _service = ShopService()
+        return _service
@@ -0,0 +1,280 @@
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+from inventory_manager import DATA_DIR, INVENTORY_FILE
+import perf
+
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshot')
+FORMAT_VERSION = 1
+INVENTORY_COLUMNS = ["id", "name", "price", "stock", "popularity"]
+# ECOMMERCE_COLUMNAR_SNAPSHOT=0 turns the binary snapshot off (JSON only)
+COLUMNAR_SNAPSHOT = os.getenv("ECOMMERCE_COLUMNAR_SNAPSHOT", "1") != "0"
+
+
+def source_stamp(path):
+    # Identifies the exact JSON file a snapshot was taken from
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def _encode_strings(values):
+    # Variable-length strings as one UTF-8 blob plus offsets (len n + 1)
+    encoded = [str(v).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def _decode_strings(blob, offsets):
+    data = blob.tobytes()
+    bounds = offsets.tolist()
+    return [data[a:b].decode("utf-8") for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+class OrderColumns:
+    """
+    The order history as parallel arrays (memory-mapped when read from a snapshot):
+
+    order_id, customer (index into `customers`), total_cost   one entry per order
+    item_offsets                                              len orders + 1
+    product_id, qty                                           one entry per order line;
+                                                              order i's lines are
+                                                              item_offsets[i]:item_offsets[i + 1]
+    placed_at                                                 one entry per order (NaN if not
+                                                              recorded), or None if no order has one
+    """
+
+    def __init__(self, order_id, customer, customers, total_cost, item_offsets, product_id, qty, placed_at=None):
+        self.order_id = order_id
+        self.customer = customer
+        self.customers = customers
+        self.total_cost = total_cost
+        self.item_offsets = item_offsets
+        self.product_id = product_id
+        self.qty = qty
+        self.placed_at = placed_at
+
+    @classmethod
+    def from_records(cls, orders):
+        customers = {}
+        customer = [customers.setdefault(o["customer_id"], len(customers)) for o in orders]
+        sizes = [len(o["items"]) for o in orders]
+        item_offsets = np.zeros(len(orders) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=item_offsets[1:])
+        lines = [item for o in orders for item in o["items"]]
+        placed_at = [o.get("placed_at") for o in orders]
+        return cls(np.array([o["order_id"] for o in orders], dtype=np.int64),
+                   np.array(customer, dtype=np.int32),
+                   list(customers),
+                   np.array([o["total_cost"] for o in orders], dtype=np.float64),
+                   item_offsets,
+                   np.array([p for p, _ in lines], dtype=np.int64),
+                   np.array([q for _, q in lines], dtype=np.int64),
+                   np.array([np.nan if t is None else t for t in placed_at], dtype=np.float64)
+                   if any(t is not None for t in placed_at) else None)
+
+    def __len__(self):
+        return len(self.order_id)
+
+    @property
+    def n_lines(self):
+        return len(self.product_id)
+
+    def to_records(self):
+        """
+        The list-of-dicts form the rest of the app uses ({order_id, customer_id, items, total_cost},
+        plus placed_at where recorded).
+        """
+        customers = [self.customers[i] for i in self.customer.tolist()]
+        bounds = self.item_offsets.tolist()
+        lines = [[pid, qty] for pid, qty in zip(self.product_id.tolist(), self.qty.tolist())]
+        records = [{"order_id": oid, "customer_id": cust, "items": lines[a:b], "total_cost": total}
+                   for oid, cust, total, a, b in zip(self.order_id.tolist(), customers, self.total_cost.tolist(),
+                                                    bounds[:-1], bounds[1:])]
+        if self.placed_at is not None:
+            for record, placed_at in zip(records, self.placed_at.tolist()):
+                if placed_at == placed_at:
+                    record["placed_at"] = placed_at
+        return records
+
+
+class ColumnarSnapshot:
+    """
+    Binary copies of inventory.json and orders.json: one .npy file per column,
+    opened memory-mapped, so startup skips JSON parsing and untouched columns
+    never get paged in.
+
+    Each data set lives in its own numbered directory next to a small
+    `<name>.json` pointer (written last, with os.replace), so a crash mid-write
+    leaves the previous snapshot in place. The pointer also records the size,
+    mtime and inode of the JSON file the snapshot was taken from: if the JSON file has
+    changed since (or the snapshot is missing or unreadable) the read methods
+    return None and callers fall back to JSON.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = directory
+
+    def _write(self, name, arrays, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        old = self._read_pointer(name)
+        generation = (old["generation"] + 1) if old else 1
+        target = os.path.join(self.directory, f"{name}.{generation}")
+        shutil.rmtree(target, ignore_errors=True)
+        os.makedirs(target)
+        for column, values in arrays.items():
+            np.save(os.path.join(target, column + ".npy"), values)
+            perf.add_bytes(os.path.join(self.directory, f"{name}.*", column + ".npy"), values.nbytes)
+        self._write_pointer(name, dict(meta, format=FORMAT_VERSION, generation=generation, columns=sorted(arrays)))
+        if old:
+            shutil.rmtree(os.path.join(self.directory, f"{name}.{old['generation']}"), ignore_errors=True)
+
+    def _write_pointer(self, name, meta):
+        pointer_path = os.path.join(self.directory, name + ".json")
+        tmp_path = pointer_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, pointer_path)
+
+    def _read_pointer(self, name):
+        try:
+            with open(os.path.join(self.directory, name + ".json"), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("format") == FORMAT_VERSION else None
+
+    def _read(self, name, source_path, mmap_mode="r"):
+        meta = self._read_pointer(name)
+        if meta is None or meta.get("source") != source_stamp(source_path):
+            return None, None
+        target = os.path.join(self.directory, f"{name}.{meta['generation']}")
+        try:
+            arrays = {column: np.load(os.path.join(target, column + ".npy"), mmap_mode=mmap_mode)
+                      for column in meta["columns"]}
+        except (OSError, ValueError):
+            return None, None
+        return arrays, meta
+
+    def write_inventory(self, df, source_path=INVENTORY_FILE):
+        if list(df.columns) != INVENTORY_COLUMNS:
+            # Extra or missing fields: leave it to JSON (the old snapshot no longer matches the file)
+            return
+        names, name_offsets = _encode_strings(df["name"].tolist())
+        arrays = {
+            "id": df["id"].to_numpy(dtype=np.int64),
+            # price/popularity keep their dtype (int or float) so the DataFrame reads back the same
+            "price": df["price"].to_numpy(),
+            "stock": df["stock"].to_numpy(dtype=np.int64),
+            "popularity": df["popularity"].to_numpy(),
+            "name": names,
+            "name_offsets": name_offsets,
+        }
+        self._write("inventory", arrays, {"source": source_stamp(source_path)})
+
+    def read_inventory(self, source_path=INVENTORY_FILE):
+        """
+        The inventory DataFrame, or None if there is no snapshot of the current inventory.json.
+        The numeric columns stay on the memory-mapped files (copy-on-write: the
+        app can still edit them, and pages are copied only once it does);
+        names are decoded to Python strings.
+        """
+        arrays, _ = self._read("inventory", source_path, mmap_mode="c")
+        if arrays is None:
+            return None
+        return pd.DataFrame({
+            "id": arrays["id"],
+            "name": _decode_strings(arrays["name"], arrays["name_offsets"]),
+            "price": arrays["price"],
+            "stock": arrays["stock"],
+            "popularity": arrays["popularity"],
+        }, copy=False)
+
+    def write_stock(self, stock, previous_source, source_path=INVENTORY_FILE):
+        """
+        Brings the snapshot up to date after a stock-only change to inventory.json
+        ({product_id: stock}, as checkout writes it) by replacing just the stock
+        column. `previous_source` is the file's source_stamp() from before that
+        write; if the snapshot didn't match it, it is left stale for the next
+        full write.
+        """
+        meta = self._read_pointer("inventory")
+        if meta is None or meta.get("source") != previous_source:
+            return
+        target = os.path.join(self.directory, f"inventory.{meta['generation']}")
+        column_path = os.path.join(target, "stock.npy")
+        try:
+            ids = np.load(os.path.join(target, "id.npy"), mmap_mode="r")
+            column = np.load(column_path)
+            at = pd.Index(ids).get_indexer(list(stock))
+            known = at >= 0
+            column[at[known]] = np.fromiter(stock.values(), dtype=np.int64, count=len(stock))[known]
+            # A new file, not a write into the old one: other processes may have it mapped
+            with open(column_path + ".tmp", 'wb') as f:
+                np.save(f, column)
+            os.replace(column_path + ".tmp", column_path)
+        except (OSError, ValueError):
+            # The pointer still names the old JSON file, so readers fall back to JSON
+            return
+        perf.add_bytes(os.path.join(self.directory, "inventory.*", "stock.npy"), column.nbytes)
+        # Last, as in _write: until the pointer names the new inventory.json the snapshot reads as stale
+        self._write_pointer("inventory", dict(meta, source=source_stamp(source_path)))
+
+    def write_orders(self, orders, source_path):
+        # OrderColumns, an order.OrderBook (same array attributes) or a list of order dicts
+        columns = orders if hasattr(orders, "item_offsets") else OrderColumns.from_records(orders)
+        arrays = {
+            "order_id": columns.order_id,
+            "customer": columns.customer,
+            "total_cost": columns.total_cost,
+            "item_offsets": columns.item_offsets,
+            "product_id": columns.product_id,
+            "qty": columns.qty,
+        }
+        placed_at = getattr(columns, "placed_at", None)
+        if placed_at is not None and not np.isnan(placed_at).all():
+            # Left out while no order has a time; read_orders then gives None
+            arrays["placed_at"] = placed_at
+        self._write("orders", arrays, {"source": source_stamp(source_path), "customers": columns.customers,
+                                       "last_order_id": int(columns.order_id.max()) if len(columns) else 0})
+
+    def read_orders(self, source_path):
+        """
+        OrderColumns over memory-mapped arrays (no copy), or None if there is no
+        snapshot of the current `source_path` (the compacted orders.json).
+        """
+        arrays, meta = self._read("orders", source_path)
+        if arrays is None:
+            return None
+        return OrderColumns(arrays["order_id"], arrays["customer"], meta["customers"], arrays["total_cost"],
+                            arrays["item_offsets"], arrays["product_id"], arrays["qty"], arrays.get("placed_at"))
+
+
+def build_snapshot():
+    """
+    Writes the binary snapshot for the current data/*.json files (compacting the
+    order journal first). Returns (products, orders) written.
+    """
+    from storage import JsonStorage
+
+    storage = JsonStorage(snapshot=ColumnarSnapshot())
+    with storage.exclusive():
+        inventory_df = storage.load_inventory()
+        storage.snapshot.write_inventory(inventory_df, storage.inventory_file)
+        orders = storage.load_orders()
+        storage.order_journal.compact(orders)
+    return len(inventory_df), len(orders)
+
+
+if __name__ == "__main__":
+    # python src/snapshot.py  -> (re)build data/snapshot from the JSON files
+    if sys.argv[1:]:
+        sys.exit("usage: python src/snapshot.py")
+    n_products, n_orders = build_snapshot()
+    print(f"Wrote a columnar snapshot of {n_products} products and {n_orders} orders to {SNAPSHOT_DIR}")
@@ -0,0 +1,731 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no flock, so the lock only covers the threads of one process
+    fcntl = None
+
+import pandas as pd
+
+import perf
+from inventory_manager import DATA_DIR, INVENTORY_FILE, load_inventory, save_inventory
+from order import OrderBook
+from order_store import OrderJournal, ORDERS_FILE, ORDERS_JOURNAL_FILE, append_line
+from snapshot import COLUMNAR_SNAPSHOT, ColumnarSnapshot, source_stamp
+
+CUSTOMERS_FILE = os.path.join(DATA_DIR, 'customers.json')
+BILL_FILE = os.path.join(DATA_DIR, 'bill_for_all.json')
+RESERVATIONS_FILE = os.path.join(DATA_DIR, 'reservations.json')
+ORDER_SEQ_FILE = os.path.join(DATA_DIR, 'order_id.seq')
+ROLLUPS_FILE = os.path.join(DATA_DIR, 'rollups.json')
+LOCK_FILE = os.path.join(DATA_DIR, 'data.lock')
+# Fold the reservations journal back into reservations.json once it has this many lines
+RESERVATIONS_COMPACT_EVERY = 1000
+SQLITE_FILE = os.path.join(DATA_DIR, 'ecommerce.db')
+
+# Backend selection: ECOMMERCE_STORAGE=json (default) or sqlite, ECOMMERCE_DB=<path to .db>
+STORAGE_BACKEND = os.getenv("ECOMMERCE_STORAGE", "json")
+SQLITE_PATH = os.getenv("ECOMMERCE_DB", SQLITE_FILE)
+
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _write_json(path, data):
+    # Swap in a complete file so a reader in another process never sees a partial one
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+        perf.add_bytes(path, f.tell())
+    os.replace(tmp_path, path)
+
+def _merge_records(path, records, key, changed_ids):
+    # Rewrites only the `changed_ids` records of the list in `path` (adding, replacing or
+    # dropping them) so records another process saved in the meantime are kept.
+    # Returns the merged list.
+    changed = {r[key]: r for r in records if r[key] in changed_ids}
+    merged = []
+    for record in _read_json(path, []):
+        if record[key] in changed_ids:
+            if record[key] in changed:
+                merged.append(changed.pop(record[key]))
+        else:
+            merged.append(record)
+    merged.extend(changed.values())
+    _write_json(path, merged)
+    return merged
+
+
+class JsonStorage:
+    """
+    The original flat-file behavior: one JSON file per collection (orders go
+    through the append-only journal).
+
+    Several server processes can share the files: writes happen under an
+    exclusive lock on data.lock, and saves with a `changed_*` hint re-read the
+    file and replace only those records instead of writing this process's
+    (possibly stale) copy over everyone else's.
+
+    With a `snapshot` (snapshot.ColumnarSnapshot) inventory and compacted orders
+    are also kept as memory-mappable column files, which loads read instead of
+    the JSON whenever they match it.
+    """
+
+    def __init__(self, customers_file=CUSTOMERS_FILE, bill_file=BILL_FILE,
+                 orders_file=ORDERS_FILE, orders_journal_file=ORDERS_JOURNAL_FILE,
+                 inventory_file=INVENTORY_FILE, reservations_file=RESERVATIONS_FILE,
+                 order_seq_file=ORDER_SEQ_FILE, lock_file=LOCK_FILE, snapshot=None, rollups_file=ROLLUPS_FILE):
+        self.customers_file = customers_file
+        self.bill_file = bill_file
+        self.inventory_file = inventory_file
+        self.reservations_file = reservations_file
+        # Carts changed since reservations.json was written, one line per change, next to it
+        self.reservations_journal = os.path.splitext(reservations_file)[0] + ".journal"
+        self.order_seq_file = order_seq_file
+        self.lock_file = lock_file
+        self.snapshot = snapshot
+        self.rollups_file = rollups_file
+        self.order_journal = OrderJournal(orders_file, orders_journal_file, columnar=snapshot)
+        self.lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_fd = None
+        # (stamp of inventory.json, {product_id: stock}) as last read or written by this process
+        self._stock = None
+        # (stamp of reservations.json, journal bytes read, journal lines, ledger) as last read
+        self._reservations = None
+
+    @classmethod
+    def in_directory(cls, directory, snapshot=None):
+        """
+        A JsonStorage over the usual file names in `directory` instead of data/.
+        """
+        return cls(*(os.path.join(directory, os.path.basename(path))
+                     for path in (CUSTOMERS_FILE, BILL_FILE, ORDERS_FILE, ORDERS_JOURNAL_FILE, INVENTORY_FILE,
+                                  RESERVATIONS_FILE, ORDER_SEQ_FILE, LOCK_FILE)),
+                   snapshot=snapshot, rollups_file=os.path.join(directory, os.path.basename(ROLLUPS_FILE)))
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Holds the data lock: one thread of one process at a time. Re-entrant.
+        """
+        with self.lock:
+            if self._lock_depth == 0:
+                self._lock_fd = open(self.lock_file, 'a')
+                if fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    # Closing the file releases the flock
+                    self._lock_fd.close()
+                    self._lock_fd = None
+
+    @contextmanager
+    def transaction(self):
+        # Plain files have no rollback; the saves just run one after the other, under the lock
+        with self.exclusive():
+            yield
+
+    def change_stamp(self):
+        """
+        Moves on whenever the inventory or orders on disk change, whichever process wrote them.
+        """
+        return [source_stamp(path) for path in (self.inventory_file, self.order_journal.snapshot_path,
+                                                self.order_journal.journal_path)]
+
+    @perf.timed("storage.load_inventory")
+    def load_inventory(self):
+        with self.exclusive():
+            df = self.snapshot.read_inventory(self.inventory_file) if self.snapshot is not None else None
+            if df is None:
+                df = load_inventory(self.inventory_file)
+                self._snapshot_inventory(df)
+            return df
+
+    def _snapshot_inventory(self, df):
+        # Called right after inventory.json is written, still under the lock
+        if self.snapshot is not None:
+            self.snapshot.write_inventory(df, self.inventory_file)
+
+    @perf.timed("storage.save_inventory")
+    def save_inventory(self, df, changed_ids=None):
+        with self.exclusive():
+            if changed_ids is None:
+                save_inventory(df, self.inventory_file)
+                self._snapshot_inventory(df)
+            else:
+                changed_ids = set(int(pid) for pid in changed_ids)
+                rows = df[df["id"].isin(changed_ids)].to_dict(orient="records")
+                merged = _merge_records(self.inventory_file, rows, "id", changed_ids)
+                self._snapshot_inventory(pd.DataFrame(merged))
+            self._stock = None
+
+    @perf.timed("storage.read_stock")
+    def read_stock(self, product_ids):
+        """
+        Current stock of `product_ids` on disk, {id: stock}; ids not in the inventory are left out.
+        """
+        with self.exclusive():
+            stock = self._current_stock()
+            return {pid: stock[pid] for pid in set(product_ids) if pid in stock}
+
+    def _current_stock(self):
+        # The whole file is parsed again only if it changed since this process last
+        # read or wrote it (e.g. another server process checked out)
+        stamp = source_stamp(self.inventory_file)
+        if self._stock is None or self._stock[0] != stamp:
+            self._stock = (stamp, {p["id"]: int(p["stock"]) for p in _read_json(self.inventory_file, [])})
+        return self._stock[1]
+
+    @perf.timed("storage.update_stock")
+    def update_stock(self, stock):
+        with self.exclusive():
+            previous = source_stamp(self.inventory_file)
+            products = _read_json(self.inventory_file, [])
+            for p in products:
+                if p["id"] in stock:
+                    p["stock"] = int(stock[p["id"]])
+            _write_json(self.inventory_file, products)
+            if self.snapshot is not None:
+                # Only the stock column: checkouts would otherwise rewrite every column of it
+                self.snapshot.write_stock(stock, previous, self.inventory_file)
+            self._stock = (source_stamp(self.inventory_file), {p["id"]: int(p["stock"]) for p in products})
+
+    @perf.timed("storage.load_orders")
+    def load_orders(self):
+        # The journal may compact itself on load, which must not race another process's append
+        with self.exclusive():
+            return self.order_journal.load()
+
+    @perf.timed("storage.load_order_book")
+    def load_order_book(self):
+        with self.exclusive():
+            return self.order_journal.load(as_book=True)
+
+    @perf.timed("storage.save_order")
+    def save_order(self, order):
+        with self.exclusive():
+            self.order_journal.append(order)
+
+    @perf.timed("storage.set_order_times")
+    def set_order_times(self, times):
+        """
+        Sets placed_at of the orders in `times` ({order_id: epoch seconds}),
+        e.g. backfilled for orders placed before times were recorded. Rewrites
+        the orders snapshot (folding the journal in), so it's a one-off, not per order.
+        """
+        with self.exclusive():
+            orders = self.order_journal.load()
+            for order in orders:
+                if order["order_id"] in times:
+                    order["placed_at"] = float(times[order["order_id"]])
+            self.order_journal.compact(orders)
+
+    @perf.timed("storage.next_order_id")
+    def next_order_id(self):
+        """
+        Hands out order ids from a persistent counter, so ids stay unique and
+        increasing across processes and restarts.
+        """
+        with self.exclusive():
+            last = _read_json(self.order_seq_file, None)
+            if last is None:
+                last = max((o["order_id"] for o in self.order_journal.load()), default=0)
+            _write_json(self.order_seq_file, last + 1)
+            return last + 1
+
+    @perf.timed("storage.load_customers")
+    def load_customers(self):
+        with self.exclusive():
+            if not os.path.exists(self.customers_file):
+                _write_json(self.customers_file, [])
+            customers = _read_json(self.customers_file, [])
+            if any("purchase_history" in c for c in customers):
+                # Older files copy every order into purchase_history; the order index
+                # answers that now, so drop the copies once
+                for c in customers:
+                    c.pop("purchase_history", None)
+                _write_json(self.customers_file, customers)
+            return customers
+
+    @perf.timed("storage.save_customers")
+    def save_customers(self, customers_list, changed_ids=None):
+        with self.exclusive():
+            if changed_ids is None:
+                _write_json(self.customers_file, customers_list)
+            else:
+                _merge_records(self.customers_file, customers_list, "customer_id", set(changed_ids))
+
+    @perf.timed("storage.load_bill")
+    def load_bill(self):
+        with self.exclusive():
+            if not os.path.exists(self.bill_file):
+                _write_json(self.bill_file, {})
+            return _read_json(self.bill_file, {})
+
+    @perf.timed("storage.save_bill")
+    def save_bill(self, bill, changed_customers=None):
+        with self.exclusive():
+            if changed_customers is None:
+                _write_json(self.bill_file, bill)
+                return
+            merged = _read_json(self.bill_file, {})
+            for customer_id in changed_customers:
+                if bill.get(customer_id):
+                    merged[customer_id] = bill[customer_id]
+                else:
+                    merged.pop(customer_id, None)
+            _write_json(self.bill_file, merged)
+
+    @perf.timed("storage.load_reservations")
+    def load_reservations(self, now):
+        """
+        Active stock reservations, {cart: {"expires_at": t, "items": {product_id: qty}}}.
+        Reservations that expired before `now` are left out. The entries are this
+        process's cached ones: replace a cart's entry to change it, don't edit it.
+        """
+        with self.exclusive():
+            ledger = self._read_reservations()
+            return {cart: entry for cart, entry in ledger.items() if entry["expires_at"] > now}
+
+    def _read_reservations(self):
+        # reservations.json plus the journal lines after it. Only the lines appended since the
+        # last call are parsed, unless reservations.json was rewritten (by any process) since.
+        stamp = source_stamp(self.reservations_file)
+        if self._reservations is not None and self._reservations[0] == stamp:
+            _, offset, lines, ledger = self._reservations
+        else:
+            ledger = {cart: {"expires_at": entry["expires_at"],
+                             "items": {int(pid): qty for pid, qty in entry["items"].items()}}
+                      for cart, entry in _read_json(self.reservations_file, {}).items()}
+            offset, lines = 0, 0
+        if os.path.exists(self.reservations_journal):
+            with open(self.reservations_journal, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            # Up to the last complete line: a torn one is cut off by the next append
+            data = data[:data.rfind(b"\n") + 1]
+            for line in data.splitlines():
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    continue
+                lines += 1
+                if change["items"] is None:
+                    ledger.pop(change["cart"], None)
+                else:
+                    ledger[change["cart"]] = {"expires_at": change["expires_at"],
+                                              "items": {int(pid): qty for pid, qty in change["items"].items()}}
+            offset += len(data)
+        self._reservations = (stamp, offset, lines, ledger)
+        return ledger
+
+    @perf.timed("storage.save_reservations")
+    def save_reservations(self, ledger, changed_carts=None):
+        """
+        `ledger` is the whole ledger as loaded under this same lock. With
+        `changed_carts` only those carts are appended to the journal (not
+        fsynced: a lost reservation only means checkout re-checks the stock);
+        the full file is rewritten without it, or once the journal gets long.
+        """
+        with self.exclusive():
+            self._read_reservations()
+            lines = self._reservations[2]
+            if changed_carts is None or lines + len(changed_carts) > RESERVATIONS_COMPACT_EVERY:
+                _write_json(self.reservations_file, ledger)
+                with open(self.reservations_journal, 'w'):
+                    pass
+                self._reservations = None
+                return
+            for cart in changed_carts:
+                entry = ledger.get(cart)
+                change = {"cart": cart, "items": None} if entry is None else {
+                    "cart": cart, "expires_at": entry["expires_at"], "items": entry["items"]}
+                append_line(self.reservations_journal, json.dumps(change), fsync=False)
+
+    @perf.timed("storage.load_rollups")
+    def load_rollups(self):
+        # sales_rollups.SalesRollups.to_dict() as last saved, or None
+        with self.exclusive():
+            return _read_json(self.rollups_file, None)
+
+    @perf.timed("storage.save_rollups")
+    def save_rollups(self, rollups):
+        with self.exclusive():
+            _write_json(self.rollups_file, rollups)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id          INTEGER PRIMARY KEY,
+    name        TEXT NOT NULL,
+    price       REAL NOT NULL,
+    stock       INTEGER NOT NULL,
+    popularity  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS customers (
+    customer_id TEXT PRIMARY KEY,
+    name        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id    INTEGER PRIMARY KEY,
+    customer_id TEXT NOT NULL,
+    total_cost  REAL NOT NULL,
+    placed_at   REAL
+);
+CREATE INDEX IF NOT EXISTS idx_orders_customer ON orders(customer_id);
+CREATE TABLE IF NOT EXISTS order_items (
+    order_id    INTEGER NOT NULL,
+    position    INTEGER NOT NULL,
+    product_id  INTEGER NOT NULL,
+    qty         INTEGER NOT NULL,
+    PRIMARY KEY (order_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items(product_id);
+CREATE TABLE IF NOT EXISTS cart_items (
+    customer_id  TEXT NOT NULL,
+    order_num    TEXT NOT NULL,
+    position     INTEGER NOT NULL,
+    product_id   INTEGER NOT NULL,
+    product_name TEXT NOT NULL,
+    qty          INTEGER NOT NULL,
+    subtotal     REAL NOT NULL,
+    PRIMARY KEY (customer_id, order_num, position)
+);
+CREATE INDEX IF NOT EXISTS idx_cart_items_product ON cart_items(product_id);
+CREATE TABLE IF NOT EXISTS reservations (
+    cart        TEXT NOT NULL,
+    product_id  INTEGER NOT NULL,
+    qty         INTEGER NOT NULL,
+    expires_at  REAL NOT NULL,
+    PRIMARY KEY (cart, product_id)
+);
+CREATE TABLE IF NOT EXISTS sequences (
+    name        TEXT PRIMARY KEY,
+    value       INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    name        TEXT PRIMARY KEY,
+    data        TEXT NOT NULL
+);
+"""
+
+
+class SqliteStorage:
+    """
+    Embedded SQLite backend. Saves only touch the rows named by the `changed_*` hints,
+    and everything inside `with storage.transaction():` commits (or rolls back) together.
+
+    A customer's orders are looked up in the orders table (indexed by customer_id)
+    rather than stored with the customer.
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        # One connection shared by every Streamlit session thread; the lock keeps
+        # one session's transaction from interleaving with another's writes.
+        # Other processes are kept out by SQLite's own database lock (waited on up to 30 s).
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(orders)")]
+        if "placed_at" not in columns:
+            # Databases created before checkout recorded order times
+            self.conn.execute("ALTER TABLE orders ADD COLUMN placed_at REAL")
+            self.conn.commit()
+        self.lock = threading.RLock()
+        self._tx_depth = 0
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self._tx_depth += 1
+            try:
+                yield
+            except Exception:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self.conn.rollback()
+                raise
+            self._tx_depth -= 1
+            self._commit()
+
+    @contextmanager
+    def exclusive(self):
+        """
+        A transaction that takes the database write lock up front (BEGIN IMMEDIATE),
+        so whatever it reads cannot be changed by another process before it commits.
+        """
+        with self.lock:
+            if self._tx_depth == 0:
+                if self.conn.in_transaction:
+                    self.conn.commit()
+                self.conn.execute("BEGIN IMMEDIATE")
+            with self.transaction():
+                yield
+
+    def change_stamp(self):
+        """
+        Moves on whenever another connection (e.g. an API server process) commits;
+        this connection's own writes leave it as is.
+        """
+        with self.lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _commit(self):
+        # Nested saves inside a transaction() wait for the outermost block
+        if self._tx_depth == 0:
+            self.conn.commit()
+
+    @perf.timed("storage.load_inventory")
+    def load_inventory(self):
+        with self.lock:
+            return pd.read_sql_query(
+                "SELECT id, name, price, stock, popularity FROM products ORDER BY id", self.conn)
+
+    @perf.timed("storage.save_inventory")
+    def save_inventory(self, df, changed_ids=None):
+        with self.transaction():
+            self._save_inventory(df, changed_ids)
+
+    def _save_inventory(self, df, changed_ids):
+        if changed_ids is None:
+            self.conn.execute("DELETE FROM products")
+            rows = df
+        else:
+            changed_ids = [int(pid) for pid in changed_ids]
+            rows = df[df["id"].isin(changed_ids)]
+            # Anything named but no longer in the DataFrame was deleted
+            gone = set(changed_ids) - set(int(pid) for pid in rows["id"])
+            self.conn.executemany("DELETE FROM products WHERE id = ?", [(pid,) for pid in gone])
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO products (id, name, price, stock, popularity) VALUES (?, ?, ?, ?, ?)",
+            [(int(r["id"]), str(r["name"]), float(r["price"]), int(r["stock"]), float(r["popularity"]))
+             for r in rows.to_dict(orient="records")])
+
+    @perf.timed("storage.read_stock")
+    def read_stock(self, product_ids):
+        with self.lock:
+            ids = [int(pid) for pid in set(product_ids)]
+            rows = self.conn.execute(
+                f"SELECT id, stock FROM products WHERE id IN ({','.join('?' * len(ids))})", ids)
+            return {pid: stock for pid, stock in rows}
+
+    @perf.timed("storage.update_stock")
+    def update_stock(self, stock):
+        with self.transaction():
+            self.conn.executemany("UPDATE products SET stock = ? WHERE id = ?",
+                                  [(int(qty), int(pid)) for pid, qty in stock.items()])
+
+    @perf.timed("storage.load_orders")
+    def load_orders(self):
+        with self.lock:
+            return self._load_orders()
+
+    @perf.timed("storage.load_order_book")
+    def load_order_book(self):
+        return OrderBook(self.load_orders())
+
+    def _load_orders(self):
+        orders = {}
+        for order_id, customer_id, total_cost, placed_at in self.conn.execute(
+                "SELECT order_id, customer_id, total_cost, placed_at FROM orders ORDER BY order_id"):
+            orders[order_id] = {"order_id": order_id, "customer_id": customer_id,
+                                "items": [], "total_cost": total_cost}
+            if placed_at is not None:
+                orders[order_id]["placed_at"] = placed_at
+        for order_id, product_id, qty in self.conn.execute(
+                "SELECT order_id, product_id, qty FROM order_items ORDER BY order_id, position"):
+            orders[order_id]["items"].append([product_id, qty])
+        return list(orders.values())
+
+    @perf.timed("storage.save_order")
+    def save_order(self, order):
+        with self.transaction():
+            self._save_order(order)
+
+    def _save_order(self, order):
+        self.conn.execute(
+            "INSERT INTO orders (order_id, customer_id, total_cost, placed_at) VALUES (?, ?, ?, ?)",
+            (int(order["order_id"]), order["customer_id"], float(order["total_cost"]), order.get("placed_at")))
+        self.conn.executemany(
+            "INSERT INTO order_items (order_id, position, product_id, qty) VALUES (?, ?, ?, ?)",
+            [(int(order["order_id"]), pos, int(pid), int(qty)) for pos, (pid, qty) in enumerate(order["items"])])
+
+    @perf.timed("storage.set_order_times")
+    def set_order_times(self, times):
+        # {order_id: placed_at}, e.g. backfilled for orders placed before times were recorded
+        with self.transaction():
+            self.conn.executemany("UPDATE orders SET placed_at = ? WHERE order_id = ?",
+                                  [(float(t), int(oid)) for oid, t in times.items()])
+
+    @perf.timed("storage.next_order_id")
+    def next_order_id(self):
+        with self.exclusive():
+            # Seeded from the orders table the first time, then only ever incremented
+            self.conn.execute(
+                "INSERT OR IGNORE INTO sequences (name, value) "
+                "SELECT 'order_id', COALESCE(MAX(order_id), 0) FROM orders")
+            self.conn.execute("UPDATE sequences SET value = value + 1 WHERE name = 'order_id'")
+            return self.conn.execute("SELECT value FROM sequences WHERE name = 'order_id'").fetchone()[0]
+
+    @perf.timed("storage.load_customers")
+    def load_customers(self):
+        with self.lock:
+            return self._load_customers()
+
+    def _load_customers(self):
+        return [{"customer_id": customer_id, "name": name}
+                for customer_id, name in self.conn.execute("SELECT customer_id, name FROM customers ORDER BY rowid")]
+
+    @perf.timed("storage.save_customers")
+    def save_customers(self, customers_list, changed_ids=None):
+        rows = customers_list
+        if changed_ids is not None:
+            rows = [c for c in customers_list if c["customer_id"] in changed_ids]
+        with self.transaction():
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO customers (customer_id, name) VALUES (?, ?)",
+                [(c["customer_id"], c["name"]) for c in rows])
+
+    @perf.timed("storage.load_bill")
+    def load_bill(self):
+        with self.lock:
+            return self._load_bill()
+
+    def _load_bill(self):
+        bill = {}
+        for customer_id, order_num, product_id, product_name, qty, subtotal in self.conn.execute(
+                "SELECT customer_id, order_num, product_id, product_name, qty, subtotal "
+                "FROM cart_items ORDER BY customer_id, order_num, position"):
+            cart = bill.setdefault(customer_id, {}).setdefault(order_num, {"order_items": [], "total": 0.0})
+            cart["order_items"].append({"product_id": product_id, "product_name": product_name,
+                                        "qty": qty, "subtotal": subtotal})
+            cart["total"] += subtotal
+        return bill
+
+    @perf.timed("storage.save_bill")
+    def save_bill(self, bill, changed_customers=None):
+        with self.transaction():
+            self._save_bill(bill, changed_customers)
+
+    def _save_bill(self, bill, changed_customers):
+        if changed_customers is None:
+            self.conn.execute("DELETE FROM cart_items")
+            customers = list(bill)
+        else:
+            self.conn.executemany("DELETE FROM cart_items WHERE customer_id = ?",
+                                  [(customer_id,) for customer_id in changed_customers])
+            customers = [customer_id for customer_id in changed_customers if customer_id in bill]
+        rows = []
+        for customer_id in customers:
+            for order_num, cart in bill[customer_id].items():
+                for pos, item in enumerate(cart["order_items"]):
+                    rows.append((customer_id, str(order_num), pos, int(item["product_id"]),
+                                 item["product_name"], int(item["qty"]), float(item["subtotal"])))
+        self.conn.executemany(
+            "INSERT INTO cart_items (customer_id, order_num, position, product_id, product_name, qty, subtotal) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    @perf.timed("storage.load_reservations")
+    def load_reservations(self, now):
+        with self.transaction():
+            self.conn.execute("DELETE FROM reservations WHERE expires_at <= ?", (now,))
+            ledger = {}
+            for cart, product_id, qty, expires_at in self.conn.execute(
+                    "SELECT cart, product_id, qty, expires_at FROM reservations"):
+                entry = ledger.setdefault(cart, {"expires_at": expires_at, "items": {}})
+                entry["items"][product_id] = qty
+            return ledger
+
+    @perf.timed("storage.save_reservations")
+    def save_reservations(self, ledger, changed_carts=None):
+        carts = list(ledger) if changed_carts is None else changed_carts
+        with self.transaction():
+            if changed_carts is None:
+                self.conn.execute("DELETE FROM reservations")
+            else:
+                self.conn.executemany("DELETE FROM reservations WHERE cart = ?", [(c,) for c in carts])
+            self.conn.executemany(
+                "INSERT INTO reservations (cart, product_id, qty, expires_at) VALUES (?, ?, ?, ?)",
+                [(cart, int(pid), int(qty), float(ledger[cart]["expires_at"]))
+                 for cart in carts if cart in ledger for pid, qty in ledger[cart]["items"].items()])
+
+    @perf.timed("storage.load_rollups")
+    def load_rollups(self):
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM rollups WHERE name = 'sales'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    @perf.timed("storage.save_rollups")
+    def save_rollups(self, rollups):
+        with self.transaction():
+            self.conn.execute("INSERT OR REPLACE INTO rollups (name, data) VALUES ('sales', ?)",
+                              (json.dumps(rollups),))
+
+
+_storages = {}
+
+def get_storage(backend=STORAGE_BACKEND):
+    """
+    Returns the process-wide storage for `backend`, so Streamlit reruns and sessions
+    share one instance (and one SQLite connection).
+    """
+    if backend not in ("json", "sqlite"):
+        raise ValueError(f"Unknown storage backend: {backend!r} (expected 'json' or 'sqlite')")
+    if backend not in _storages:
+        if backend == "json":
+            _storages[backend] = JsonStorage(snapshot=ColumnarSnapshot() if COLUMNAR_SNAPSHOT else None)
+        else:
+            # First run against a fresh database: seed it from the JSON files
+            if not os.path.exists(SQLITE_PATH):
+                import_json_to_sqlite(SQLITE_PATH)
+            _storages[backend] = SqliteStorage()
+    return _storages[backend]
+
+
+def import_json_to_sqlite(sqlite_path=SQLITE_PATH, directory=None):
+    """
+    One-shot import of data/*.json (or the JSON files in `directory`) into a
+    SQLite database (existing rows are replaced). The order-id sequence carries
+    on from the imported orders. Returns the number of (products, orders, customers) imported.
+    """
+    source = JsonStorage.in_directory(directory) if directory else JsonStorage()
+    target = SqliteStorage(sqlite_path)
+    inventory_df = source.load_inventory()
+    orders = source.load_orders()
+    customers = source.load_customers()
+    bill = source.load_bill()
+    with target.transaction():
+        target.conn.execute("DELETE FROM orders")
+        target.conn.execute("DELETE FROM order_items")
+        target.conn.execute("DELETE FROM customers")
+        target.save_inventory(inventory_df)
+        for order in orders:
+            target.save_order(order)
+        target.save_customers(customers)
+        target.save_bill(bill)
+        # Never hand out an id the JSON side already used (its counter can be ahead of the last order)
+        last_id = max([o["order_id"] for o in orders] + [_read_json(source.order_seq_file, 0)])
+        target.conn.execute("INSERT OR REPLACE INTO sequences (name, value) VALUES ('order_id', ?)", (int(last_id),))
+    return len(inventory_df), len(orders), len(customers)
+
+
+if __name__ == "__main__":
+    # python src/storage.py import [DIR]  -> copy data/*.json (or DIR/*.json) into the SQLite database
+    if sys.argv[1:2] != ["import"] or len(sys.argv) > 3:
+        sys.exit("usage: python src/storage.py import [json directory]")
+    n_products, n_orders, n_customers = import_json_to_sqlite(directory=sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"Imported {n_products} products, {n_orders} orders and {n_customers} customers into {SQLITE_PATH}")
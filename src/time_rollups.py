@@ -0,0 +1,426 @@
+"""
+Sales per hour, day and month, kept current order by order, so time-series
+charts and period reports read a handful of buckets instead of scanning the
+order history.
+
+Buckets are UTC: hours and days are counted from 1970-01-01, months as
+(year - 1970) * 12 + month - 1. Orders placed before checkout recorded a time
+(no "placed_at") are counted as untimed and left out; give them times with
+
+    python src/time_rollups.py backfill --start 2024-01-01 [--end 2024-06-30]
+"""
+import argparse
+import calendar
+import datetime
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import perf
+from reports import top_products
+
+GRANULARITIES = ("hour", "day", "month")
+SECONDS = {"hour": 3600, "day": 86400}
+LABEL_FORMATS = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d", "month": "%Y-%m"}
+# Per-product buckets added since the last merge are held in a dict; merged into the sorted arrays past this many
+MERGE_EVERY = int(os.getenv("ECOMMERCE_TIME_ROLLUP_MERGE_EVERY", "4096"))
+
+
+def bucket_of(timestamp, granularity):
+    """
+    The bucket holding `timestamp` (epoch seconds).
+    """
+    if granularity in SECONDS:
+        return int(timestamp // SECONDS[granularity])
+    when = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=timestamp)
+    return (when.year - 1970) * 12 + when.month - 1
+
+def buckets_of(timestamps, granularity):
+    # bucket_of for an array of timestamps
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if granularity in SECONDS:
+        return np.floor(timestamps / SECONDS[granularity]).astype(np.int64)
+    seconds = np.floor(timestamps).astype(np.int64).astype("datetime64[s]")
+    return seconds.astype("datetime64[M]").astype(np.int64)
+
+def bucket_start(bucket, granularity):
+    """
+    Epoch seconds at which `bucket` begins.
+    """
+    if granularity in SECONDS:
+        return int(bucket) * SECONDS[granularity]
+    year, month = divmod(int(bucket), 12)
+    return calendar.timegm((1970 + year, month + 1, 1, 0, 0, 0))
+
+def bucket_label(bucket, granularity):
+    return time.strftime(LABEL_FORMATS[granularity], time.gmtime(bucket_start(bucket, granularity)))
+
+def parse_date(text):
+    # "YYYY-MM-DD" (UTC midnight) -> epoch seconds
+    return calendar.timegm(time.strptime(text, "%Y-%m-%d"))
+
+
+class _ProductBuckets:
+    """
+    (bucket, product) -> revenue and units for one granularity. The entries are
+    one array of keys `bucket << 32 | product_id`, sorted, plus the matching
+    revenue and units, so the entries of a bucket range are one contiguous slice
+    (two searchsorted calls). Entries added since the last merge sit in a dict.
+    """
+
+    def __init__(self, keys=None, revenue=None, units=None):
+        self.keys = np.zeros(0, dtype=np.int64) if keys is None else keys
+        self.revenue = np.zeros(0, dtype=np.float64) if revenue is None else revenue
+        self.units = np.zeros(0, dtype=np.int64) if units is None else units
+        self.tail = {}
+
+    @classmethod
+    def build(cls, buckets, product_ids, revenue, units):
+        # One entry per distinct (bucket, product) of the given lines: a sort and two segmented sums
+        keys = (buckets << 32) | product_ids
+        if not len(keys):
+            return cls()
+        order = np.argsort(keys)
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        return cls(keys[starts], np.add.reduceat(np.asarray(revenue, dtype=np.float64)[order], starts),
+                   np.add.reduceat(np.asarray(units, dtype=np.int64)[order], starts))
+
+    def regroup(self, coarser):
+        """
+        The same entries summed into coarser buckets; `coarser` maps an array
+        of buckets to theirs (e.g. hours to days).
+        """
+        self.merge()
+        return _ProductBuckets.build(coarser(self.keys >> 32), self.keys & 0xFFFFFFFF, self.revenue, self.units)
+
+    def __len__(self):
+        if not self.tail:
+            return len(self.keys)
+        keys = np.fromiter(self.tail, dtype=np.int64, count=len(self.tail))
+        at = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        merged = self.keys[at] == keys if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        return len(self.keys) + int((~merged).sum())
+
+    def add(self, bucket, product_id, revenue, units):
+        key = (bucket << 32) | product_id
+        entry = self.tail.get(key)
+        if entry is None:
+            self.tail[key] = [revenue, units]
+        else:
+            entry[0] += revenue
+            entry[1] += units
+        if len(self.tail) >= MERGE_EVERY:
+            self.merge()
+
+    def merge(self):
+        """
+        Folds the dict into the arrays: new keys are inserted at their place
+        (orders arrive in time order, so mostly at the end), no re-sort. The
+        arrays are replaced, never written to, so slices from range() stay valid.
+        """
+        if not self.tail:
+            return
+        keys = np.array(sorted(self.tail), dtype=np.int64)
+        revenue = np.array([self.tail[k][0] for k in keys.tolist()], dtype=np.float64)
+        units = np.array([self.tail[k][1] for k in keys.tolist()], dtype=np.int64)
+        at = np.searchsorted(self.keys, keys)
+        found = at < len(self.keys)
+        found[found] = self.keys[at[found]] == keys[found]
+        new = ~found
+        merged_revenue = np.insert(self.revenue, at[new], revenue[new])
+        merged_units = np.insert(self.units, at[new], units[new])
+        # Existing keys moved right by the number of new keys inserted before them
+        shifted = at[found] + np.cumsum(new)[found]
+        merged_revenue[shifted] += revenue[found]
+        merged_units[shifted] += units[found]
+        self.keys = np.insert(self.keys, at[new], keys[new])
+        self.revenue = merged_revenue
+        self.units = merged_units
+        self.tail = {}
+
+    def range(self, first, last):
+        """
+        (buckets, product ids, revenue, units) of the entries with first <= bucket <= last.
+        """
+        a, b = np.searchsorted(self.keys, [first << 32, (last + 1) << 32])
+        keys, revenue, units = self.keys[a:b], self.revenue[a:b], self.units[a:b]
+        if self.tail:
+            extra = [(k, v) for k, v in self.tail.items() if first <= k >> 32 <= last]
+            if extra:
+                keys = np.concatenate([keys, np.array([k for k, _ in extra], dtype=np.int64)])
+                revenue = np.concatenate([revenue, np.array([v[0] for _, v in extra], dtype=np.float64)])
+                units = np.concatenate([units, np.array([v[1] for _, v in extra], dtype=np.int64)])
+        return keys >> 32, keys & 0xFFFFFFFF, revenue, units
+
+
+class TimeRollups:
+    """
+    Revenue, units and orders per hour, day and month, in total and per product:
+
+    totals[granularity]      {bucket: [revenue, units, orders]}, revenue = sum of total_cost
+    products[granularity]    _ProductBuckets, revenue at the price paid at checkout
+
+    add_order() is O(items in the order). series() reads one bucket per point
+    and period() covers a date range with at most a few dozen month, day and
+    hour buckets, so neither depends on how many orders there are.
+    Product ids must fit in 32 bits. Thread-safe: checkout adds orders while
+    pages and the API read.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.totals = {g: {} for g in GRANULARITIES}
+        self.products = {g: _ProductBuckets() for g in GRANULARITIES}
+        self.timed_orders = 0
+        self.untimed_orders = 0
+        self.first = None
+        self.last = None
+
+    def add_order(self, order, products):
+        """
+        products: {product_id: {'price': ...}}, as for SalesRollups.add_order.
+        """
+        with self._lock:
+            self._add_order(order, products)
+
+    def _add_order(self, order, products):
+        placed_at = order.get("placed_at")
+        if placed_at is None:
+            self.untimed_orders += 1
+            return
+        lines = []
+        for pid, qty in order["items"]:
+            product = products.get(pid)
+            price = float(product["price"]) if product is not None else 0.0
+            lines.append((int(pid), int(qty), price * qty))
+        units = sum(qty for _, qty, _ in lines)
+        hour = bucket_of(placed_at, "hour")
+        buckets = {"hour": hour, "day": hour // 24, "month": bucket_of(placed_at, "month")}
+        for granularity in GRANULARITIES:
+            bucket = buckets[granularity]
+            entry = self.totals[granularity].get(bucket)
+            if entry is None:
+                entry = self.totals[granularity][bucket] = [0.0, 0, 0]
+            entry[0] += float(order["total_cost"])
+            entry[1] += units
+            entry[2] += 1
+            for pid, qty, revenue in lines:
+                self.products[granularity].add(bucket, pid, revenue, qty)
+        self.timed_orders += 1
+        self.first = placed_at if self.first is None else min(self.first, placed_at)
+        self.last = placed_at if self.last is None else max(self.last, placed_at)
+
+    @classmethod
+    @perf.timed("time_rollups.from_book")
+    def from_book(cls, book, inventory_df=None):
+        """
+        Full build over an order.OrderBook with a few array passes per
+        granularity. Like SalesRollups.from_book, product revenue uses the
+        current prices in `inventory_df` (0 without one).
+        """
+        rollups = cls()
+        placed_at = book.placed_at
+        timed = ~np.isnan(placed_at)
+        rollups.timed_orders = int(timed.sum())
+        rollups.untimed_orders = len(book) - rollups.timed_orders
+        if not rollups.timed_orders:
+            return rollups
+        rollups.first = float(placed_at[timed].min())
+        rollups.last = float(placed_at[timed].max())
+
+        line_orders = book.line_orders()
+        line_timed = timed[line_orders]
+        line_orders = line_orders[line_timed]
+        pids = book.product_id[line_timed]
+        qty = book.qty[line_timed].astype(np.int64)
+        if inventory_df is None:
+            prices = np.zeros(len(pids), dtype=np.float64)
+        else:
+            # A hash lookup per line; products no longer listed count at price 0
+            at = pd.Index(inventory_df["id"]).get_indexer(pids)
+            prices = np.where(at >= 0, inventory_df["price"].to_numpy(dtype=np.float64)[at], 0.0)
+        hours = np.zeros(len(book), dtype=np.int64)
+        hours[timed] = buckets_of(placed_at[timed], "hour")
+        order_units = np.bincount(line_orders, weights=qty, minlength=len(book))
+
+        # Hours from the orders and lines; each coarser level from the one below it, which has fewer entries
+        coarser = {"day": lambda b: b // 24, "month": lambda b: buckets_of(b * 86400, "month")}
+        buckets = hours[timed]
+        sums = [book.total_cost[timed], order_units[timed], np.ones(rollups.timed_orders)]
+        products = _ProductBuckets.build(hours[line_orders], pids, prices * qty, qty)
+        for granularity in GRANULARITIES:
+            if granularity in coarser:
+                buckets = coarser[granularity](buckets)
+                products = products.regroup(coarser[granularity])
+            buckets, sums = _sum_by(buckets, sums)
+            rollups.totals[granularity] = {b: [r, int(u), int(n)] for b, r, u, n in zip(
+                buckets.tolist(), *(s.tolist() for s in sums))}
+            rollups.products[granularity] = products
+        return rollups
+
+    # Reads
+
+    def series(self, granularity, start, end, product_id=None):
+        """
+        One row per `granularity` bucket from the one holding `start` to the one
+        holding `end` (epoch seconds), zero-filled: period (label), start (epoch
+        seconds), revenue, units and, over all products, orders.
+        """
+        with self._lock:
+            return self._series(granularity, start, end, product_id)
+
+    def _series(self, granularity, start, end, product_id):
+        first, last = bucket_of(start, granularity), bucket_of(end, granularity)
+        buckets = list(range(first, last + 1))
+        frame = {"period": [bucket_label(b, granularity) for b in buckets],
+                 "start": [bucket_start(b, granularity) for b in buckets]}
+        if product_id is None:
+            empty = (0.0, 0, 0)
+            rows = [self.totals[granularity].get(b, empty) for b in buckets]
+            frame["revenue"] = [r[0] for r in rows]
+            frame["units"] = [r[1] for r in rows]
+            frame["orders"] = [r[2] for r in rows]
+        else:
+            found, pids, revenue, units = self.products[granularity].range(first, last)
+            mine = pids == product_id
+            at = found[mine] - first
+            frame["revenue"] = np.bincount(at, weights=revenue[mine], minlength=len(buckets)).tolist()
+            frame["units"] = np.bincount(at, weights=units[mine], minlength=len(buckets)).astype(np.int64).tolist()
+        return pd.DataFrame(frame)
+
+    def period(self, start, end, top_n=10):
+        """
+        Totals for the whole hours from `start` up to (not including) `end`
+        (epoch seconds): {"start", "end", "revenue", "units", "orders",
+        "products" (distinct products sold), "top_products": [(product_id, revenue, units)]}.
+        """
+        with self._lock:
+            return self._period(start, end, top_n)
+
+    def _period(self, start, end, top_n):
+        revenue = 0.0
+        units = 0
+        orders = 0
+        parts = []
+        for granularity, first, last in cover(bucket_of(start, "hour"), bucket_of(end, "hour")):
+            table = self.totals[granularity]
+            for bucket in range(first, last + 1):
+                entry = table.get(bucket)
+                if entry is not None:
+                    revenue += entry[0]
+                    units += entry[1]
+                    orders += entry[2]
+            parts.append(self.products[granularity].range(first, last))
+        product_revenue = {}
+        product_units = {}
+        if parts:
+            pids = np.concatenate([p[1] for p in parts])
+            sold, inverse = np.unique(pids, return_inverse=True)
+            product_revenue = dict(zip(sold.tolist(), np.bincount(
+                inverse, weights=np.concatenate([p[2] for p in parts]), minlength=len(sold)).tolist()))
+            product_units = dict(zip(sold.tolist(), np.bincount(
+                inverse, weights=np.concatenate([p[3] for p in parts]), minlength=len(sold)).astype(np.int64).tolist()))
+        return {"start": start, "end": end, "revenue": revenue, "units": units, "orders": orders,
+                "products": len(product_units),
+                "top_products": [(pid, sales, product_units[pid])
+                                 for pid, sales in top_products(product_revenue, top_n)]}
+
+    def stats(self):
+        with self._lock:
+            return {"timed_orders": self.timed_orders, "untimed_orders": self.untimed_orders,
+                    "first": self.first, "last": self.last,
+                    "buckets": {g: len(self.totals[g]) for g in GRANULARITIES},
+                    "product_buckets": {g: len(self.products[g]) for g in GRANULARITIES}}
+
+
+def _sum_by(buckets, values):
+    # The distinct buckets, and each array of `values` summed per bucket
+    distinct, where = np.unique(buckets, return_inverse=True)
+    return distinct, [np.bincount(where, weights=v, minlength=len(distinct)) for v in values]
+
+
+def cover(first_hour, end_hour):
+    """
+    The fewest (granularity, first bucket, last bucket) ranges covering hours
+    first_hour .. end_hour - 1 exactly: whole months in the middle, whole days
+    around them, single hours at the ends.
+    """
+    if first_hour >= end_hour:
+        return []
+    first_day, end_day = -(-first_hour // 24), end_hour // 24
+    if first_day >= end_day:
+        return [("hour", first_hour, end_hour - 1)]
+    ranges = []
+    if first_hour < first_day * 24:
+        ranges.append(("hour", first_hour, first_day * 24 - 1))
+    first_month = bucket_of(first_day * 86400, "month")
+    if bucket_start(first_month, "month") < first_day * 86400:
+        first_month += 1
+    end_month = bucket_of(end_day * 86400, "month")
+    if first_month < end_month:
+        month_day, end_month_day = bucket_start(first_month, "month") // 86400, bucket_start(end_month, "month") // 86400
+        if first_day < month_day:
+            ranges.append(("day", first_day, month_day - 1))
+        ranges.append(("month", first_month, end_month - 1))
+        if end_month_day < end_day:
+            ranges.append(("day", end_month_day, end_day - 1))
+    else:
+        ranges.append(("day", first_day, end_day - 1))
+    if end_day * 24 < end_hour:
+        ranges.append(("hour", end_day * 24, end_hour - 1))
+    return ranges
+
+
+def backfill_times(book, start, end=None):
+    """
+    Times for the orders of `book` (an order.OrderBook) that have none: spread
+    evenly over [start, end) in order-id order, so they keep their sequence.
+    `end` defaults to the earliest recorded time (or now, if there is none).
+    Returns {order_id: placed_at}.
+    """
+    untimed = np.isnan(book.placed_at)
+    if not untimed.any():
+        return {}
+    if end is None:
+        timed = book.placed_at[~untimed]
+        end = float(timed.min()) if len(timed) else time.time()
+    if end <= start:
+        raise ValueError("the backfill period must end after it starts")
+    ids = np.sort(book.order_id[untimed])
+    times = start + (end - start) * np.arange(len(ids)) / len(ids)
+    return dict(zip(ids.tolist(), times.tolist()))
+
+
+def backfill_timestamps(storage, start, end=None):
+    """
+    Gives the stored orders without a time one (see backfill_times), under the
+    storage lock. Returns {order_id: placed_at} for the orders changed.
+    """
+    with storage.exclusive():
+        times = backfill_times(storage.load_order_book(), start, end)
+        if times:
+            storage.set_order_times(times)
+    return times
+
+
+if __name__ == "__main__":
+    # python src/time_rollups.py backfill --start 2024-01-01 [--end 2024-06-30]
+    #   -> time the orders placed before checkout recorded times (the running app picks them up on restart)
+    from storage import get_storage
+
+    parser = argparse.ArgumentParser(description="Give orders without a timestamp one.")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--start", required=True, help="YYYY-MM-DD (UTC)")
+    parser.add_argument("--end", help="YYYY-MM-DD (UTC); default: the earliest timed order, or now")
+    args = parser.parse_args()
+    try:
+        times = backfill_timestamps(get_storage(), parse_date(args.start),
+                                    parse_date(args.end) if args.end else None)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"Backfilled timestamps for {len(times)} orders")
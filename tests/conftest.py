@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules import each other by plain name from src/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from storage import JsonStorage, SqliteStorage
+
+
+def open_storage(backend, directory):
+    if backend == "json":
+        return JsonStorage.in_directory(str(directory))
+    return SqliteStorage(os.path.join(str(directory), "shop.db"))
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request):
+    return request.param
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from api import ApiClient, ApiServer
+from conftest import open_storage
+from data_store import DataStore
+from datagen import make_inventory
+from service import ServiceError, ShopService
+
+
+@pytest.fixture
+def client(tmp_path):
+    storage = open_storage("json", tmp_path)
+    storage.save_inventory(make_inventory(10, stock=50))
+    store = DataStore(storage)
+    listening = threading.Event()
+    ports = []
+
+    def ready(server):
+        ports.append(server.sockets[0].getsockname()[1])
+        listening.set()
+
+    api = ApiServer(ShopService(store), workers=2)
+    # A daemon thread: serve() only returns on a signal, and the test process exits with it
+    threading.Thread(target=asyncio.run, args=(api.serve("127.0.0.1", 0, ready=ready),), daemon=True).start()
+    assert listening.wait(10)
+    client = ApiClient(f"http://127.0.0.1:{ports[0]}")
+    yield client
+    client.close()
+    store.close()
+
+
+def test_customers_with_non_ascii_ids_can_shop(client):
+    customer, created = client.login("Jürgen7")
+    assert created and customer["customer_id"] == "Jürgen7"
+    assert [i["product_id"] for i in client.add_to_cart("Jürgen7", 1, 2, 1)["order_items"]] == [2]
+    assert client.cart("Jürgen7", 1)["total"] > 0
+    order = client.checkout("Jürgen7", 1)
+    assert [o["order_id"] for o in client.customer_orders("Jürgen7")["orders"]] == [order["order_id"]]
+    with pytest.raises(ServiceError) as error:
+        client.cart("not an id", 1)
+    assert error.value.status == 404
+
+
+def test_only_gets_are_sent_again_when_a_kept_alive_connection_drops():
+    received = []
+
+    class DropsSecondRequest(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def serve(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            received.append(self.command)
+            self.served = getattr(self, "served", 0) + 1
+            if self.served > 1:
+                # Carried out, then the connection drops before the answer
+                self.close_connection = True
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        do_GET = do_POST = serve
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DropsSecondRequest)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ApiClient(f"http://127.0.0.1:{server.server_address[1]}")
+    try:
+        assert client.request("GET", "/a") == {}
+        assert client.request("GET", "/b") == {}
+        assert received == ["GET", "GET", "GET"]
+        with pytest.raises(ConnectionError):
+            client.request("POST", "/carts/cust1/1/checkout")
+        assert received.count("POST") == 1
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
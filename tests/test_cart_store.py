@@ -0,0 +1,44 @@
+import time
+
+from cart_store import CartStore
+from checkout import cart_key
+from conftest import open_storage
+from data_store import DataStore
+from datagen import make_inventory
+from service import ShopService
+
+ITEM = {"product_id": 3, "product_name": "Lamp", "qty": 2, "subtotal": 20.0}
+
+
+def test_carts_read_back_after_a_restart(backend, tmp_path):
+    storage = open_storage(backend, tmp_path)
+    carts = CartStore(storage, flush_interval=60)
+    carts.add_item("cust1", 1, dict(ITEM))
+    carts.flush()
+
+    carts = CartStore(open_storage(backend, tmp_path), flush_interval=60)
+    assert carts.get("cust1", 1)["order_items"] == [ITEM]
+    assert carts.get("cust1", "1") is carts.get("cust1", 1)
+    carts.add_item("cust1", "1", dict(ITEM, product_id=4))
+    carts.flush()
+    assert [i["product_id"] for i in carts.get("cust1", 1)["order_items"]] == [3, 4]
+    # One cart on disk, not a second one under the string key
+    assert list(storage.load_bill()["cust1"]) == ["1"]
+
+
+def test_service_cart_matches_its_reservation_after_a_restart(backend, tmp_path):
+    open_storage(backend, tmp_path).save_inventory(make_inventory(10, stock=50))
+    store = DataStore(open_storage(backend, tmp_path))
+    ShopService(store).add_to_cart("cust1", 1, 2, 1)
+    store.close()
+
+    store = DataStore(open_storage(backend, tmp_path))
+    service = ShopService(store)
+    assert [i["product_id"] for i in service.cart("cust1", 1)["order_items"]] == [2]
+    service.add_to_cart("cust1", 1, 3, 1)
+    assert [i["product_id"] for i in service.cart("cust1", 1)["order_items"]] == [2, 3]
+    held = store.storage.load_reservations(time.time())[cart_key("cust1", 1)]["items"]
+    assert held == {2: 1, 3: 1}
+    order = service.checkout("cust1", 1)
+    assert sorted(pid for pid, _ in order["items"]) == [2, 3]
+    store.close()
@@ -0,0 +1,147 @@
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import storage as storage_module
+from checkout import InsufficientStock, cart_key, place_order, release, reserve
+from conftest import open_storage
+from data_store import DataStore
+from datagen import make_inventory
+from service import ShopService
+from time_rollups import GRANULARITIES, TimeRollups
+
+N_PRODUCTS = 20
+INITIAL_STOCK = 60
+
+
+def _checkout_worker(backend, directory, worker, n_orders, seed):
+    # One server process: reserve random carts and check them out until stock runs out
+    storage = open_storage(backend, directory)
+    products = {pid: {"price": 10.0} for pid in range(1, N_PRODUCTS + 1)}
+    rng = random.Random(seed)
+    placed = []
+    for n in range(n_orders):
+        cart = cart_key(f"w{worker}", n)
+        items = []
+        try:
+            for _ in range(rng.randint(1, 3)):
+                pid, qty = rng.randint(1, N_PRODUCTS), rng.randint(1, 3)
+                reserve(storage, cart, pid, qty)
+                items.append((pid, qty))
+            order, _ = place_order(storage, f"w{worker}", cart, items, products)
+            placed.append(order["order_id"])
+        except InsufficientStock:
+            release(storage, cart)
+    return placed
+
+
+def _sold(orders):
+    sold = {pid: 0 for pid in range(1, N_PRODUCTS + 1)}
+    for order in orders:
+        for pid, qty in order["items"]:
+            sold[pid] += qty
+    return sold
+
+
+@pytest.fixture
+def store(backend, tmp_path):
+    open_storage(backend, tmp_path).save_inventory(make_inventory(N_PRODUCTS, stock=INITIAL_STOCK))
+    store = DataStore(open_storage(backend, tmp_path))
+    yield store
+    store.close()
+
+
+def test_processes_never_oversell_or_reuse_order_ids(backend, tmp_path):
+    open_storage(backend, tmp_path).save_inventory(make_inventory(N_PRODUCTS, stock=INITIAL_STOCK))
+    with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_checkout_worker, backend, str(tmp_path), w, 150, w) for w in range(4)]
+        placed = sorted(oid for f in futures for oid in f.result())
+
+    storage = open_storage(backend, tmp_path)
+    orders = storage.load_orders()
+    stock = storage.read_stock(range(1, N_PRODUCTS + 1))
+    sold = _sold(orders)
+    assert min(stock.values()) >= 0
+    assert all(INITIAL_STOCK - stock[pid] == sold[pid] for pid in sold)
+    assert placed == [o["order_id"] for o in orders] == list(range(1, len(placed) + 1))
+
+
+def test_concurrent_checkouts_keep_stock_and_rollups(store):
+    service = ShopService(store)
+    errors = []
+    done = threading.Event()
+
+    def shopper(worker):
+        rng = random.Random(worker)
+        for n in range(1, 31):
+            try:
+                for _ in range(rng.randint(1, 3)):
+                    service.add_to_cart(f"w{worker}", n, rng.randint(1, N_PRODUCTS), rng.randint(1, 2))
+                service.checkout(f"w{worker}", n)
+            except InsufficientStock:
+                release(store.storage, cart_key(f"w{worker}", n))
+            except Exception as e:
+                errors.append(e)
+
+    def reader():
+        while not done.is_set():
+            try:
+                service.sales_report(fmt="csv", top_n=5)
+                service.sales_over_time("hour")
+                service.sales_period(0, time.time() + 3600)
+                service.recommendations([1, 2])
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(2)]
+    shoppers = [threading.Thread(target=shopper, args=(w,)) for w in range(4)]
+    for t in readers + shoppers:
+        t.start()
+    for t in shoppers:
+        t.join()
+    done.set()
+    for t in readers:
+        t.join()
+    assert errors == []
+
+    orders = store.storage.load_orders()
+    ids = [o["order_id"] for o in orders]
+    assert ids == list(range(1, len(ids) + 1))
+    assert len(store.orders) == len(ids)
+    sold = _sold(orders)
+    stock = store.storage.read_stock(range(1, N_PRODUCTS + 1))
+    assert all(INITIAL_STOCK - stock[pid] == sold[pid] for pid in sold)
+    assert dict(zip(store.inventory_df["id"].tolist(), store.inventory_df["stock"].tolist())) == stock
+
+    assert store.rollups.verify(store.orders) == []
+    expected = TimeRollups.from_book(store.orders, store.inventory_df)
+    for granularity in GRANULARITIES:
+        assert store.time_rollups.totals[granularity].keys() == expected.totals[granularity].keys()
+
+
+def test_reservations_match_across_processes_and_compactions(backend, tmp_path, monkeypatch):
+    # Two storages on one directory stand in for two server processes
+    monkeypatch.setattr(storage_module, "RESERVATIONS_COMPACT_EVERY", 5)
+    open_storage(backend, tmp_path).save_inventory(make_inventory(N_PRODUCTS, stock=INITIAL_STOCK))
+    storages = [open_storage(backend, tmp_path), open_storage(backend, tmp_path)]
+    rng = random.Random(3)
+    expected = {}
+    for n in range(60):
+        storage = storages[n % 2]
+        cart = cart_key(f"c{rng.randint(1, 6)}", 1)
+        if rng.random() < 0.2:
+            release(storage, cart, now=1000.0)
+            expected.pop(cart, None)
+        else:
+            pid = rng.randint(1, 3)
+            reserve(storage, cart, pid, 1, ttl=60, now=1000.0 + n)
+            items = expected.setdefault(cart, {})
+            items[pid] = items.get(pid, 0) + 1
+        for other in storages + [open_storage(backend, tmp_path)]:
+            assert {c: e["items"] for c, e in other.load_reservations(1000.0).items()} == expected
+    # Every reservation lapses 60 s after its cart's last add
+    assert open_storage(backend, tmp_path).load_reservations(1000.0 + 59 + 60) == {}
@@ -0,0 +1,65 @@
+import pytest
+
+from checkout import cart_key, place_order, reserve
+from conftest import open_storage
+from data_store import DataStore
+from datagen import make_inventory
+from recommender import get_similarity_engine
+from service import ShopService
+
+N_PRODUCTS = 20
+INITIAL_STOCK = 60
+
+
+@pytest.fixture
+def store(backend, tmp_path):
+    open_storage(backend, tmp_path).save_inventory(make_inventory(N_PRODUCTS, stock=INITIAL_STOCK))
+    store = DataStore(open_storage(backend, tmp_path))
+    yield store
+    store.close()
+
+
+def test_checkout_keeps_the_similarity_engine(store):
+    service = ShopService(store)
+    engine = get_similarity_engine(store.inventory_df, store.version("inventory"))
+    inventory_version, stock_version = store.version("inventory"), store.version("stock")
+    service.add_to_cart("cust1", 1, 3, 2)
+    service.checkout("cust1", 1)
+    assert store.version("inventory") == inventory_version
+    assert store.version("stock") > stock_version
+    assert get_similarity_engine(store.inventory_df, store.version("inventory")) is engine
+    assert store.catalog.value(3, "stock") == INITIAL_STOCK - 2
+
+
+def test_admin_edit_keeps_stock_checked_out_elsewhere(store, backend, tmp_path):
+    # Another server process sells 5 of product 1 after this store was loaded
+    other = open_storage(backend, tmp_path)
+    reserve(other, cart_key("elsewhere", 1), 1, 5)
+    place_order(other, "elsewhere", cart_key("elsewhere", 1), [(1, 5)], {1: {"price": 10.0}}, now=1.7e9)
+
+    edited = store.inventory_df.copy()
+    edited.loc[edited["id"] == 1, "name"] = "Renamed"
+    store.update_inventory(edited, changed_ids=[1])
+    assert store.storage.read_stock([1]) == {1: INITIAL_STOCK - 5}
+    assert store.catalog.value(1, "stock") == INITIAL_STOCK - 5
+
+    edited = store.inventory_df.copy()
+    edited.loc[edited["id"] == 1, "stock"] = 7
+    store.update_inventory(edited, changed_ids=[1], stock_ids=[1])
+    assert store.storage.read_stock([1]) == {1: 7}
+
+
+def test_refresh_picks_up_orders_from_another_process(store, backend, tmp_path):
+    # Loading an empty JSON directory writes orders.json, which costs one reload
+    store.refresh()
+    assert not store.refresh()
+    other = open_storage(backend, tmp_path)
+    reserve(other, cart_key("elsewhere", 1), 2, 3)
+    place_order(other, "elsewhere", cart_key("elsewhere", 1), [(2, 3)], {2: {"price": 10.0}}, now=1.7e9)
+
+    assert store.refresh()
+    assert len(store.orders) == 1
+    assert store.catalog.value(2, "stock") == INITIAL_STOCK - 3
+    assert store.rollups.n_orders == 1
+    assert store.time_rollups.timed_orders == 1
+    assert not store.refresh()
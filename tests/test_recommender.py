@@ -0,0 +1,80 @@
+import math
+import random
+from collections import defaultdict
+
+import pytest
+
+from datagen import make_inventory, make_orders
+from recommender import CoPurchaseIndex, _scan_co_purchases, get_recommendations, recommend_batch
+
+N_PRODUCTS = 300
+
+
+def reference_recommendations(cart_items, orders, inventory_df):
+    # The original per-pair loop get_recommendations replaced
+    if not cart_items:
+        return inventory_df.sort_values(by="popularity", ascending=False).head(3)["id"].tolist()
+    product_dict = inventory_df.set_index("id").to_dict("index")
+    co_purchase_counts = defaultdict(int)
+    for order in orders:
+        pids_in_order = [p[0] for p in order["items"]]
+        if any(pid in pids_in_order for pid in cart_items):
+            for pid, _ in order["items"]:
+                if pid not in cart_items:
+                    co_purchase_counts[pid] += 1
+    final_scores = {}
+    for pid, p2 in product_dict.items():
+        if pid in cart_items:
+            continue
+        similarity = 0.0
+        for cart_pid in cart_items:
+            p1 = product_dict[cart_pid]
+            similarity += 1.0 / (1.0 + math.sqrt((p1["price"] - p2["price"]) ** 2
+                                                 + (p1["popularity"] - p2["popularity"]) ** 2))
+        final_scores[pid] = co_purchase_counts[pid] + similarity
+    return [pid for pid, _ in sorted(final_scores.items(), key=lambda x: x[1], reverse=True)[:3]]
+
+
+@pytest.fixture(scope="module")
+def inventory():
+    return make_inventory(N_PRODUCTS)
+
+
+@pytest.fixture(scope="module")
+def orders():
+    return make_orders(2_000, N_PRODUCTS)
+
+
+@pytest.fixture(scope="module")
+def carts():
+    rng = random.Random(7)
+    carts = [[rng.randint(1, N_PRODUCTS) for _ in range(rng.randint(1, 4))] for _ in range(40)]
+    return carts + [[], [5, 5], [1]]
+
+
+def test_co_purchase_index_matches_a_scan(orders, carts):
+    index = CoPurchaseIndex(orders)
+    for cart in carts:
+        assert dict(index.co_purchase_counts(cart)) == dict(_scan_co_purchases(cart, orders))
+
+
+def test_rankings_match_the_original_loop(inventory, orders, carts):
+    index = CoPurchaseIndex(orders)
+    for cart in carts:
+        expected = reference_recommendations(cart, orders, inventory)
+        assert get_recommendations(cart, orders, inventory) == expected
+        # Through the cached engine too (-1: a version data_versions never hands out)
+        assert get_recommendations(cart, orders, inventory, copurchase_index=index, inventory_version=-1) == expected
+
+
+def test_approximate_scoring_with_every_candidate_is_exact(inventory, orders, carts):
+    index = CoPurchaseIndex(orders)
+    for cart in carts:
+        assert (get_recommendations(cart, orders, inventory, copurchase_index=index, approx_candidates=N_PRODUCTS)
+                == reference_recommendations(cart, orders, inventory))
+
+
+def test_batch_matches_one_cart_at_a_time(inventory, orders, carts):
+    index = CoPurchaseIndex(orders)
+    expected = [get_recommendations(cart, orders, inventory, copurchase_index=index) for cart in carts]
+    assert recommend_batch(carts, orders, inventory, copurchase_index=index) == expected
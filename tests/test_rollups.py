@@ -0,0 +1,266 @@
+import math
+import random
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+import time_rollups
+from conftest import open_storage
+from data_store import DataStore
+from datagen import make_inventory, make_orders
+from order import OrderBook
+from reports import generate_sales_report
+from sales_rollups import SalesRollups
+from time_rollups import GRANULARITIES, TimeRollups, bucket_of
+
+N_PRODUCTS = 500
+START = 1_704_067_200  # 2024-01-01 UTC
+
+
+@pytest.fixture
+def inventory():
+    return make_inventory(N_PRODUCTS)
+
+
+@pytest.fixture
+def prices(inventory):
+    return {pid: {"price": price} for pid, price in zip(inventory["id"].tolist(), inventory["price"].tolist())}
+
+
+@pytest.fixture
+def orders(prices):
+    orders = make_orders(3_000, N_PRODUCTS, start=START)
+    for order in orders[::7]:
+        del order["placed_at"]
+    # Totals at the listed prices, so full recomputes can match product revenue too
+    for order in orders:
+        order["total_cost"] = sum(prices[pid]["price"] * qty for pid, qty in order["items"])
+    return orders
+
+
+def brute_force_buckets(orders, prices, granularity):
+    # {bucket: [revenue, units, orders]} and {(bucket, product_id): [revenue, units]}, one order at a time
+    totals, products = {}, {}
+    for order in orders:
+        if order.get("placed_at") is None:
+            continue
+        bucket = bucket_of(order["placed_at"], granularity)
+        entry = totals.setdefault(bucket, [0.0, 0, 0])
+        entry[0] += order["total_cost"]
+        entry[1] += sum(qty for _, qty in order["items"])
+        entry[2] += 1
+        for pid, qty in order["items"]:
+            line = products.setdefault((bucket, pid), [0.0, 0])
+            line[0] += prices[pid]["price"] * qty
+            line[1] += qty
+    return totals, products
+
+
+def assert_close(got, expected):
+    assert got.keys() == expected.keys()
+    for key in expected:
+        assert np.allclose(got[key], expected[key]), key
+
+
+def product_buckets(rollups, granularity):
+    # range() lists a key twice while part of it still waits in the unmerged dict
+    buckets, pids, revenue, units = rollups.products[granularity].range(0, 2 ** 31 - 1)
+    entries = {}
+    for key in zip(buckets.tolist(), pids.tolist(), revenue.tolist(), units.tolist()):
+        entry = entries.setdefault(key[:2], [0.0, 0])
+        entry[0] += key[2]
+        entry[1] += key[3]
+    return entries
+
+
+def test_sales_rollups_match_a_full_recompute(orders, prices, inventory):
+    rollups = SalesRollups()
+    for order in orders:
+        rollups.add_order(order, prices)
+    book = OrderBook(orders)
+    expected = SalesRollups.from_book(book, inventory)
+    assert rollups.verify(book) == []
+    assert rollups.n_orders == expected.n_orders == len(orders)
+    assert math.isclose(rollups.total_revenue, expected.total_revenue)
+    assert_close(rollups.product_revenue, expected.product_revenue)
+    assert rollups.product_units == expected.product_units
+
+    saved = SalesRollups.from_dict(rollups.to_dict())
+    more = make_orders(3_100, N_PRODUCTS)[3_000:]
+    book.extend(more)
+    assert saved.catch_up(book, prices) == len(more)
+    assert saved.verify(book) == []
+
+
+def test_reports_while_checkout_sells_new_products(tmp_path):
+    # Checkout adds to store.rollups under store.lock; every order here sells a product the rollups
+    # haven't seen, so their dicts grow while a report goes over them
+    storage = open_storage("json", tmp_path)
+    storage.save_inventory(make_inventory(10))
+    store = DataStore(storage)
+    prices = {}
+
+    def sell(n):
+        prices[n] = {"price": 1.0}
+        with store.lock:
+            store.rollups.add_order({"order_id": n, "customer_id": f"c{n}", "items": [[n, 1]],
+                                     "total_cost": 1.0}, prices)
+
+    for n in range(1, 50_001):
+        sell(n)
+    done = threading.Event()
+
+    def writer():
+        n = 50_000
+        while not done.is_set():
+            n += 1
+            sell(n)
+
+    # Switch threads often so the writer lands in the middle of reports
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    errors = []
+    try:
+        for _ in range(50):
+            try:
+                generate_sales_report(None, None, top_n=5, fmt="csv", rollups=store.rollups_snapshot())
+            except RuntimeError as e:
+                errors.append(e)
+    finally:
+        done.set()
+        thread.join()
+        sys.setswitchinterval(interval)
+        store.close()
+    assert errors == []
+
+
+@pytest.mark.parametrize("merge_every", [1, 7, 4096])
+def test_time_rollups_match_a_full_recompute(orders, prices, inventory, monkeypatch, merge_every):
+    monkeypatch.setattr(time_rollups, "MERGE_EVERY", merge_every)
+    live = TimeRollups()
+    for order in orders:
+        live.add_order(order, prices)
+    built = TimeRollups.from_book(OrderBook(orders), inventory)
+    for rollups in (live, built):
+        assert rollups.untimed_orders == len(orders[::7])
+        assert rollups.timed_orders == len(orders) - rollups.untimed_orders
+        for granularity in GRANULARITIES:
+            totals, products = brute_force_buckets(orders, prices, granularity)
+            assert_close(rollups.totals[granularity], totals)
+            assert_close(product_buckets(rollups, granularity), products)
+
+
+def test_time_rollup_reads_match_brute_force(orders, prices):
+    rollups = TimeRollups()
+    for order in orders:
+        rollups.add_order(order, prices)
+    rng = random.Random(5)
+    timed = [o for o in orders if o.get("placed_at") is not None]
+    for _ in range(20):
+        start = START + rng.uniform(0, 3000 * 3600)
+        end = start + rng.uniform(0, 40 * 86400)
+        first, last = math.floor(start / 3600) * 3600, math.floor(end / 3600) * 3600
+        inside = [o for o in timed if first <= o["placed_at"] < last]
+        report = rollups.period(start, end, top_n=None)
+        assert report["orders"] == len(inside)
+        assert math.isclose(report["revenue"], sum(o["total_cost"] for o in inside), abs_tol=1e-6)
+        assert report["units"] == sum(q for o in inside for _, q in o["items"])
+        sold = {}
+        for order in inside:
+            for pid, qty in order["items"]:
+                sold[pid] = sold.get(pid, 0.0) + prices[pid]["price"] * qty
+        assert_close({pid: revenue for pid, revenue, _ in report["top_products"]}, sold)
+
+        first_day, last_day = bucket_of(start, "day"), bucket_of(end, "day")
+        pid = inside[0]["items"][0][0] if inside else 1
+        orders_per_day = [0] * (last_day - first_day + 1)
+        units_per_day = [0] * (last_day - first_day + 1)
+        for order in timed:
+            day = bucket_of(order["placed_at"], "day")
+            if first_day <= day <= last_day:
+                orders_per_day[day - first_day] += 1
+                units_per_day[day - first_day] += sum(q for p, q in order["items"] if p == pid)
+        assert rollups.series("day", start, end)["orders"].tolist() == orders_per_day
+        assert rollups.series("day", start, end, product_id=pid)["units"].tolist() == units_per_day
+
+
+def test_time_rollup_reads_while_orders_are_added(monkeypatch):
+    # Small merges so readers keep meeting the per-product arrays mid-merge
+    monkeypatch.setattr(time_rollups, "MERGE_EVERY", 7)
+    prices = {pid: {"price": float(pid)} for pid in range(1, 40)}
+    orders = make_orders(2_000, 39, start=START)
+    end = START + 2_001 * 3600
+    rollups = TimeRollups()
+    errors = []
+    done = threading.Event()
+
+    def reader():
+        while not done.is_set():
+            try:
+                report = rollups.period(START, end, top_n=None)
+                if sum(revenue for _, revenue, _ in report["top_products"]) > report["revenue"] + 1e-6:
+                    errors.append("a product bucket was counted twice")
+                rollups.series("hour", START, end, product_id=3)
+                rollups.stats()
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(2)]
+    for t in readers:
+        t.start()
+    for order in orders:
+        order["total_cost"] = sum(prices[pid]["price"] * qty for pid, qty in order["items"])
+        rollups.add_order(order, prices)
+    done.set()
+    for t in readers:
+        t.join()
+    assert errors == []
+    for granularity in GRANULARITIES:
+        totals, products = brute_force_buckets(orders, prices, granularity)
+        assert_close(rollups.totals[granularity], totals)
+        assert_close(product_buckets(rollups, granularity), products)
+
+
+def test_store_reads_while_orders_are_added(tmp_path, inventory, orders, prices):
+    storage = open_storage("json", tmp_path)
+    storage.save_inventory(inventory)
+    store = DataStore(storage)
+    store.time_rollups  # built empty; add_order keeps it current from here
+    errors = []
+    done = threading.Event()
+
+    def reader():
+        while not done.is_set():
+            try:
+                generate_sales_report(None, None, top_n=5, fmt="csv", rollups=store.rollups_snapshot())
+                store.time_rollups.period(START, START + 4000 * 3600, top_n=5)
+                store.order_lines.table(store.inventory_df, store.version("inventory"))
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(2)]
+    for t in readers:
+        t.start()
+    try:
+        for order in orders:
+            # A product the rollups haven't seen in every order, so their dicts keep growing under the reports
+            order["items"].append([N_PRODUCTS + order["order_id"], 1])
+            store.add_order(order, prices)
+    finally:
+        done.set()
+        for t in readers:
+            t.join()
+        store.close()
+    assert errors == []
+
+    assert store.rollups.verify(store.orders) == []
+    expected = TimeRollups.from_book(store.orders, inventory)
+    for granularity in GRANULARITIES:
+        assert_close(store.time_rollups.totals[granularity], expected.totals[granularity])
+        assert_close(product_buckets(store.time_rollups, granularity), product_buckets(expected, granularity))
+    assert len(store.order_lines.table(store.inventory_df, store.version("inventory"))) == sum(
+        len(o["items"]) for o in orders)
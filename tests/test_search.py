@@ -0,0 +1,82 @@
+import random
+
+import pandas as pd
+import pytest
+
+from registry import CatalogIndex
+from search_index import ProductSearchIndex
+
+WORDS = ["wireless", "smart", "watch", "mouse", "keyboard", "usb", "hub", "cable", "able", "pro", "mini", "max",
+         "charger", "speaker", "Wi-Fi", "ÉCRAN", "straße"]
+QUERIES = ["w", "wi", "wire", "smart w", "able", "ab", "key", "KEYBOARD", "b", "pro", "ax", "usb hub", "écran",
+           "STRASSE", "straße", "hub 1", "zzz", " mouse "]
+
+
+def make_names(n, seed):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 4))) + f" {i}" for i in range(n)]
+
+
+def brute_force(names, query, limit):
+    """
+    The ranking ProductSearchIndex promises, by a scan over {id: name}: exact name,
+    then name prefix (alphabetical), then a later word's prefix (by that word),
+    then substring (3+ characters, alphabetical).
+    """
+    q = query.casefold().strip()
+    if not q:
+        return []
+    names = {pid: name.casefold() for pid, name in names.items()}
+    by_name = sorted((norm != q, norm, pid) for pid, norm in names.items() if norm.startswith(q))
+    found = {pid for _, _, pid in by_name}
+    by_word = sorted((min(w for w in norm.split()[1:] if w.startswith(q)), pid) for pid, norm in names.items()
+                     if pid not in found and any(w.startswith(q) for w in norm.split()[1:]))
+    found.update(pid for _, pid in by_word)
+    by_substring = sorted((norm, pid) for pid, norm in names.items()
+                          if len(q) >= 3 and pid not in found and q in norm)
+    ranked = [pid for _, _, pid in by_name] + [pid for _, pid in by_word] + [pid for _, pid in by_substring]
+    return ranked[:limit]
+
+
+@pytest.fixture
+def inventory():
+    names = make_names(2_000, seed=1)
+    return pd.DataFrame({"id": range(1, len(names) + 1), "name": names})
+
+
+@pytest.mark.parametrize("limit", [1, 5, 50, 10_000])
+def test_results_match_a_scan(inventory, limit):
+    index = ProductSearchIndex(inventory)
+    names = dict(zip(inventory["id"], inventory["name"]))
+    for query in QUERIES:
+        assert index.search(query, limit=limit) == brute_force(names, query, limit), query
+
+
+def test_incremental_updates_match_a_rebuild(inventory):
+    catalog = CatalogIndex(inventory)
+    index = ProductSearchIndex(inventory)
+    rng = random.Random(2)
+    df = inventory
+    for step, name in enumerate(make_names(200, seed=3)):
+        pid = rng.randint(1, len(inventory) + 50)
+        if step % 4 == 0:
+            df = df[df["id"] != pid]
+        elif pid in set(df["id"]):
+            df = df.copy()
+            df.loc[df["id"] == pid, "name"] = name
+        else:
+            df = pd.concat([df, pd.DataFrame([{"id": pid, "name": name}])], ignore_index=True)
+        catalog.sync(df)
+        index.sync(df, [pid], catalog)
+
+    rebuilt = ProductSearchIndex(df)
+    names = dict(zip(df["id"], df["name"]))
+    assert len(index) == len(rebuilt) == len(df)
+    for query in QUERIES:
+        assert index.search(query, limit=50) == rebuilt.search(query, limit=50) == brute_force(names, query, 50)
+
+
+def test_repeated_word_matches_do_not_use_up_the_limit():
+    index = ProductSearchIndex(pd.DataFrame({"id": [1, 2, 3], "name": ["Zed Ab Ac", "Yy Ad", "Ab"]}))
+    assert index.search("a", limit=2) == [3, 1]
+    assert index.search("a", limit=3) == [3, 1, 2]
@@ -0,0 +1,46 @@
+import mmap
+import os
+
+import numpy as np
+
+from datagen import make_inventory
+from inventory_manager import load_inventory
+from snapshot import ColumnarSnapshot
+from storage import JsonStorage
+
+
+def _mapped(values):
+    # Whether the array's memory belongs to a memory-mapped file
+    base = values
+    while base is not None:
+        if isinstance(base, mmap.mmap):
+            return True
+        base = getattr(base, "base", None)
+    return False
+
+
+def test_checkout_keeps_the_inventory_snapshot_current(tmp_path):
+    snapshot = ColumnarSnapshot(os.path.join(tmp_path, "snapshot"))
+    storage = JsonStorage.in_directory(str(tmp_path), snapshot=snapshot)
+    storage.save_inventory(make_inventory(50, stock=20))
+    for n in range(1, 6):
+        storage.update_stock({n: 20 - n, 7: 20 - n, 999: 1})
+
+    df = snapshot.read_inventory(storage.inventory_file)
+    assert df is not None
+    expected = load_inventory(storage.inventory_file)
+    assert df["stock"].tolist() == expected["stock"].tolist()
+    assert df.drop(columns="stock").equals(expected.drop(columns="stock"))
+
+
+def test_snapshot_inventory_is_read_without_copying(tmp_path):
+    snapshot = ColumnarSnapshot(os.path.join(tmp_path, "snapshot"))
+    storage = JsonStorage.in_directory(str(tmp_path), snapshot=snapshot)
+    storage.save_inventory(make_inventory(50, stock=20))
+
+    df = JsonStorage.in_directory(str(tmp_path), snapshot=snapshot).load_inventory()
+    assert all(_mapped(df[column].to_numpy()) for column in ("id", "price", "stock", "popularity"))
+    # Copy-on-write: the app can edit its copy, the file doesn't change
+    df.at[0, "stock"] = 5
+    assert snapshot.read_inventory(storage.inventory_file)["stock"].tolist() == [20] * 50
+    assert np.array_equal(df["id"].to_numpy(), np.arange(1, 51))